@@ -1,22 +1,37 @@
 """HAProxy Manager - Flask Backend API"""
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import os
+import hmac
 from utils.auth import (
     init_db, authenticate_user, create_session,
     validate_session, destroy_session, require_auth,
-    hash_password
+    hash_password, create_stream_ticket, redeem_stream_ticket
 )
 from utils.haproxy import (
-    read_haproxy_stats, parse_haproxy_config,
-    write_haproxy_config, reload_haproxy, toggle_server,
-    get_haproxy_config_path, apply_config_and_restart,
-    list_config_backups, restore_backup, track_connection_history
+    read_filtered_stats, read_haproxy_config, STAT_TYPES,
+    write_haproxy_config, reload_haproxy, toggle_server, set_servers_state,
+    push_server_update, add_server_runtime, delete_server_runtime,
+    get_haproxy_config_path,
+    restore_backup, track_connection_history
 )
 from utils.database import (
-    get_db_connection, add_user, get_all_users, delete_user,
-    change_password, log_audit
+    get_db_connection, release_db_connection, add_user, delete_user,
+    change_password, attach_servers, log_audit, log_audit_many
 )
+from utils.list_query import (
+    ACTIVE_CONNECTIONS, BACKENDS, BACKUPS, FRONTENDS, USERS, ListQueryError, parse_fields, run_list_query
+)
+from utils.config_plan import plan_apply
+from utils.apply_queue import get_apply_queue, run_exclusive
+from utils.jobs import get_job_manager
+from utils.reload_metrics import get_reload_tracker
+from utils.stats_sampler import get_stats_sampler
+from utils.stats_history import get_stats_history, HISTORY_TYPES
+from utils.stats_snapshot import SNAPSHOT_FIELDS, get_sample_snapshot
+from utils.stats_parser import COUNTER_FIELDS
+from utils.stats_stream import get_stats_broadcaster
+from utils.metrics import get_metrics_renderer
 
 app = Flask(__name__)
 
@@ -31,6 +46,17 @@ CORS(app, origins=allowed_origins, supports_credentials=True)
 # Initialize database
 init_db()
 
+# Each thread keeps its database connection between requests; roll back
+# whatever a failed request left uncommitted
+@app.teardown_request
+def release_database(error):
+    release_db_connection()
+
+# Feed every stats sample into the in-memory history
+get_stats_sampler().add_listener(get_stats_history().record)
+# ...and push the changes to live /api/stats/stream clients
+get_stats_sampler().add_listener(get_stats_broadcaster().publish)
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -73,13 +99,25 @@ def logout():
 @app.route('/api/config', methods=['GET'])
 @require_auth
 def get_config():
-    """Get HAProxy configuration"""
-    config = parse_haproxy_config()
-
-    if 'error' in config:
-        return jsonify(config), 500
-
-    return jsonify(config), 200
+    """
+    Get HAProxy configuration.
+    The ETag is the config file's hash; polls sending it back in
+    If-None-Match get an empty 304 until the file changes.
+    """
+    result = read_haproxy_config()
+
+    if not result['success']:
+        return jsonify({'error': result['error']}), 500
+
+    etag = result['hash']
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = jsonify(result['config'])
+    response.set_etag(etag)
+    # Cached by the browser, but always revalidated
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @app.route('/api/config', methods=['POST'])
 @require_auth
@@ -116,14 +154,188 @@ def reload_config():
 @app.route('/api/stats', methods=['GET'])
 @require_auth
 def get_stats():
-    """Get HAProxy statistics"""
-    stats = read_haproxy_stats()
+    """
+    Get HAProxy statistics, aggregated over all admin endpoints.
+    Unfiltered requests are served from the shared sampled snapshot.
+    backend=, frontend= and type= (comma-separated frontend,backend,server)
+    are pushed down to HAProxy so only the matching rows are dumped.
+    breakdown=1 adds per-instance stats under 'instances'.
+    """
+    backend = request.args.get('backend')
+    frontend = request.args.get('frontend')
+    stat_types = [t for t in request.args.get('type', '').split(',') if t]
+    breakdown = request.args.get('breakdown', '').lower() in ('1', 'true', 'yes')
+
+    for stat_type in stat_types:
+        if stat_type not in STAT_TYPES:
+            return jsonify({'error': f'Invalid type: {stat_type}'}), 400
+
+    if backend or frontend or stat_types:
+        stats = read_filtered_stats(frontend=frontend, backend=backend, types=stat_types, breakdown=breakdown)
+        if stats.get('not_found'):
+            return jsonify({'error': stats['error']}), 404
+    else:
+        sample = get_stats_sampler().get_sample()
+        stats = sample['stats']
+        if breakdown and 'error' not in stats:
+            stats = dict(stats, instances={
+                name: instance['stats'] for name, instance in sample['instances'].items()
+            })
 
     if stats and 'error' in stats:
         return jsonify(stats), 500
 
     return jsonify(stats), 200
 
+@app.route('/api/stats/top', methods=['GET'])
+@require_auth
+def get_stats_top():
+    """
+    Get the frontends, backends or servers with the highest value of a field.
+    rate=1 ranks by per-second change since the previous sample instead
+    (counter fields only).
+    group=backend (servers only) ranks backends by the sum over their servers.
+    """
+    section = request.args.get('type', 'server') + 's'
+    field = request.args.get('field', 'sessions_current')
+    limit = min(max(request.args.get('n', 10, type=int), 1), 1000)
+    rate = request.args.get('rate', '').lower() in ('1', 'true', 'yes')
+    group = request.args.get('group')
+
+    if section not in SNAPSHOT_FIELDS:
+        return jsonify({'error': f"Invalid type: {request.args.get('type')}"}), 400
+    if field not in SNAPSHOT_FIELDS[section][0]:
+        return jsonify({'error': f'Invalid field: {field}'}), 400
+    if rate and field not in COUNTER_FIELDS:
+        return jsonify({'error': f'rate=1 needs a counter field, {field} is a gauge'}), 400
+    if group and (section != 'servers' or group != 'backend'):
+        return jsonify({'error': 'group=backend is only supported for servers'}), 400
+
+    sampler = get_stats_sampler()
+    sample = sampler.get_sample()
+    if 'error' in sample['stats']:
+        return jsonify(sample['stats']), 500
+
+    snapshot = get_sample_snapshot(sample)
+    previous = None
+    elapsed = None
+    if rate:
+        previous_sample = sampler.get_previous_sample()
+        if previous_sample is None:
+            return jsonify({'error': 'No previous sample yet, try again shortly'}), 503
+        previous = get_sample_snapshot(previous_sample)
+        elapsed = max(sample['timestamp'] - previous_sample['timestamp'], 0.001)
+
+    if group:
+        totals = snapshot.sum_by(section, field, group, previous=previous)
+        items = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:limit]
+    else:
+        items = snapshot.top(section, field, limit, previous=previous)
+
+    return jsonify({
+        'type': section[:-1],
+        'field': field,
+        'rate': rate,
+        'timestamp': sample['timestamp'],
+        'items': [
+            {'name': name, 'value': round(value / elapsed, 3) if elapsed else value}
+            for name, value in items
+        ]
+    }), 200
+
+@app.route('/api/stats/history', methods=['GET'])
+@require_auth
+def get_stats_history_view():
+    """
+    Get rate/gauge history (and window averages) for one frontend, backend or server.
+    name is a proxy name, or backend/server for servers; type defaults to
+    server for backend/server names and backend otherwise.
+    window and step are in seconds.
+    """
+    name = request.args.get('name')
+    if not name:
+        return jsonify({'error': 'name required'}), 400
+
+    entity_type = request.args.get('type') or ('server' if '/' in name else 'backend')
+    if entity_type not in HISTORY_TYPES:
+        return jsonify({'error': f'Invalid type: {entity_type}'}), 400
+
+    window = request.args.get('window', 3600, type=int)
+    step = request.args.get('step', type=int)
+    if window <= 0 or (step is not None and step <= 0):
+        return jsonify({'error': 'window and step must be positive'}), 400
+
+    history = get_stats_history()
+    # Make sure sampling is running so history starts filling up
+    get_stats_sampler().start()
+
+    window = min(window, int(history.capacity * history.resolution))
+    result = history.query(entity_type, name, window=window, step=step)
+
+    if result is None:
+        return jsonify({'error': f'No history for {entity_type} {name}'}), 404
+
+    return jsonify(result), 200
+
+@app.route('/api/stats/stream/ticket', methods=['POST'])
+@require_auth
+def create_stats_stream_ticket():
+    """Issue a single-use ticket for opening /api/stats/stream"""
+    return jsonify({'ticket': create_stream_ticket(request.username)}), 200
+
+@app.route('/api/stats/stream', methods=['GET'])
+def stream_stats():
+    """
+    Live stats as Server-Sent Events.
+    Sends a full 'snapshot' event first, then 'delta' events containing
+    only the rows and fields that changed since the previous sample.
+    EventSource cannot set headers, so auth uses a ticket from
+    /api/stats/stream/ticket.
+    """
+    username = redeem_stream_ticket(request.args.get('ticket', ''))
+    if not username:
+        return jsonify({'error': 'Invalid or expired stream ticket'}), 401
+
+    # Make sure there is a snapshot to start from
+    get_stats_sampler().get()
+
+    return Response(
+        get_stats_broadcaster().stream(),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            # Disable response buffering in nginx
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Prometheus exposition of every numeric 'show stat' and 'show info' field.
+    Authenticates with METRICS_TOKEN as a bearer token when it is set,
+    otherwise with a regular session token.
+    """
+    token = request.headers.get('Authorization', '')
+    if token.startswith('Bearer '):
+        token = token[7:]
+
+    metrics_token = os.getenv('METRICS_TOKEN')
+    if metrics_token:
+        if not hmac.compare_digest(token.encode(), metrics_token.encode()):
+            return jsonify({'error': 'Invalid metrics token'}), 401
+    elif not validate_session(token):
+        return jsonify({'error': 'Invalid or expired token'}), 401
+
+    sample = get_stats_sampler().get_sample()
+    if 'error' in sample['stats']:
+        return jsonify(sample['stats']), 503
+
+    return Response(
+        get_metrics_renderer().render(sample),
+        mimetype='text/plain; version=0.0.4'
+    )
+
 @app.route('/api/server/<backend>/<server>/toggle', methods=['POST'])
 @require_auth
 def toggle_server_status(backend, server):
@@ -150,14 +362,74 @@ def toggle_server_status(backend, server):
 
     return jsonify(result), 200
 
+@app.route('/api/servers/state', methods=['POST'])
+@require_auth
+def set_servers_state_bulk():
+    """
+    Change the runtime state of many servers at once.
+    Body: {"changes": [{"backend": ..., "server": ..., "state": ...}]} where
+    state is ready, drain, maint, enable or disable. All commands go over one
+    admin socket session and all audit entries are written together.
+    """
+    data = request.json
+    changes = data.get('changes') if data else None
+
+    if not isinstance(changes, list) or not changes:
+        return jsonify({'error': 'changes list required'}), 400
+    if not all(isinstance(change, dict) for change in changes):
+        return jsonify({'error': 'Each change must be an object'}), 400
+
+    result = set_servers_state(changes)
+
+    if result.get('invalid'):
+        return jsonify({'error': result['error']}), 400
+    if 'results' not in result:
+        return jsonify(result), 500
+
+    log_audit_many([
+        (
+            request.username,
+            'set_server_state',
+            'server',
+            f"{entry['backend']}/{entry['server']}",
+            f"state={entry['state']}" + ('' if entry['success'] else f", failed: {entry['response']}"),
+            request.remote_addr
+        )
+        for entry in result['results']
+    ])
+
+    return jsonify(result), 200
+
 # ============ User Management Endpoints ============
 
+def _list_response(key, spec, extra_fields=(), required_fields=(), decorate=None):
+    """
+    Response of a list endpoint: {key: items}, plus 'next_cursor' when
+    paginating. decorate(items, fields) may add the extra_fields;
+    required_fields are always queried so it can use them.
+    """
+    try:
+        fields = parse_fields(spec, request.args.get('fields'), extra_fields)
+        query_fields = fields
+        if decorate and set(extra_fields) & set(fields):
+            query_fields = fields + [field for field in required_fields if field not in fields]
+        items, next_cursor = run_list_query(spec, request.args, query_fields)
+    except ListQueryError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if decorate:
+        decorate(items, fields)
+
+    body = {key: items}
+    if request.args.get('limit') or request.args.get('cursor'):
+        body['next_cursor'] = next_cursor
+    return jsonify(body), 200
+
 @app.route('/api/users', methods=['GET'])
 @require_auth
 def list_users():
-    """List all users"""
-    users = get_all_users()
-    return jsonify({'users': users}), 200
+    """List users (paginated with limit/cursor, see list_query)"""
+    return _list_response('users', USERS)
 
 @app.route('/api/users', methods=['POST'])
 @require_auth
@@ -186,13 +458,15 @@ def create_user():
     if not success:
         return jsonify({'error': 'User already exists'}), 409
 
+    # Account changes are on disk before the response
     log_audit(
         request.username,
         'create_user',
         'user',
         username,
         None,
-        request.remote_addr
+        request.remote_addr,
+        sync=True
     )
 
     return jsonify({'success': True, 'username': username}), 201
@@ -215,7 +489,8 @@ def remove_user(username):
         'user',
         username,
         None,
-        request.remote_addr
+        request.remote_addr,
+        sync=True
     )
 
     return jsonify({'success': True}), 200
@@ -248,7 +523,8 @@ def update_password(username):
         'user',
         username,
         None,
-        request.remote_addr
+        request.remote_addr,
+        sync=True
     )
 
     return jsonify({'success': True}), 200
@@ -258,20 +534,8 @@ def update_password(username):
 @app.route('/api/frontends', methods=['GET'])
 @require_auth
 def list_frontends():
-    """List all frontend servers from database"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        SELECT id, name, bind_address, bind_port, mode, default_backend, enabled, created_at, updated_at
-        FROM frontend_servers
-        ORDER BY name
-    ''')
-
-    frontends = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-
-    return jsonify({'frontends': frontends}), 200
+    """List frontend servers from database (paginated with limit/cursor, see list_query)"""
+    return _list_response('frontends', FRONTENDS)
 
 @app.route('/api/frontends', methods=['POST'])
 @require_auth
@@ -415,34 +679,19 @@ def delete_frontend(frontend_id):
 @app.route('/api/backends', methods=['GET'])
 @require_auth
 def list_backends():
-    """List all backend servers with their server lists"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        SELECT id, name, mode, balance, enabled, created_at, updated_at
-        FROM backend_servers
-        ORDER BY name
-    ''')
-
-    backends = []
-    for row in cursor.fetchall():
-        backend = dict(row)
-
-        # Get servers for this backend
-        cursor.execute('''
-            SELECT id, server_name, address, port, enabled, weight, maxconn, check_enabled
-            FROM backend_server_list
-            WHERE backend_name = ?
-            ORDER BY server_name
-        ''', (backend['name'],))
-
-        backend['servers'] = [dict(s) for s in cursor.fetchall()]
-        backends.append(backend)
-
-    conn.close()
-
-    return jsonify({'backends': backends}), 200
+    """
+    List backend servers with their server lists (paginated with
+    limit/cursor, see list_query). 'servers' is a field like the others.
+    """
+    def add_servers(backends, fields):
+        if 'servers' in fields:
+            attach_servers(backends)
+            if 'name' not in fields:
+                for backend in backends:
+                    del backend['name']
+
+    return _list_response('backends', BACKENDS, extra_fields=('servers',), required_fields=('name',),
+                          decorate=add_servers)
 
 @app.route('/api/backends', methods=['POST'])
 @require_auth
@@ -514,16 +763,31 @@ def update_backend(backend_id):
         update_fields.append('updated_at = CURRENT_TIMESTAMP')
         params.append(backend_id)
 
+        cursor.execute('SELECT name FROM backend_servers WHERE id = ?', (backend_id,))
+        row = cursor.fetchone()
+
+        if not row:
+            return jsonify({'error': 'Backend not found'}), 404
+
+        renamed = 'name' in data and data['name'] != row['name']
+        if renamed:
+            # The servers reference the backend by name: rename both, with the
+            # foreign key checked at commit
+            cursor.execute('PRAGMA defer_foreign_keys = ON')
+
         cursor.execute(f'''
             UPDATE backend_servers
             SET {', '.join(update_fields)}
             WHERE id = ?
         ''', params)
 
-        conn.commit()
+        if renamed:
+            cursor.execute(
+                'UPDATE backend_server_list SET backend_name = ? WHERE backend_name = ?',
+                (data['name'], row['name'])
+            )
 
-        if cursor.rowcount == 0:
-            return jsonify({'error': 'Backend not found'}), 404
+        conn.commit()
 
         log_audit(
             request.username,
@@ -582,44 +846,91 @@ def delete_backend(backend_id):
 @app.route('/api/backends/<backend_name>/servers', methods=['POST'])
 @require_auth
 def add_backend_server(backend_name):
-    """Add a server to a backend"""
+    """
+    Add a server to a backend.
+    With "runtime": true the server is first added to the running HAProxy
+    ('add server') without a reload; if that fails nothing is saved.
+    """
     data = request.json
 
     if not data or 'server_name' not in data or 'address' not in data or 'port' not in data:
         return jsonify({'error': 'server_name, address, and port required'}), 400
 
+    server = {
+        'server_name': data['server_name'],
+        'address': data['address'],
+        'port': data['port'],
+        'enabled': data.get('enabled', 1),
+        'weight': data.get('weight', 1),
+        'maxconn': data.get('maxconn', 32),
+        'check_enabled': data.get('check_enabled', 1)
+    }
+
     conn = get_db_connection()
     cursor = conn.cursor()
 
     try:
-        cursor.execute('''
-            INSERT INTO backend_server_list
-            (backend_name, server_name, address, port, enabled, weight, maxconn, check_enabled)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            backend_name,
-            data['server_name'],
-            data['address'],
-            data['port'],
-            data.get('enabled', 1),
-            data.get('weight', 1),
-            data.get('maxconn', 32),
-            data.get('check_enabled', 1)
-        ))
+        # Everything that can be checked is checked before talking to
+        # HAProxy, and no transaction is open while we do
+        cursor.execute('SELECT enabled FROM backend_servers WHERE name = ?', (backend_name,))
+        backend = cursor.fetchone()
+        if not backend:
+            return jsonify({'error': 'Backend not found'}), 404
 
-        conn.commit()
-        server_id = cursor.lastrowid
+        cursor.execute('SELECT 1 FROM backend_server_list WHERE backend_name = ? AND server_name = ?',
+                       (backend_name, server['server_name']))
+        if cursor.fetchone():
+            return jsonify({'error': f"Server {server['server_name']} already exists in {backend_name}"}), 409
+
+        runtime = {'commands': []}
+        # Only enabled servers of enabled backends belong in the running config
+        if data.get('runtime') and backend['enabled'] and server['enabled']:
+            runtime = add_server_runtime(backend_name, server)
+            if not runtime['success']:
+                return jsonify({'error': f"Runtime add failed: {runtime['error']}"}), 500
+
+        try:
+            cursor.execute('''
+                INSERT INTO backend_server_list
+                (backend_name, server_name, address, port, enabled, weight, maxconn, check_enabled)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                backend_name,
+                server['server_name'],
+                server['address'],
+                server['port'],
+                server['enabled'],
+                server['weight'],
+                server['maxconn'],
+                server['check_enabled']
+            ))
+            server_id = cursor.lastrowid
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            if runtime['commands']:
+                # Not saved: take the server out of HAProxy again
+                delete_server_runtime(backend_name, server['server_name'])
+            raise
 
         log_audit(
             request.username,
             'add_backend_server',
             'backend_server',
             f"{backend_name}/{data['server_name']}",
-            f"address={data['address']}:{data['port']}",
+            f"address={data['address']}:{data['port']}" + (' (applied at runtime)' if runtime['commands'] else ''),
             request.remote_addr
         )
 
-        return jsonify({'success': True, 'id': server_id}), 201
+        result = {
+            'success': True,
+            'id': server_id,
+            'runtime_commands': runtime['commands'],
+            'requires_apply': not runtime['commands']
+        }
+        if 'warning' in runtime:
+            result['warning'] = runtime['warning']
+        return jsonify(result), 201
 
     except Exception as e:
         conn.rollback()
@@ -630,7 +941,14 @@ def add_backend_server(backend_name):
 @app.route('/api/backends/<backend_name>/servers/<int:server_id>', methods=['PUT'])
 @require_auth
 def update_backend_server(backend_name, server_id):
-    """Update a backend server (e.g., enable/disable)"""
+    """
+    Update a backend server (e.g., enable/disable, weight, address).
+    Changes to a running server are pushed to HAProxy through the runtime
+    API first; if HAProxy rejects them nothing is saved. If HAProxy is not
+    reachable or does not run the server yet, only the DB is changed.
+    requires_apply in the response tells whether a full apply is still
+    needed (e.g. for enabling a server that is not in the running config).
+    """
     data = request.json
 
     if not data:
@@ -640,14 +958,29 @@ def update_backend_server(backend_name, server_id):
     cursor = conn.cursor()
 
     try:
+        cursor.execute('''
+            SELECT s.*, b.enabled AS backend_enabled
+            FROM backend_server_list s
+            JOIN backend_servers b ON b.name = s.backend_name
+            WHERE s.id = ? AND s.backend_name = ?
+        ''', (server_id, backend_name))
+        row = cursor.fetchone()
+
+        if not row:
+            return jsonify({'error': 'Server not found'}), 404
+
+        old = dict(row)
+        new = dict(old)
+
         # Build update query dynamically
         update_fields = []
         params = []
 
-        for field in ['enabled', 'weight', 'maxconn', 'check_enabled']:
+        for field in ['enabled', 'weight', 'maxconn', 'check_enabled', 'address', 'port']:
             if field in data:
                 update_fields.append(f'{field} = ?')
                 params.append(data[field])
+                new[field] = data[field]
 
         if not update_fields:
             return jsonify({'error': 'No fields to update'}), 400
@@ -655,15 +988,39 @@ def update_backend_server(backend_name, server_id):
         update_fields.append('updated_at = CURRENT_TIMESTAMP')
         params.extend([server_id, backend_name])
 
-        cursor.execute(f'''
-            UPDATE backend_server_list
-            SET {', '.join(update_fields)}
-            WHERE id = ? AND backend_name = ?
-        ''', params)
-
-        conn.commit()
-
-        if cursor.rowcount == 0:
+        # HAProxy first, with no transaction open while we wait for it.
+        # Only enabled servers of enabled backends are in the running config
+        if old['backend_enabled'] and old['enabled']:
+            runtime = push_server_update(backend_name, old, new)
+        else:
+            runtime = {
+                'success': True,
+                'commands': [],
+                'requires_apply': bool(new['enabled']) != bool(old['enabled'])
+            }
+
+        if not runtime['success']:
+            return jsonify({'error': f"Runtime update failed: {runtime['error']}"}), 500
+
+        try:
+            cursor.execute(f'''
+                UPDATE backend_server_list
+                SET {', '.join(update_fields)}
+                WHERE id = ? AND backend_name = ?
+            ''', params)
+            updated = cursor.rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            if runtime['commands']:
+                # Not saved: put the running server back as it was
+                push_server_update(backend_name, new, old)
+            raise
+
+        if not updated:
+            # Deleted meanwhile
+            if runtime['commands']:
+                push_server_update(backend_name, new, old)
             return jsonify({'error': 'Server not found'}), 404
 
         log_audit(
@@ -671,11 +1028,19 @@ def update_backend_server(backend_name, server_id):
             'update_backend_server',
             'backend_server',
             f"{backend_name}/{server_id}",
-            f"enabled={data.get('enabled')}",
+            ', '.join(f'{field}={new[field]}' for field in data if field in new) +
+            (' (applied at runtime)' if runtime['commands'] else ''),
             request.remote_addr
         )
 
-        return jsonify({'success': True}), 200
+        result = {
+            'success': True,
+            'runtime_commands': runtime['commands'],
+            'requires_apply': runtime['requires_apply']
+        }
+        if 'warning' in runtime:
+            result['warning'] = runtime['warning']
+        return jsonify(result), 200
 
     except Exception as e:
         conn.rollback()
@@ -686,14 +1051,23 @@ def update_backend_server(backend_name, server_id):
 @app.route('/api/backends/<backend_name>/servers/<int:server_id>', methods=['DELETE'])
 @require_auth
 def remove_backend_server(backend_name, server_id):
-    """Remove a server from a backend"""
+    """
+    Remove a server from a backend.
+    With ?runtime=1 the server is also deleted from the running HAProxy
+    ('disable server' then 'del server') without a reload; if that fails
+    (e.g. it still has connections) the server is kept.
+    """
+    runtime_requested = request.args.get('runtime', '').lower() in ('1', 'true', 'yes')
+
     conn = get_db_connection()
     cursor = conn.cursor()
 
     try:
         cursor.execute('''
-            SELECT server_name FROM backend_server_list
-            WHERE id = ? AND backend_name = ?
+            SELECT s.*, b.enabled AS backend_enabled
+            FROM backend_server_list s
+            JOIN backend_servers b ON b.name = s.backend_name
+            WHERE s.id = ? AND s.backend_name = ?
         ''', (server_id, backend_name))
 
         row = cursor.fetchone()
@@ -703,19 +1077,40 @@ def remove_backend_server(backend_name, server_id):
 
         server_name = row['server_name']
 
-        cursor.execute('DELETE FROM backend_server_list WHERE id = ?', (server_id,))
-        conn.commit()
+        # HAProxy first, with no transaction open while we wait for it
+        runtime = {'commands': []}
+        if runtime_requested and row['backend_enabled'] and row['enabled']:
+            runtime = delete_server_runtime(backend_name, server_name)
+            if not runtime['success']:
+                return jsonify({'error': f"Runtime delete failed: {runtime['error']}"}), 500
+
+        try:
+            cursor.execute('DELETE FROM backend_server_list WHERE id = ?', (server_id,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            if runtime['commands']:
+                # Still saved: put the server back into HAProxy
+                add_server_runtime(backend_name, row)
+            raise
 
         log_audit(
             request.username,
             'remove_backend_server',
             'backend_server',
             f"{backend_name}/{server_name}",
-            None,
+            'applied at runtime' if runtime['commands'] else None,
             request.remote_addr
         )
 
-        return jsonify({'success': True}), 200
+        result = {
+            'success': True,
+            'runtime_commands': runtime['commands'],
+            'requires_apply': not runtime['commands']
+        }
+        if 'warning' in runtime:
+            result['warning'] = runtime['warning']
+        return jsonify(result), 200
 
     except Exception as e:
         conn.rollback()
@@ -759,29 +1154,53 @@ def get_connection_history():
 @app.route('/api/connections/active', methods=['GET'])
 @require_auth
 def get_active_connections():
-    """Get currently active connections (no disconnect time)"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        SELECT * FROM connection_history
-        WHERE disconnected_at IS NULL
-        ORDER BY connected_at DESC
-    ''')
-
-    connections = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-
-    return jsonify({'connections': connections}), 200
+    """Get currently active connections, newest first (paginated with limit/cursor, see list_query)"""
+    return _list_response('connections', ACTIVE_CONNECTIONS)
 
 # ============ HAProxy Config Management ============
 
+@app.route('/api/haproxy/plan', methods=['GET'])
+@require_auth
+def get_apply_plan():
+    """Dry run of /api/haproxy/apply: what would change and how it would be applied"""
+    plan = plan_apply()
+    if not plan.get('success'):
+        return jsonify(plan), 500
+
+    for change in plan['changes']:
+        change['commands'] = [command for command, _, _ in change.pop('steps')]
+    if request.args.get('config', '').lower() not in ('1', 'true', 'yes'):
+        plan.pop('config')
+
+    return jsonify(plan), 200
+
+def _wants_sync():
+    """Whether the caller asked to wait for the result instead of a job (?sync=1)"""
+    return request.args.get('sync', '').lower() in ('1', 'true', 'yes')
+
+def _job_response(job):
+    """202 response pointing at a background job"""
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': f'/api/jobs/{job.id}'
+    }), 202
+
 @app.route('/api/haproxy/apply', methods=['POST'])
 @require_auth
 def apply_and_restart():
-    """Apply current database config to HAProxy and restart"""
+    """
+    Apply current database config to HAProxy, reloading only when needed.
+    Runs as a background job (202 with its id) unless ?sync=1 is given.
+    """
+    if not _wants_sync():
+        job = get_job_manager().submit('apply', request.username, get_apply_queue().submit,
+                                       request.username, request.remote_addr)
+        return _job_response(job)
+
     try:
-        result = apply_config_and_restart(request.username, request.remote_addr)
+        result = get_apply_queue().submit(request.username, request.remote_addr)
 
         if not result.get('success'):
             return jsonify(result), 500
@@ -791,19 +1210,41 @@ def apply_and_restart():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@require_auth
+def get_job(job_id):
+    """Status, per-phase timings and (once finished) result of a background job"""
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict()), 200
+
+@app.route('/api/haproxy/reloads', methods=['GET'])
+@require_auth
+def get_reloads():
+    """Listener downtime and drain time of recent reloads, newest first"""
+    return jsonify({'reloads': get_reload_tracker().recent()}), 200
+
 @app.route('/api/haproxy/backups', methods=['GET'])
 @require_auth
 def get_config_backups():
-    """List all configuration backups"""
-    backups = list_config_backups()
-    return jsonify({'backups': backups}), 200
+    """List configuration backups, newest first (paginated with limit/cursor, see list_query)"""
+    return _list_response('backups', BACKUPS)
 
 @app.route('/api/haproxy/backups/<int:backup_id>/restore', methods=['POST'])
 @require_auth
 def restore_config_backup(backup_id):
-    """Restore a configuration backup"""
+    """
+    Restore a configuration backup.
+    Runs as a background job (202 with its id) unless ?sync=1 is given.
+    """
+    if not _wants_sync():
+        job = get_job_manager().submit('restore', request.username, run_exclusive, restore_backup,
+                                       backup_id, request.username, request.remote_addr)
+        return _job_response(job)
+
     try:
-        result = restore_backup(backup_id, request.username, request.remote_addr)
+        result = run_exclusive(restore_backup, backup_id, request.username, request.remote_addr)
 
         if not result.get('success'):
             return jsonify(result), 500
@@ -0,0 +1,97 @@
+"""Benchmark: audit logging cost on the request path
+
+Compares the previous log_audit(), a connection, an insert and a commit
+per event, with the queued writer: the time callers spend per event, the
+commits needed for a bulk operation, and sync=True callers on several
+threads sharing commits.
+
+Usage (from backend/):
+    python -m benchmarks.bench_audit_log [--events N] [--threads N]
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from utils.audit_log import get_audit_writer
+from utils.database import init_database, log_audit, log_audit_many
+
+
+def legacy_log_audit(username, action, resource_type, resource_name=None, details=None, ip_address=None):
+    """The previous log_audit()"""
+    conn = sqlite3.connect(os.environ['DATABASE_PATH'])
+    conn.execute('''
+        INSERT INTO audit_log (username, action, resource_type, resource_name, details, ip_address)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (username, action, resource_type, resource_name, details, ip_address))
+    conn.commit()
+    conn.close()
+
+
+def timed(func):
+    started = time.perf_counter()
+    func()
+    return time.perf_counter() - started
+
+
+def on_threads(count, func):
+    threads = [threading.Thread(target=func) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+    events = args.events
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ['DATABASE_PATH'] = os.path.join(directory, 'bench.db')
+        init_database()
+        writer = get_audit_writer()
+
+        def legacy_loop():
+            for i in range(events):
+                legacy_log_audit('bench', 'toggle_server', 'server', f'web/srv{i}', 'enabled=True', '127.0.0.1')
+
+        def async_loop():
+            for i in range(events):
+                log_audit('bench', 'toggle_server', 'server', f'web/srv{i}', 'enabled=True', '127.0.0.1')
+
+        def sync_loop():
+            for i in range(events // args.threads):
+                log_audit('bench', 'change_password', 'user', f'user{i}', None, '127.0.0.1', sync=True)
+
+        print(f'{"":>22}  {"before":>11}  {"after":>11}')
+        legacy = timed(legacy_loop)
+        queued = timed(async_loop)
+        writer.flush()
+        print(f'{"per event":>22}  {legacy / events * 1e6:8.1f} us  {queued / events * 1e6:8.1f} us'
+              f'  {legacy / queued:6.1f}x')
+
+        batches = writer.batches
+        bulk = timed(lambda: log_audit_many(
+            [('bench', 'set_server_state', 'server', f'web/srv{i}', 'state=drain', None) for i in range(events)],
+            sync=True
+        ))
+        print(f'{"bulk, commits":>22}  {events:11d}  {writer.batches - batches:11d}  ({bulk * 1000:.1f} ms)')
+
+        batches = writer.batches
+        legacy_threads = timed(lambda: on_threads(args.threads, lambda: [
+            legacy_log_audit('bench', 'change_password', 'user', f'user{i}') for i in range(events // args.threads)
+        ]))
+        sync_threads = timed(lambda: on_threads(args.threads, sync_loop))
+        print(f'{"sync, " + str(args.threads) + " threads":>22}  {legacy_threads * 1000:8.1f} ms  '
+              f'{sync_threads * 1000:8.1f} ms  {legacy_threads / sync_threads:6.1f}x'
+              f'  ({writer.batches - batches} commits for {events // args.threads * args.threads} events)')
+        writer.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""Benchmark: backend listing and config rendering at 5k backends x 20 servers
+
+Compares the previous one-query-per-backend implementations of
+GET /api/backends and render_config_from_db() with the single ordered
+query grouped in one pass. The render is timed with an empty fragment
+cache, so every backend's servers are read; a warm render is shown too.
+
+Usage (from backend/):
+    python -m benchmarks.bench_backend_queries [--backends N] [--servers N] [--repeat N]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import utils.config_render as config_render
+from utils.database import get_backends_with_servers, get_db_connection, init_database
+from utils.haproxy import format_server_options, render_config_from_db
+
+
+def seed(num_backends, servers_per_backend):
+    """Fill a fresh database with backends, their servers and a few frontends"""
+    init_database()
+    conn = get_db_connection()
+    conn.executemany(
+        'INSERT INTO frontend_servers (name, bind_address, bind_port, mode, default_backend) VALUES (?, ?, ?, ?, ?)',
+        [(f'fe_{f}', '*', 8000 + f, 'tcp', f'backend_{f}') for f in range(max(num_backends // 100, 1))]
+    )
+    conn.executemany(
+        'INSERT INTO backend_servers (name, mode, balance) VALUES (?, ?, ?)',
+        [(f'backend_{b}', 'tcp', 'leastconn' if b % 4 == 0 else 'roundrobin') for b in range(num_backends)]
+    )
+    conn.executemany(
+        'INSERT INTO backend_server_list (backend_name, server_name, address, port, enabled, weight, maxconn, check_enabled)'
+        ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        [(f'backend_{b}', f'srv_{s}', f'10.{b % 250}.{b // 250 % 250}.{s}', 80, int(s % 10 != 9),
+          s % 3 + 1, 32 if s % 5 else 64, int(s % 2 == 0))
+         for b in range(num_backends) for s in range(servers_per_backend)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def legacy_list_backends():
+    """The previous GET /api/backends query loop"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    cursor.execute('''
+        SELECT id, name, mode, balance, enabled, created_at, updated_at
+        FROM backend_servers
+        ORDER BY name
+    ''')
+
+    backends = []
+    for row in cursor.fetchall():
+        backend = dict(row)
+        cursor.execute('''
+            SELECT id, server_name, address, port, enabled, weight, maxconn, check_enabled
+            FROM backend_server_list
+            WHERE backend_name = ?
+            ORDER BY server_name
+        ''', (backend['name'],))
+        backend['servers'] = [dict(s) for s in cursor.fetchall()]
+        backends.append(backend)
+
+    conn.close()
+    return backends
+
+
+def legacy_render():
+    """The previous backend loop of render_config_from_db()"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    config_lines = []
+
+    cursor.execute('SELECT * FROM backend_servers WHERE enabled = 1 ORDER BY name')
+    for backend in cursor.fetchall():
+        config_lines.append(f'backend {backend["name"]}')
+        config_lines.append(f'    mode {backend["mode"]}')
+        config_lines.append(f'    balance {backend["balance"]}')
+        cursor.execute('''
+            SELECT * FROM backend_server_list
+            WHERE backend_name = ? AND enabled = 1
+            ORDER BY server_name
+        ''', (backend['name'],))
+        for server in cursor.fetchall():
+            options_str = format_server_options(server)
+            config_lines.append(f'    server {server["server_name"]} {server["address"]}:{server["port"]} {options_str}'.strip())
+        config_lines.append('')
+
+    conn.close()
+    return '\n'.join(config_lines)
+
+
+def cold_render():
+    """render_config_from_db() with an empty fragment cache"""
+    config_render._renderer = config_render.ConfigRenderer()
+    return render_config_from_db()
+
+
+def best_of(func, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backends', type=int, default=5000)
+    parser.add_argument('--servers', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ['DATABASE_PATH'] = os.path.join(directory, 'bench.db')
+        seed(args.backends, args.servers)
+        print(f'{args.backends} backends x {args.servers} servers')
+
+        legacy_list_time, legacy_list = best_of(legacy_list_backends, args.repeat)
+        list_time, backends = best_of(get_backends_with_servers, args.repeat)
+        assert legacy_list == backends, 'backend listings differ'
+
+        legacy_render_time, legacy_text = best_of(legacy_render, args.repeat)
+        render_time, text = best_of(cold_render, args.repeat)
+        warm_time, warm_text = best_of(render_config_from_db, args.repeat)
+        assert text == warm_text and text.endswith(legacy_text), 'rendered configs differ'
+
+    rows = (
+        ('list backends', legacy_list_time, list_time),
+        ('render (cold)', legacy_render_time, render_time),
+        ('render (warm)', legacy_render_time, warm_time),
+    )
+    print(f'{"":>14}  {"before":>10}  {"after":>10}')
+    for label, before, after in rows:
+        print(f'{label:>14}  {before * 1000:7.1f} ms  {after * 1000:7.1f} ms  {before / after:6.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""Benchmark: HAProxy config parsing at 50k lines
+
+Compares the previous regex-based parse_haproxy_config_text() with the
+single-pass tokenizing parser, on a generated config with thousands of
+backends, comments and a listen section.
+
+Usage (from backend/):
+    python -m benchmarks.bench_config_parser [--lines N] [--repeat N]
+"""
+import argparse
+import re
+import time
+
+from utils.haproxy import parse_haproxy_config_text
+
+
+def generate_config(num_lines, servers_per_backend=16):
+    """Build a config of roughly num_lines lines"""
+    lines = [
+        '# Generated for benchmarking',
+        'global',
+        '    log /dev/log local0',
+        '    stats socket /run/haproxy/admin.sock mode 660 level admin expose-fd listeners',
+        '    stats timeout 30s',
+        '    daemon',
+        '',
+        'defaults',
+        '    mode    http',
+        '    option  httplog',
+        '    timeout connect 5000',
+        '    timeout client  50000',
+        '    timeout server  50000',
+        '',
+    ]
+
+    num_backends = max(num_lines // (servers_per_backend + 6), 1)
+    num_frontends = max(num_backends // 50, 1)
+    for f in range(num_frontends):
+        lines.extend([
+            f'frontend fe_{f}',
+            f'    bind *:{8000 + f}',
+            '    mode http',
+            f'    default_backend backend_{f * 50}  # first backend of this block',
+            '',
+        ])
+
+    for b in range(num_backends):
+        lines.extend([
+            f'backend backend_{b}',
+            '    mode http',
+            '    balance roundrobin',
+            '    # servers',
+        ])
+        for s in range(servers_per_backend):
+            weight = f' weight {s % 5 + 1}' if s % 3 == 0 else ''
+            lines.append(f'    server srv_{s} 10.{b % 250}.{s}.{b // 250 % 250}:80 check{weight}')
+        lines.append('')
+
+    lines.extend([
+        'listen stats',
+        '    bind 127.0.0.1:8404',
+        '    stats enable',
+        '    stats uri /stats',
+        '',
+    ])
+    return '\n'.join(lines)
+
+
+def legacy_parse(content):
+    """The previous parse_haproxy_config_text()"""
+    config = {'frontends': [], 'backends': [], 'global': '', 'defaults': ''}
+
+    global_match = re.search(r'^global\s+(.*?)(?=\n\S|\Z)', content, re.DOTALL | re.MULTILINE)
+    if global_match:
+        config['global'] = global_match.group(1).strip()
+
+    defaults_match = re.search(r'^defaults\s+(.*?)(?=\nfrontend|\nbackend|\nlisten|\Z)', content, re.DOTALL | re.MULTILINE)
+    if defaults_match:
+        config['defaults'] = defaults_match.group(1).strip()
+
+    frontend_pattern = r'^frontend\s+(\S+)\s+(.*?)(?=\nfrontend|\nbackend|\nlisten|\Z)'
+    for match in re.finditer(frontend_pattern, content, re.DOTALL | re.MULTILINE):
+        body = match.group(2).strip()
+        backend_match = re.search(r'default_backend\s+(\S+)', body)
+        config['frontends'].append({
+            'name': match.group(1),
+            'binds': re.findall(r'bind\s+([^\n]+)', body),
+            'default_backend': backend_match.group(1) if backend_match else '',
+            'config': body
+        })
+
+    backend_pattern = r'^backend\s+(\S+)\s+(.*?)(?=\nfrontend|\nbackend|\nlisten|\Z)'
+    for match in re.finditer(backend_pattern, content, re.DOTALL | re.MULTILINE):
+        body = match.group(2).strip()
+        balance_match = re.search(r'balance\s+(\S+)', body)
+        servers = []
+        for server_match in re.finditer(r'server\s+(\S+)\s+([^:\s]+):(\d+)(.*)$', body, re.MULTILINE):
+            servers.append({
+                'name': server_match.group(1),
+                'host': server_match.group(2),
+                'port': server_match.group(3),
+                'options': server_match.group(4).strip()
+            })
+        config['backends'].append({
+            'name': match.group(1),
+            'balance': balance_match.group(1) if balance_match else 'roundrobin',
+            'servers': servers,
+            'config': body
+        })
+
+    return config
+
+
+def best_of(func, content, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(content)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    content = generate_config(args.lines)
+    lines = content.count('\n') + 1
+    print(f'{lines} lines, {len(content) / 1024 / 1024:.1f} MiB')
+
+    legacy_time, legacy = best_of(legacy_parse, content, args.repeat)
+    tokenized_time, tokenized = best_of(parse_haproxy_config_text, content, args.repeat)
+
+    # The new parser adds line numbers and listen/other sections; everything
+    # the legacy parser returned must match
+    assert legacy['global'] == tokenized['global'], 'parsers disagree'
+    assert legacy['defaults'] == tokenized['defaults'], 'parsers disagree'
+    for section in ('frontends', 'backends'):
+        assert len(legacy[section]) == len(tokenized[section]), 'parsers disagree'
+        for old, new in zip(legacy[section], tokenized[section]):
+            new = dict(new, servers=[{k: v for k, v in s.items() if k != 'line'} for s in new.get('servers', [])])
+            assert all(new[key] == value for key, value in old.items()), 'parsers disagree'
+    assert tokenized['listens'] and tokenized['listens'][0]['name'] == 'stats'
+
+    for label, elapsed in (('legacy', legacy_time), ('tokenized', tokenized_time)):
+        print(f'{label:>10}: {elapsed * 1000:8.1f} ms  {lines / elapsed:12,.0f} lines/s')
+    print(f'   speedup: {legacy_time / tokenized_time:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Benchmark: memory of the retained stats at 10k servers x 720 samples
+
+Fills the stats history with a full ring of samples and reports what it
+holds, then the cost of recording one sample. The previous per-entity
+history (12 preallocated float32 rings per server, every slot reset on
+every sample) is shown for comparison; its memory is allocated on the
+first samples, so a few are enough to measure it.
+
+Usage (from backend/):
+    python -m benchmarks.bench_stats_memory [--servers N] [--samples N] [--fields a,b]
+"""
+import argparse
+import copy
+import time
+import tracemalloc
+
+from benchmarks.bench_stats_parser import generate_csv
+from utils.stats_history import StatsHistory
+from utils.stats_parser import StatCsvParser
+from utils.stats_snapshot import StatsSnapshot
+
+# Counters that move between samples, and by how much per step
+MOVING = (('sessions_total', 7), ('bytes_in', 4096), ('bytes_out', 65536), ('requests_total', 11))
+
+
+def base_stats(num_servers):
+    parser = StatCsvParser()
+    parser.feed(generate_csv(num_servers))
+    return parser.close()
+
+
+def advance(stats, step):
+    """Move the counters of every row forward"""
+    for section in ('frontends', 'backends', 'servers'):
+        for i, row in enumerate(stats[section]):
+            for field, increment in MOVING:
+                if field in row:
+                    row[field] += increment * (1 + (i + step) % 5)
+            row['sessions_current'] = (i + step) % 20
+
+
+def measure(func):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = func()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+class LegacyHistory(StatsHistory):
+    """Allocation of the previous history: one ring per field per entity"""
+
+    def __init__(self, capacity, resolution):
+        super().__init__(capacity, resolution)
+        self.series = {}
+
+    def record(self, stats, timestamp=None):
+        from array import array
+        nan = float('nan')
+        for entity_type, section in (('frontend', 'frontends'), ('backend', 'backends'), ('server', 'servers')):
+            for row in stats[section]:
+                name = f"{row['backend']}/{row['name']}" if section == 'servers' else row['name']
+                key = (entity_type, name)
+                if key not in self.series:
+                    self.series[key] = {field: array('f', [nan]) * self.capacity
+                                        for field in self.fields(entity_type)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--servers', type=int, default=10000)
+    parser.add_argument('--samples', type=int, default=720)
+    parser.add_argument('--fields', help='STATS_HISTORY_FIELDS')
+    args = parser.parse_args()
+    fields = set(args.fields.split(',')) if args.fields else None
+
+    stats = base_stats(args.servers)
+
+    def legacy_fill():
+        legacy = LegacyHistory(args.samples, 5)
+        legacy.record(stats)
+        return legacy
+
+    _, legacy_bytes = measure(legacy_fill)
+
+    history = StatsHistory(capacity=args.samples, resolution=5, fields=fields)
+
+    def fill():
+        for step in range(args.samples):
+            advance(stats, step)
+            history.record(stats, 1000 + step * 5)
+
+    _, history_bytes = measure(fill)
+
+    advance(stats, args.samples)
+    started = time.perf_counter()
+    history.record(stats, 1000 + args.samples * 5)
+    record_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    history.query('server', 'backend_0/server_0', window=args.samples * 5, now=1000 + args.samples * 5)
+    query_time = time.perf_counter() - started
+
+    _, rows_bytes = measure(lambda: copy.deepcopy(stats))
+    _, snapshot_bytes = measure(lambda: StatsSnapshot.from_stats(stats))
+
+    print(f'{args.servers} servers x {args.samples} samples, fields: {args.fields or "all"}')
+    print(f'{"":>22}  {"before":>11}  {"after":>11}')
+    print(f'{"history":>22}  {legacy_bytes / 2 ** 20:8.1f} MB  {history_bytes / 2 ** 20:8.1f} MB')
+    print(f'{"record one sample":>22}  {"":>11}  {record_time * 1000:8.1f} ms')
+    print(f'{"query one server":>22}  {"":>11}  {query_time * 1000:8.1f} ms')
+    print(f'{"previous sample":>22}  {rows_bytes / 2 ** 20:8.1f} MB  {snapshot_bytes / 2 ** 20:8.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
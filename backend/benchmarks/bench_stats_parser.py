@@ -0,0 +1,169 @@
+"""Benchmark: 'show stat' CSV parsing at 10k servers
+
+Compares the previous parse-everything implementation of
+read_haproxy_stats() with the streaming StatCsvParser (which also converts
+the latency, error and HTTP status columns and derives ratios).
+
+Usage (from backend/):
+    python -m benchmarks.bench_stats_parser [--servers N] [--repeat N]
+"""
+import argparse
+import time
+
+from utils.stats_parser import StatCsvParser
+
+HEADER = (
+    'pxname,svname,qcur,qmax,scur,smax,slim,stot,bin,bout,dreq,dresp,ereq,econ,eresp,'
+    'wretr,wredis,status,weight,act,bck,chkfail,chkdown,lastchg,downtime,qlimit,pid,iid,'
+    'sid,throttle,lbtot,tracked,type,rate,rate_lim,rate_max,check_status,check_code,'
+    'check_duration,hrsp_1xx,hrsp_2xx,hrsp_3xx,hrsp_4xx,hrsp_5xx,hrsp_other,hanafail,'
+    'req_rate,req_rate_max,req_tot,cli_abrt,srv_abrt,comp_in,comp_out,comp_byp,comp_rsp,'
+    'lastsess,last_chk,last_agt,qtime,ctime,rtime,ttime,agent_status,agent_code,'
+    'agent_duration,check_desc,agent_desc,check_rise,check_fall,check_health,agent_rise,'
+    'agent_fall,agent_health,addr,cookie,mode,algo,conn_rate,conn_rate_max,conn_tot,'
+    'intercepted,dcon,dses,wrew,connect,reuse,cache_lookups,cache_hits,srv_icur,src_ilim,'
+    'qtime_max,ctime_max,rtime_max,ttime_max,eint,idle_conn_cur,safe_conn_cur,'
+    'used_conn_cur,need_conn_est,uweight,agg_server_status,agg_server_check_status,'
+    'agg_check_status'
+).split(',')
+
+
+def generate_csv(num_servers, servers_per_backend=20):
+    """Build a realistic 'show stat' response"""
+    # HAProxy prints 0 for counters that apply to a row and leaves the rest empty
+    counters = ('qcur', 'dreq', 'dresp', 'ereq', 'econ', 'eresp', 'wretr', 'wredis', 'req_tot',
+                'hrsp_1xx', 'hrsp_2xx', 'hrsp_3xx', 'hrsp_4xx', 'hrsp_5xx', 'hrsp_other',
+                'qtime', 'ctime', 'rtime', 'ttime', 'rate')
+
+    def row(values):
+        values = dict(dict.fromkeys(counters, 0), **values)
+        return ','.join(str(values.get(h, '')) for h in HEADER) + ','
+
+    lines = ['# ' + ','.join(HEADER) + ',']
+    lines.append(row({'pxname': 'web', 'svname': 'FRONTEND', 'status': 'OPEN', 'scur': 12,
+                      'stot': 123456, 'bin': 987654321, 'bout': 123456789, 'req_tot': 120000}))
+
+    num_backends = max(num_servers // servers_per_backend, 1)
+    for b in range(num_backends):
+        for s in range(servers_per_backend):
+            lines.append(row({
+                'pxname': f'backend_{b}', 'svname': f'server_{s}', 'status': 'UP', 'weight': 1,
+                'scur': s, 'stot': 100000 + s, 'bin': 5000000 + b, 'bout': 9000000 + s,
+                'check_status': 'L4OK', 'lastchg': 3600, 'downtime': 0, 'check_code': '',
+                'addr': f'10.{b % 250}.{s}.1:80', 'mode': 'http', 'qtime': 0, 'ctime': 1,
+                'rtime': 12, 'ttime': 40, 'hrsp_2xx': 99000, 'hrsp_5xx': 12
+            }))
+        lines.append(row({'pxname': f'backend_{b}', 'svname': 'BACKEND', 'status': 'UP',
+                          'scur': 3, 'stot': 2000000, 'bin': 1, 'bout': 2,
+                          'act': servers_per_backend, 'bck': 0}))
+
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+def legacy_parse(chunks):
+    """The previous read_haproxy_stats() parsing code"""
+    response = b''
+    for chunk in chunks:
+        response += chunk
+
+    lines = response.decode('utf-8').strip().split('\n')
+    headers = lines[0].strip('# ').split(',')
+    stats = {'frontends': [], 'backends': [], 'servers': [],
+             'summary': {'total_sessions': 0, 'current_sessions': 0, 'bytes_in': 0, 'bytes_out': 0}}
+
+    for line in lines[1:]:
+        if not line.strip():
+            continue
+        values = line.split(',')
+        if len(values) < len(headers):
+            continue
+        entry = dict(zip(headers, values))
+        pxname = entry.get('pxname', '')
+        svname = entry.get('svname', '')
+        if svname == 'FRONTEND':
+            stats['frontends'].append({
+                'name': pxname, 'status': entry.get('status', 'UNKNOWN'),
+                'sessions_current': int(entry.get('scur', 0) or 0),
+                'sessions_total': int(entry.get('stot', 0) or 0),
+                'bytes_in': int(entry.get('bin', 0) or 0),
+                'bytes_out': int(entry.get('bout', 0) or 0),
+                'requests_total': int(entry.get('req_tot', 0) or 0),
+                'rate': int(entry.get('rate', 0) or 0)})
+        elif svname == 'BACKEND':
+            stats['backends'].append({
+                'name': pxname, 'status': entry.get('status', 'UNKNOWN'),
+                'sessions_current': int(entry.get('scur', 0) or 0),
+                'sessions_total': int(entry.get('stot', 0) or 0),
+                'bytes_in': int(entry.get('bin', 0) or 0),
+                'bytes_out': int(entry.get('bout', 0) or 0),
+                'queue_current': int(entry.get('qcur', 0) or 0),
+                'active_servers': int(entry.get('act', 0) or 0),
+                'backup_servers': int(entry.get('bck', 0) or 0)})
+        else:
+            stats['servers'].append({
+                'backend': pxname, 'name': svname, 'status': entry.get('status', 'UNKNOWN'),
+                'weight': int(entry.get('weight', 0) or 0),
+                'sessions_current': int(entry.get('scur', 0) or 0),
+                'sessions_total': int(entry.get('stot', 0) or 0),
+                'bytes_in': int(entry.get('bin', 0) or 0),
+                'bytes_out': int(entry.get('bout', 0) or 0),
+                'check_status': entry.get('check_status', ''),
+                'last_status_change': entry.get('lastchg', ''),
+                'downtime': int(entry.get('downtime', 0) or 0)})
+            stats['summary']['total_sessions'] += int(entry.get('stot', 0) or 0)
+            stats['summary']['current_sessions'] += int(entry.get('scur', 0) or 0)
+            stats['summary']['bytes_in'] += int(entry.get('bin', 0) or 0)
+            stats['summary']['bytes_out'] += int(entry.get('bout', 0) or 0)
+
+    return stats
+
+
+def streaming_parse(chunks):
+    parser = StatCsvParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+    return parser.close()
+
+
+def split_chunks(data, size=65536):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def best_of(func, chunks, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(chunks)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--servers', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    data = generate_csv(args.servers)
+    # HAProxy delivers the dump in 4 KiB pieces on a typical socket
+    chunks = split_chunks(data, 4096)
+    rows = data.count(b'\n') - 2
+
+    print(f'{rows} rows, {len(data) / 1024 / 1024:.1f} MiB, {len(chunks)} chunks')
+
+    legacy_time, legacy = best_of(legacy_parse, chunks, args.repeat)
+    streaming_time, streaming = best_of(streaming_parse, chunks, args.repeat)
+    # The streaming parser returns extra fields; the legacy ones must match
+    assert legacy['summary'] == streaming['summary'], 'parsers disagree'
+    for section in ('frontends', 'backends', 'servers'):
+        for old_row, new_row in zip(legacy[section], streaming[section]):
+            assert old_row.items() <= new_row.items(), 'parsers disagree'
+
+    for label, elapsed in (('legacy', legacy_time), ('streaming', streaming_time)):
+        print(f'{label:>10}: {elapsed * 1000:8.1f} ms  {rows / elapsed:12,.0f} rows/s')
+    print(f'   speedup: {legacy_time / streaming_time:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
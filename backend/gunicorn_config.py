@@ -10,7 +10,9 @@ backlog = 2048
 # For high-traffic deployments, implement Redis-backed sessions
 # and increase workers to: multiprocessing.cpu_count() * 2 + 1
 workers = 1
-worker_class = 'sync'
+# gevent lets long-lived /api/stats/stream connections wait on a greenlet
+# instead of holding a whole sync worker each
+worker_class = 'gevent'
 worker_connections = 1000
 timeout = 30
 keepalive = 2
@@ -0,0 +1,430 @@
+"""Pooled client for the HAProxy admin (stats) socket
+
+Connections are switched to HAProxy's interactive ``prompt`` mode so a single
+socket can carry any number of commands. Each response is terminated by the
+prompt (``"\\n> "``), which is how we know a command has finished without
+waiting for HAProxy to close the connection.
+
+Addresses are either a Unix socket path or ``tcp://host:port`` (also plain
+``host:port``) for stats sockets exposed over TCP or through socat.
+"""
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+PROMPT = b'\n> '
+RECV_SIZE = 65536
+# Longest command line we send; HAProxy reads each line into one buffer
+# (tune.bufsize, 16 kB by default)
+MAX_LINE = 8192
+
+
+class AdminSocketError(Exception):
+    """Raised when the admin socket connection fails mid-command"""
+
+
+def parse_address(address):
+    """
+    Parse an admin socket address.
+    Returns (host, port) for TCP addresses or None for Unix socket paths.
+    """
+    if address.startswith('tcp://'):
+        address = address[len('tcp://'):]
+    elif address.startswith('/') or address.startswith('.') or ':' not in address:
+        return None
+
+    host, _, port = address.rpartition(':')
+    if not port.isdigit():
+        return None
+    return host.strip('[]'), int(port)
+
+
+def batch_commands(commands, max_line=MAX_LINE):
+    """Group commands into ';'-separated lines no longer than max_line"""
+    lines = []
+    current = []
+    length = 0
+    for command in commands:
+        if current and length + 1 + len(command) > max_line:
+            lines.append(current)
+            current = []
+            length = 0
+        length += len(command) + (1 if current else 0)
+        current.append(command)
+    if current:
+        lines.append(current)
+    return lines
+
+
+def split_responses(text, count):
+    """
+    Split the output of count ';'-separated commands into one response per
+    command. Each command's output is terminated by an empty line, and
+    commands without output produce just that empty line.
+    """
+    responses = []
+    current = []
+    for line in text.split('\n'):
+        if line:
+            current.append(line)
+            continue
+        responses.append('\n'.join(current))
+        current = []
+        if len(responses) == count:
+            break
+    if current and len(responses) < count:
+        responses.append('\n'.join(current))
+    responses.extend([''] * (count - len(responses)))
+    return responses
+
+
+class AdminSocketConnection:
+    """A single admin socket connection in interactive prompt mode"""
+
+    def __init__(self, address, timeout=5.0):
+        self.address = address
+        self.timeout = timeout
+        self.sock = None
+        self.last_used = 0.0
+
+    def connect(self):
+        """Open the socket and enter prompt mode"""
+        tcp_address = parse_address(self.address)
+        if tcp_address:
+            sock = socket.create_connection(tcp_address, timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+        try:
+            if not tcp_address:
+                sock.connect(self.address)
+            sock.sendall(b'prompt\n')
+            self.sock = sock
+            # The reply to 'prompt' is just the prompt itself
+            self._read_until_prompt(lambda chunk: None, initial=True)
+        except Exception:
+            sock.close()
+            self.sock = None
+            raise
+        self.last_used = time.monotonic()
+
+    def close(self):
+        """Close the underlying socket"""
+        if self.sock is not None:
+            try:
+                self.sock.sendall(b'quit\n')
+            except OSError:
+                pass
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def _read_until_prompt(self, consumer, initial=False):
+        """
+        Read from the socket, passing chunks to consumer until the prompt.
+        The prompt itself is never passed to the consumer.
+        """
+        # Hold back the last bytes of every chunk until we know they are not
+        # the start of the prompt terminator.
+        pending = b''
+        while True:
+            chunk = self.sock.recv(RECV_SIZE)
+            if not chunk:
+                raise AdminSocketError('HAProxy closed the admin socket connection')
+
+            data = pending + chunk if pending else chunk
+            if data.endswith(PROMPT) or (initial and data.endswith(b'> ')):
+                body = data[:-len(PROMPT)] if data.endswith(PROMPT) else data[:-2]
+                if body:
+                    consumer(body)
+                return
+
+            keep = len(PROMPT) - 1
+            if len(data) > keep:
+                consumer(data[:-keep])
+                pending = data[-keep:]
+            else:
+                pending = data
+
+    def send(self, command):
+        """Send a command line, connecting first if needed"""
+        if self.sock is None:
+            self.connect()
+        self.sock.sendall(command.encode('utf-8') + b'\n')
+
+    def receive(self, consumer):
+        """Feed the response to the command sent to consumer chunk by chunk"""
+        self._read_until_prompt(consumer)
+        self.last_used = time.monotonic()
+
+    def stream(self, command, consumer):
+        """Send a command and feed the response to consumer chunk by chunk"""
+        self.send(command)
+        self.receive(consumer)
+
+    def execute(self, command):
+        """Send a command and return the full response as text"""
+        buffer = bytearray()
+        self.stream(command, buffer.extend)
+        return buffer.decode('utf-8', errors='replace')
+
+    def execute_many(self, commands):
+        """
+        Run many commands, several per line separated by ';', and return
+        one response per command.
+        """
+        responses = []
+        for batch in batch_commands(commands):
+            output = self.execute(';'.join(batch))
+            responses.extend(split_responses(output, len(batch)))
+        return responses
+
+
+class AdminSocketPool:
+    """
+    Thread-safe pool of persistent admin socket connections.
+
+    Idle connections are dropped once they have been unused for longer than
+    ``max_idle`` seconds, which should stay below HAProxy's ``stats timeout``
+    so we never pick up a connection HAProxy is about to close.
+    """
+
+    def __init__(self, address, max_size=4, max_idle=20.0, timeout=5.0):
+        self.address = address
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        """Get an idle connection, or a new unconnected one"""
+        now = time.monotonic()
+        stale = []
+        conn = None
+
+        with self._lock:
+            while self._idle:
+                candidate = self._idle.pop()
+                if now - candidate.last_used < self.max_idle:
+                    conn = candidate
+                    break
+                stale.append(candidate)
+
+        for candidate in stale:
+            candidate.close()
+
+        if conn is None:
+            conn = AdminSocketConnection(self.address, timeout=self.timeout)
+        return conn
+
+    def _release(self, conn):
+        """Return a healthy connection to the pool"""
+        with self._lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for a sequence of commands.
+        The connection is discarded if anything goes wrong while it is held.
+        """
+        conn = self._acquire()
+        try:
+            if conn.sock is None:
+                conn.connect()
+            yield conn
+        except BaseException:
+            conn.close()
+            raise
+        else:
+            self._release(conn)
+
+    def stream(self, command, consumer):
+        """
+        Run a command, feeding the response to consumer.
+        A reused connection that turns out to be dead when sending the
+        command is replaced by a fresh one. Once sent, a command is only
+        sent again if it just reads ('show ...') and the connection was
+        closed before any output: runtime commands are not idempotent, and
+        after a timeout HAProxy may well have run them already.
+        """
+        conn = self._acquire()
+        reused = conn.sock is not None
+        received = False
+
+        def tracking_consumer(chunk):
+            nonlocal received
+            received = True
+            consumer(chunk)
+
+        try:
+            try:
+                conn.send(command)
+            except ConnectionError:
+                if not reused:
+                    raise
+                conn.close()
+                conn = AdminSocketConnection(self.address, timeout=self.timeout)
+                reused = False
+                conn.send(command)
+
+            try:
+                conn.receive(tracking_consumer)
+            except (ConnectionError, AdminSocketError):
+                if not reused or received or not command.startswith('show '):
+                    raise
+                conn.close()
+                conn = AdminSocketConnection(self.address, timeout=self.timeout)
+                conn.stream(command, consumer)
+        except BaseException:
+            conn.close()
+            raise
+
+        self._release(conn)
+
+    def execute(self, command):
+        """Run a command and return the full response as text"""
+        buffer = bytearray()
+        self.stream(command, buffer.extend)
+        return buffer.decode('utf-8', errors='replace')
+
+    def execute_many(self, commands):
+        """
+        Run a list of commands over one connection, batched into as few
+        lines as possible. Returns one response per command.
+        Not retried: the commands may have partially taken effect.
+        """
+        with self.connection() as conn:
+            return conn.execute_many(commands)
+
+    def close(self):
+        """Close all idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_admin_socket_pool(address=None):
+    """Get the shared connection pool for an admin socket address"""
+    if address is None:
+        from .haproxy import get_haproxy_socket_path
+        address = get_haproxy_socket_path()
+
+    with _pools_lock:
+        pool = _pools.get(address)
+        if pool is None:
+            pool = AdminSocketPool(
+                address,
+                max_size=int(os.getenv('HAPROXY_SOCKET_POOL_SIZE', '4')),
+                max_idle=float(os.getenv('HAPROXY_SOCKET_MAX_IDLE', '20')),
+                timeout=float(os.getenv('HAPROXY_SOCKET_TIMEOUT', '5'))
+            )
+            _pools[address] = pool
+        return pool
+
+
+def send_command(command, address=None):
+    """Run a single runtime API command and return its output"""
+    return get_admin_socket_pool(address).execute(command)
+
+
+def send_commands(commands, address=None):
+    """Run several runtime API commands in one session, one output each"""
+    return get_admin_socket_pool(address).execute_many(commands)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def fan_out(func, endpoints, timeout):
+    """
+    Call func(address) for every (name, address) endpoint concurrently.
+    Each call gets the same deadline, so the total time is that of the
+    slowest endpoint rather than the sum.
+    Returns a list of (name, result, error) in endpoint order; error is the
+    exception raised, or TimeoutError if the deadline passed.
+    """
+    global _executor
+
+    if len(endpoints) == 1:
+        name, address = endpoints[0]
+        try:
+            return [(name, func(address), None)]
+        except Exception as e:
+            return [(name, None, e)]
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv('HAPROXY_FANOUT_WORKERS', '16')),
+                thread_name_prefix='haproxy-fanout'
+            )
+        executor = _executor
+
+    futures = [executor.submit(func, address) for _, address in endpoints]
+    wait(futures, timeout=timeout)
+
+    results = []
+    for (name, address), future in zip(endpoints, futures):
+        if not future.done():
+            future.cancel()
+            results.append((name, None, TimeoutError(f'{address} did not answer within {timeout}s')))
+        elif future.exception() is not None:
+            results.append((name, None, future.exception()))
+        else:
+            results.append((name, future.result(), None))
+    return results
+
+
+def send_master_command(command, address, timeout=10.0):
+    """
+    Run a command on the HAProxy master CLI (the -S socket) and return its
+    output. Outside prompt mode the master closes the connection once it
+    has answered, so the response is read until EOF.
+    """
+    tcp_address = parse_address(address)
+    if tcp_address:
+        sock = socket.create_connection(tcp_address, timeout=timeout)
+    else:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+    try:
+        if not tcp_address:
+            sock.connect(address)
+        sock.sendall(command.encode('utf-8') + b'\n')
+        buffer = bytearray()
+        while True:
+            chunk = sock.recv(RECV_SIZE)
+            if not chunk:
+                break
+            buffer.extend(chunk)
+        return buffer.decode('utf-8', errors='replace')
+    finally:
+        sock.close()
+
+
+def close_admin_socket_pools():
+    """
+    Drop every pooled connection, e.g. after a reload: pooled connections
+    would otherwise keep talking to the old, draining process.
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close()
@@ -0,0 +1,156 @@
+"""Coalescing queue for configuration applies
+
+Applies requested within a short debounce window, or while another apply
+is running, are merged into one batch: a single plan/render/validate/reload
+cycle whose result every caller in the batch receives. The database is
+read when the batch starts, so it includes every edit made before any of
+the merged requests.
+
+Only one apply (or restore) runs at a time across all gunicorn workers,
+serialized by an flock on a lock file next to the config backups. Every
+request of a batch is audited under its own username.
+"""
+import fcntl
+import os
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from .config_plan import NOOP, execute_plan
+from .database import log_audit_many
+from .haproxy import get_backup_directory
+from .jobs import job_phase
+
+_process_lock = threading.Lock()
+
+# Longest wait between two attempts to take the apply lock (seconds)
+LOCK_POLL_MAX = 0.1
+
+
+def get_apply_lock_path():
+    """Lock file shared by every worker process"""
+    return os.getenv('HAPROXY_APPLY_LOCK', os.path.join(get_backup_directory(), 'apply.lock'))
+
+
+@contextmanager
+def apply_lock():
+    """
+    Hold the cross-worker apply lock. A blocking flock() would stall every
+    greenlet of the worker, so it is polled; time.sleep is gevent.sleep
+    under monkey patching.
+    """
+    with _process_lock:
+        with open(get_apply_lock_path(), 'a') as lock_file:
+            delay = 0.005
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    time.sleep(delay)
+                    delay = min(delay * 2, LOCK_POLL_MAX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def run_exclusive(func, *args):
+    """Run func(*args) while holding the apply lock"""
+    with ExitStack() as stack:
+        with job_phase('queue'):
+            stack.enter_context(apply_lock())
+        return func(*args)
+
+
+class _Batch:
+    """Apply requests merged into one run"""
+
+    def __init__(self):
+        self.requests = []
+        self.done = threading.Event()
+        self.result = None
+
+
+class ApplyQueue:
+    """
+    Merges concurrent apply requests. The first request of a batch waits
+    for the debounce window and the apply lock, then runs the apply for
+    everyone who joined in the meantime.
+    """
+
+    def __init__(self, apply_func, debounce=0.5):
+        self.apply_func = apply_func
+        self.debounce = debounce
+        self._pending = None
+        self._lock = threading.Lock()
+
+    def submit(self, username, ip_address):
+        """Request an apply and wait for the result of the batch it joins"""
+        with self._lock:
+            batch = self._pending
+            leader = batch is None
+            if leader:
+                batch = self._pending = _Batch()
+            batch.requests.append((username, ip_address))
+
+        if leader:
+            self._run(batch)
+        else:
+            with job_phase('queue'):
+                batch.done.wait()
+
+        return dict(batch.result, batched=len(batch.requests))
+
+    def _run(self, batch):
+        try:
+            with ExitStack() as stack:
+                with job_phase('queue'):
+                    if self.debounce > 0:
+                        time.sleep(self.debounce)
+                    stack.enter_context(apply_lock())
+                # Close the batch only now, so requests arriving while an
+                # earlier apply held the lock are merged as well
+                with self._lock:
+                    self._pending = None
+                username, ip_address = batch.requests[0]
+                batch.result = self.apply_func(username, ip_address)
+        except Exception as e:
+            batch.result = {'success': False, 'error': f'Failed to apply configuration: {str(e)}'}
+        finally:
+            with self._lock:
+                if self._pending is batch:
+                    self._pending = None
+            batch.done.set()
+
+        self._audit_joined(batch)
+
+    @staticmethod
+    def _audit_joined(batch):
+        """
+        The apply is audited under the first request's username: add an
+        entry for each request that joined it
+        """
+        result = batch.result
+        if len(batch.requests) < 2 or not result.get('success') or \
+                result.get('strategy') == NOOP or result.get('unchanged'):
+            return
+        leader = batch.requests[0][0]
+        log_audit_many([
+            (username, 'apply_config', 'haproxy', None,
+             f"{result['message']} (batched with the apply requested by {leader})", ip_address)
+            for username, ip_address in batch.requests[1:]
+        ])
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_apply_queue():
+    """Get the shared apply queue"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = ApplyQueue(execute_plan, debounce=float(os.getenv('HAPROXY_APPLY_DEBOUNCE', '0.5')))
+        return _queue
@@ -0,0 +1,229 @@
+"""Batched, asynchronous audit log writer
+
+log_audit() used to insert and commit on the request path of every
+mutating endpoint. Entries are now queued in memory and one background
+thread writes whatever is queued in a single transaction (group commit):
+as soon as AUDIT_LOG_BATCH_SIZE entries are waiting, otherwise every
+AUDIT_LOG_FLUSH_INTERVAL seconds, and at interpreter exit.
+
+Callers that must not answer before their entry is on disk pass
+``sync=True``: they wait until a batch including it is committed, and
+waiting callers share that commit. A batch that fails to write (database
+locked, I/O error) is retried AUDIT_LOG_MAX_RETRIES times, then dropped:
+sync callers waiting for it get an AuditLogError, as they do after
+AUDIT_LOG_SYNC_TIMEOUT seconds. The writer has its own connection, with
+synchronous=FULL, so a committed batch survives a power loss.
+AUDIT_LOG_MODE=sync writes every entry on the caller's thread instead,
+as before.
+"""
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from .database import open_db_connection, write_audit_entries
+
+# Above this many queued entries (e.g. while the database is locked for
+# long) callers write their entries themselves
+MAX_PENDING = 10000
+
+# Batches given up on, remembered for the sync callers waiting for them
+MAX_FAILED_BATCHES = 100
+
+logger = logging.getLogger(__name__)
+
+
+class AuditLogError(Exception):
+    """An entry a sync caller waits for was not written"""
+
+
+class AuditWriter:
+    """Queue of audit entries written in batches by a background thread"""
+
+    def __init__(self, batch_size=500, flush_interval=0.2, max_retries=3, sync_timeout=30.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.sync_timeout = sync_timeout
+        self._cond = threading.Condition()
+        self._pending = []
+        # Entries queued / written (or dropped) since start, to wait for a
+        # given entry
+        self._queued = 0
+        self._written = 0
+        # (first, last, error) entry numbers of the batches dropped
+        self._failed = []
+        self._retries = 0
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        # A caller is waiting: write without waiting for the interval
+        self._flush_now = False
+        self.batches = 0
+
+    def start(self):
+        """Start the writer thread (again, after a fork) if needed"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+
+        with self._cond:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                # The parent process writes what it queued itself
+                self._pending = []
+                self._written = self._queued
+            self._pid = os.getpid()
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, entries, sync=False):
+        """
+        Queue entries (tuples for write_audit_entries()). With sync=True, return once they
+        are committed; raises AuditLogError if they were dropped or it took too long.
+        """
+        if not entries:
+            return
+        self.start()
+
+        with self._cond:
+            if len(self._pending) >= MAX_PENDING:
+                overflow = True
+            else:
+                overflow = False
+                self._pending.extend(entries)
+                self._queued += len(entries)
+                target = self._queued
+                if sync:
+                    self._flush_now = True
+                if sync or len(self._pending) >= self.batch_size:
+                    self._cond.notify_all()
+
+        if overflow:
+            write_audit_entries(entries)
+            return
+
+        if sync:
+            self._wait_written(target, target - len(entries) + 1)
+
+    def _wait_written(self, target, first=None):
+        deadline = time.monotonic() + self.sync_timeout
+        with self._cond:
+            while self._written < target:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise AuditLogError(f'Audit log not written within {self.sync_timeout:g}s')
+                self._cond.wait(remaining)
+            if first is not None:
+                for failed_first, failed_last, error in self._failed:
+                    if failed_first <= target and first <= failed_last:
+                        raise AuditLogError(f'Audit log not written: {error}')
+
+    def flush(self):
+        """Write everything queued so far and wait for the commit"""
+        with self._cond:
+            target = self._queued
+            self._flush_now = True
+            self._cond.notify_all()
+        if self._thread is not None and self._thread.is_alive():
+            self._wait_written(target)
+
+    def _run(self):
+        """Writing loop"""
+        conn = open_db_connection()
+        # fsync every commit: a written batch is durable
+        conn.execute('PRAGMA synchronous = FULL')
+        try:
+            self._loop(conn)
+        finally:
+            conn.close_for_good()
+
+    def _loop(self, conn):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while not (self._stopping or self._flush_now) and len(self._pending) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending
+                self._pending = []
+                self._flush_now = False
+                stopping = self._stopping
+
+            if batch:
+                self._write_batch(conn, batch)
+            if stopping:
+                return
+
+    def _write_batch(self, conn, batch):
+        error = None
+        try:
+            write_audit_entries(batch, conn)
+        except sqlite3.OperationalError as e:
+            # Locked or I/O error: retried with the next batch, sync callers
+            # keep waiting for it
+            self._retries += 1
+            if self._retries <= self.max_retries:
+                logger.warning('Writing %d audit entries failed, retrying: %s', len(batch), e)
+                with self._cond:
+                    self._pending[:0] = batch
+                time.sleep(self.flush_interval)
+                return
+            logger.error('Writing %d audit entries failed %d times, dropping them: %s',
+                         len(batch), self._retries, e)
+            error = e
+        except Exception:
+            # A malformed entry fails the whole transaction: write the
+            # others one by one and drop it
+            for entry in batch:
+                try:
+                    write_audit_entries([entry], conn)
+                except Exception as e:
+                    logger.warning('Dropping malformed audit entry %r: %s', entry, e)
+
+        self._retries = 0
+        with self._cond:
+            if error is not None:
+                self._failed.append((self._written + 1, self._written + len(batch), error))
+                del self._failed[:-MAX_FAILED_BATCHES]
+            else:
+                self.batches += 1
+            self._written += len(batch)
+            self._cond.notify_all()
+
+    def close(self, timeout=5.0):
+        """Write what is queued and stop the thread"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            thread.join(timeout)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_audit_writer():
+    """Get the process-wide audit writer, or None in AUDIT_LOG_MODE=sync"""
+    global _writer
+
+    if os.getenv('AUDIT_LOG_MODE', 'async').lower() == 'sync':
+        return None
+
+    with _writer_lock:
+        if _writer is None:
+            _writer = AuditWriter(
+                batch_size=int(os.getenv('AUDIT_LOG_BATCH_SIZE', '500')),
+                flush_interval=float(os.getenv('AUDIT_LOG_FLUSH_INTERVAL', '0.2')),
+                max_retries=int(os.getenv('AUDIT_LOG_MAX_RETRIES', '3')),
+                sync_timeout=float(os.getenv('AUDIT_LOG_SYNC_TIMEOUT', '30'))
+            )
+            atexit.register(_writer.close)
+        return _writer
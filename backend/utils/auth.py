@@ -6,11 +6,16 @@ from datetime import datetime, timedelta
 from functools import wraps
 from flask import request, jsonify
 import os
-from .database import init_database, get_db_connection
+from .database import init_database, get_db_connection, close_db_connection
 
 # Session store (consider Redis for production)
 sessions = {}
 
+# Short-lived, single-use tickets for EventSource connections, which cannot
+# send an Authorization header (keeps session tokens out of URLs and logs)
+stream_tickets = {}
+STREAM_TICKET_TTL = timedelta(seconds=60)
+
 def init_db():
     """Initialize database with all tables"""
     # Initialize all database tables
@@ -18,18 +23,16 @@ def init_db():
 
     # Create default admin user if not exists
     conn = get_db_connection()
-    cursor = conn.cursor()
 
-    cursor.execute('SELECT COUNT(*) FROM users WHERE username = ?', ('admin',))
-    if cursor.fetchone()[0] == 0:
-        password_hash = hash_password('admin')
-        cursor.execute(
-            'INSERT INTO users (username, password_hash) VALUES (?, ?)',
-            ('admin', password_hash)
-        )
-
-    conn.commit()
-    conn.close()
+    with conn.transaction():
+        if conn.execute('SELECT COUNT(*) FROM users WHERE username = ?', ('admin',)).fetchone()[0] == 0:
+            password_hash = hash_password('admin')
+            conn.execute(
+                'INSERT INTO users (username, password_hash) VALUES (?, ?)',
+                ('admin', password_hash)
+            )
+    # Runs at import: keep no connection a forked worker could inherit
+    close_db_connection()
 
 def hash_password(password):
     """Hash password using bcrypt"""
@@ -66,6 +69,26 @@ def destroy_session(token):
     if token in sessions:
         del sessions[token]
 
+def create_stream_ticket(username):
+    """Create a single-use ticket for opening an event stream"""
+    now = datetime.now()
+    for ticket in [t for t, v in stream_tickets.items() if now > v['expires']]:
+        stream_tickets.pop(ticket, None)
+
+    ticket = secrets.token_hex(16)
+    stream_tickets[ticket] = {
+        'username': username,
+        'expires': now + STREAM_TICKET_TTL
+    }
+    return ticket
+
+def redeem_stream_ticket(ticket):
+    """Consume a stream ticket, returning the username or None"""
+    entry = stream_tickets.pop(ticket, None)
+    if not entry or datetime.now() > entry['expires']:
+        return None
+    return entry['username']
+
 def require_auth(f):
     """Decorator to require authentication"""
     @wraps(f)
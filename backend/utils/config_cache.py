@@ -0,0 +1,236 @@
+"""Cache of HAProxy config files, their hash and their parsed form
+
+The dashboard polls /api/config every few seconds while haproxy.cfg changes
+a few times a day. Each file is read, hashed and (on first use) parsed once,
+then served from memory for as long as its (inode, mtime_ns, size) stays
+the same; a single stat() per lookup detects edits made by anyone, in any
+process.
+
+With HAPROXY_CONFIG_INOTIFY=true (Linux only) the live config's directory
+is also watched with inotify. Watched files are not even stat()ed on a
+hit; an event for the file drops its entry instead. If inotify is not
+available the cache silently keeps using stat().
+"""
+import ctypes
+import ctypes.util
+import hashlib
+import os
+import select
+import struct
+import threading
+from collections import OrderedDict
+
+# Temporary files validated during applies are cached too; keep only a few
+MAX_CACHED_FILES = 8
+
+
+class CachedConfig:
+    """Content of one config file version; 'parsed' is built on first use"""
+
+    def __init__(self, path, key, content):
+        self.path = path
+        self.key = key
+        self.content = content
+        self.hash = hashlib.sha256(content.encode()).hexdigest()
+        self._parsed = None
+        self._lock = threading.Lock()
+
+    @property
+    def parsed(self):
+        """
+        parse_haproxy_config_text() of the content. Shared by every caller,
+        so it must not be modified.
+        """
+        if self._parsed is None:
+            # Imported here: haproxy.py uses this module
+            from .haproxy import parse_haproxy_config_text
+            with self._lock:
+                if self._parsed is None:
+                    self._parsed = parse_haproxy_config_text(self.content)
+        return self._parsed
+
+
+def _file_key(path):
+    stat = os.stat(path)
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class ConfigCache:
+    """Per-path cache of CachedConfig, keyed by (inode, mtime_ns, size)"""
+
+    def __init__(self, max_files=MAX_CACHED_FILES):
+        self.max_files = max_files
+        self._entries = OrderedDict()
+        self._watched = set()
+        self._watcher = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path):
+        """
+        Current version of a file. Raises the OSError of stat()/open(),
+        e.g. FileNotFoundError.
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and path in self._watched:
+                self.hits += 1
+                self._entries.move_to_end(path)
+                return entry
+
+        key = _file_key(path)
+        if entry is not None and entry.key == key:
+            with self._lock:
+                self.hits += 1
+                self._entries.move_to_end(path)
+            return entry
+
+        with self._lock:
+            generation = self._generation
+        # newline='' keeps the hash equal to the hash of the file's bytes
+        with open(path, 'r', newline='') as f:
+            content = f.read()
+        # The file may have changed between stat() and read(); key the entry
+        # by the stat taken after reading, so a later stat() catches it
+        entry = CachedConfig(path, _file_key(path), content)
+
+        with self._lock:
+            self.misses += 1
+            if generation != self._generation and path in self._watched:
+                # Invalidated while reading; what was read may be stale
+                return entry
+            self._entries[path] = entry
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_files:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, path=None):
+        """Drop one file (or everything) so the next get() re-reads it"""
+        with self._lock:
+            self._generation += 1
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.abspath(path), None)
+
+    def watch(self, path):
+        """
+        Invalidate a file on inotify events instead of stat()ing it on
+        every lookup. Returns False if inotify is not available.
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            if self._watcher is None:
+                self._watcher = _InotifyWatcher(self._on_event, self._on_watch_stopped)
+            if not self._watcher.add(os.path.dirname(path)):
+                return False
+            # Drop what was read before the watch existed
+            self._entries.pop(path, None)
+            self._watched.add(path)
+            return True
+
+    def _on_event(self, path):
+        # None: events were lost, nothing cached can be trusted
+        self.invalidate(path)
+
+    def _on_watch_stopped(self):
+        """Go back to stat()ing every file"""
+        with self._lock:
+            self._watched.clear()
+        self.invalidate()
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+_WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class _InotifyWatcher:
+    """
+    Background thread reporting changed files in watched directories.
+    The descriptor is non-blocking and waited on with select(), which
+    only suspends the watcher's greenlet under gevent; a blocking read
+    would stall the whole worker.
+    """
+
+    def __init__(self, callback, on_stop):
+        self.callback = callback
+        self.on_stop = on_stop
+        self._directories = {}
+        self._fd = None
+        self._libc = None
+        name = ctypes.util.find_library('c')
+        if not name:
+            return
+        try:
+            libc = ctypes.CDLL(name, use_errno=True)
+            fd = libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        except (OSError, AttributeError):
+            return
+        if fd < 0:
+            return
+        self._libc = libc
+        self._fd = fd
+        threading.Thread(target=self._run, daemon=True, name='config-inotify').start()
+
+    def add(self, directory):
+        """Watch a directory; False if it cannot be watched"""
+        if self._fd is None:
+            return False
+        if directory in self._directories.values():
+            return True
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _WATCH_MASK)
+        if wd < 0:
+            return False
+        self._directories[wd] = directory
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                select.select([self._fd], [], [])
+                data = os.read(self._fd, 64 * 1024)
+            except (InterruptedError, BlockingIOError):
+                continue
+            except OSError:
+                self.on_stop()
+                return
+            offset = 0
+            while offset + _EVENT_HEADER.size <= len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    self.callback(None)
+                elif wd in self._directories and name:
+                    self.callback(os.path.join(self._directories[wd], os.fsdecode(name)))
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_config_cache():
+    """Get the shared config file cache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ConfigCache()
+            if os.getenv('HAPROXY_CONFIG_INOTIFY', 'false').lower() == 'true':
+                from .haproxy import get_haproxy_config_path
+                _cache.watch(get_haproxy_config_path())
+        return _cache
@@ -0,0 +1,157 @@
+"""Single-pass HAProxy configuration parser
+
+The configuration is read line by line. A line whose first word is a
+section keyword (``global``, ``defaults``, ``frontend``, ``backend``,
+``listen``, ``peers``, ...) opens a new section, and every other non-empty
+line becomes a ``(line number, keyword, arguments)`` entry of the current
+section. Comments are dropped from the entries but kept in the section's
+raw text. Nothing is rescanned, so the cost is linear in the file size.
+"""
+import gc
+import threading
+from contextlib import contextmanager
+
+SECTION_KEYWORDS = frozenset((
+    'global', 'defaults', 'frontend', 'backend', 'listen', 'peers', 'resolvers',
+    'userlist', 'cache', 'program', 'http-errors', 'ring', 'mailers', 'fcgi-app',
+    'crt-store', 'traces', 'log-forward', 'dynamic-update',
+))
+
+# The collector is process-wide: pauses are counted across threads and
+# greenlets, and the last one to end enables it again
+_gc_lock = threading.Lock()
+_gc_pauses = 0
+_gc_was_enabled = False
+
+
+@contextmanager
+def paused_gc():
+    """
+    Pause the cyclic garbage collector while building many small objects.
+    A parse allocates hundreds of thousands of acyclic tuples and dicts,
+    and the collector would otherwise keep rescanning them.
+    """
+    global _gc_pauses, _gc_was_enabled
+    with _gc_lock:
+        if not _gc_pauses:
+            _gc_was_enabled = gc.isenabled()
+            gc.disable()
+        _gc_pauses += 1
+    try:
+        yield
+    finally:
+        with _gc_lock:
+            _gc_pauses -= 1
+            if not _gc_pauses and _gc_was_enabled:
+                gc.enable()
+
+
+def _strip_comment(line):
+    """Remove an unquoted, unescaped '#' comment from a line"""
+    quote = None
+    escaped = False
+    for i, char in enumerate(line):
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif quote:
+            if char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == '#':
+            return line[:i]
+    return line
+
+
+class ConfigSection:
+    """One section: its header, entries and the lines it spans"""
+
+    __slots__ = ('type', 'name', 'args', 'line', 'end_line', 'entries', '_lines', '_start')
+
+    def __init__(self, section_type, name, args, line, lines, start):
+        self.type = section_type
+        self.name = name
+        self.args = args
+        self.line = line
+        self.end_line = line
+        self.entries = []
+        self._lines = lines
+        self._start = start
+
+    @property
+    def body(self):
+        """Raw text of the section after its header line, comments included"""
+        return '\n'.join(self._lines[self._start:self.end_line]).strip()
+
+    def get(self, keyword, default=None):
+        """Arguments of the first entry with this keyword"""
+        for _, entry_keyword, args in self.entries:
+            if entry_keyword == keyword:
+                return args
+        return default
+
+    def find(self, keyword):
+        """(line, arguments) of every entry with this keyword"""
+        return [(line, args) for line, entry_keyword, args in self.entries if entry_keyword == keyword]
+
+    def to_dict(self, entries=True):
+        section = {'type': self.type, 'name': self.name, 'line': self.line, 'end_line': self.end_line}
+        if self.args:
+            section['args'] = self.args
+        if entries:
+            section['entries'] = [list(entry) for entry in self.entries]
+        return section
+
+
+def parse_config(content):
+    """Parse configuration text into a list of ConfigSection, in file order"""
+    with paused_gc():
+        return _parse_lines(content.splitlines())
+
+
+def _parse_lines(lines):
+    sections = []
+    section = None
+    keywords = SECTION_KEYWORDS
+    # Entries before the first section are dropped
+    append = [].append
+
+    for number, line in enumerate(lines, 1):
+        parts = (_strip_comment(line) if '#' in line else line).split(None, 1)
+        if not parts:
+            continue
+
+        keyword = parts[0]
+        if keyword in keywords:
+            if section is not None:
+                section.end_line = number - 1
+            header = parts[1].split() if len(parts) > 1 else []
+            section = ConfigSection(keyword, header[0] if header else '', header[1:], number, lines, number)
+            sections.append(section)
+            append = section.entries.append
+        elif len(parts) > 1:
+            append((number, keyword, parts[1].rstrip()))
+        else:
+            append((number, keyword, ''))
+
+    if section is not None:
+        section.end_line = len(lines)
+    return sections
+
+
+def parse_server(args):
+    """
+    Split 'server' arguments into name, host, port and options.
+    Returns None for servers without a numeric port.
+    """
+    parts = args.split(None, 2)
+    if len(parts) < 2:
+        return None
+    host, _, port = parts[1].rpartition(':')
+    if not host or not port.isdigit():
+        return None
+    if host[0] == '[' and host[-1] == ']':
+        host = host[1:-1]
+    return {'name': parts[0], 'host': host, 'port': port, 'options': parts[2] if len(parts) > 2 else ''}
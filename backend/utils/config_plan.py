@@ -0,0 +1,405 @@
+"""Plan the cheapest way to bring HAProxy in line with the database
+
+The desired state is the configuration rendered from the database. The
+running state is the current config file, with the servers of each backend
+taken from ``show servers state`` so runtime edits are accounted for.
+Every difference becomes a change classified as:
+
+- ``runtime``: applied through the admin socket (server add/remove, weight,
+  maxconn, address, disabling health checks)
+- ``reload``: needs HAProxy to reload its configuration (global, defaults,
+  frontends, backend settings, enabling health checks, other server options)
+- ``noop``: the rendered text differs but nothing HAProxy runs changes
+
+If nothing changed the apply is skipped; if every change is ``runtime`` the
+new config is written without reloading and the commands are sent; anything
+else goes through the regular apply and reload.
+"""
+import ipaddress
+from datetime import datetime
+
+from .config_cache import get_config_cache
+from .database import log_audit
+from .jobs import job_phase
+from .haproxy import (
+    add_server_steps, apply_config_and_restart, apply_runtime_steps, backup_current_config,
+    copy_file_with_privileges, delete_server_steps, get_applied_config_hash, get_haproxy_config_path,
+    install_config, parse_haproxy_config_text, read_servers_state, record_applied_config, reload_haproxy,
+    reload_verb, render_config_from_db, validate_runtime_values
+)
+
+RUNTIME = 'runtime'
+RELOAD = 'reload'
+NOOP = 'noop'
+
+# Server option defaults of the rendered config (see format_server_options)
+DEFAULT_WEIGHT = 1
+DEFAULT_MAXCONN = 32
+
+
+def parse_server_options(options):
+    """Split a server line's options into check/weight/maxconn and the rest"""
+    parsed = {'check': False, 'weight': DEFAULT_WEIGHT, 'maxconn': DEFAULT_MAXCONN, 'other': []}
+    tokens = options.split()
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token == 'check':
+            parsed['check'] = True
+        elif token in ('weight', 'maxconn') and i + 1 < len(tokens) and tokens[i + 1].isdigit():
+            parsed[token] = int(tokens[i + 1])
+            i += 1
+        else:
+            parsed['other'].append(token)
+        i += 1
+    parsed['other'] = tuple(parsed['other'])
+    return parsed
+
+
+def _change(kind, obj, name, action, detail, steps=()):
+    return {'type': kind, 'object': obj, 'name': name, 'action': action,
+            'detail': detail, 'steps': list(steps)}
+
+
+def _settings(body):
+    """Backend settings without its server lines"""
+    return [line.strip() for line in body.splitlines()
+            if line.strip() and not line.strip().startswith('server ')]
+
+
+def _is_hostname(host):
+    """True for a server address that is a name rather than an IP"""
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return True
+    return False
+
+
+def _running_host(state, server):
+    """
+    Address a running server was configured with. The runtime view only
+    has the resolved IP, plus the hostname in srv_fqdn when there is one;
+    without it, a hostname from the config file is taken as still current.
+    """
+    if state['fqdn']:
+        return state['fqdn']
+    if server.get('host') and _is_hostname(server['host']):
+        return server['host']
+    return state['address']
+
+
+def _running_servers(backend, runtime):
+    """
+    Servers of a backend in the running process: the config file's servers,
+    replaced by the runtime view when the admin socket could be read.
+    Options are None for servers that only exist at runtime.
+    """
+    in_file = {}
+    for server in backend['servers']:
+        options = parse_server_options(server['options'])
+        in_file[server['name']] = dict(server, port=int(server['port']), weight=options['weight'],
+                                       options=options)
+    if runtime is None:
+        return in_file
+
+    servers = {}
+    for (backend_name, server_name), state in runtime.items():
+        if backend_name != backend['name']:
+            continue
+        server = in_file.get(server_name, {'name': server_name, 'options': None})
+        servers[server_name] = dict(server, host=_running_host(state, server),
+                                    port=state['port'] if state['port'] is not None else server.get('port'),
+                                    weight=state['weight'])
+    return servers
+
+
+def _diff_server(backend_name, desired, running):
+    """Changes turning a running server into the desired one"""
+    target = f"{backend_name}/{desired['name']}"
+    wanted = desired['options']
+    current = running['options']
+    steps = []
+    details = []
+    reload_reasons = []
+
+    if running['weight'] != wanted['weight']:
+        details.append(f"weight {running['weight']} -> {wanted['weight']}")
+        steps.append((f"set server {target} weight {wanted['weight']}",
+                      f"set server {target} weight {running['weight']}", False))
+    if current is not None:
+        if current['maxconn'] != wanted['maxconn']:
+            details.append(f"maxconn {current['maxconn']} -> {wanted['maxconn']}")
+            steps.append((f"set maxconn server {target} {wanted['maxconn']}",
+                          f"set maxconn server {target} {current['maxconn']}", False))
+        if current['check'] and not wanted['check']:
+            details.append('health check disabled')
+            steps.append((f'disable health {target}', f'enable health {target}', False))
+        elif wanted['check'] and not current['check']:
+            reload_reasons.append('health check enabled')
+        if current['other'] != wanted['other']:
+            reload_reasons.append(f"options {' '.join(wanted['other']) or '(none)'}")
+    if (running['host'], running['port']) != (desired['host'], int(desired['port'])):
+        address = f"address {running['host']}:{running['port']} -> {desired['host']}:{desired['port']}"
+        if _is_hostname(running['host']) or _is_hostname(desired['host']):
+            # 'set server addr' only takes an IP
+            reload_reasons.append(address)
+        else:
+            details.append(address)
+            steps.append((f"set server {target} addr {desired['host']} port {desired['port']}",
+                          f"set server {target} addr {running['host']} port {running['port']}", False))
+
+    if validate_runtime_values(backend_name, desired['name'], desired['host'], running['host']):
+        reload_reasons.append('name or address not usable at runtime')
+
+    changes = []
+    if reload_reasons:
+        changes.append(_change(RELOAD, 'server', target, 'change', ', '.join(reload_reasons)))
+    elif steps:
+        changes.append(_change(RUNTIME, 'server', target, 'change', ', '.join(details), steps))
+    return changes
+
+
+def _diff_backend(desired, running, runtime):
+    """Changes for one backend present in both the desired and running config"""
+    name = desired['name']
+    if _settings(desired['config']) != _settings(running['config']):
+        return [_change(RELOAD, 'backend', name, 'change', 'backend settings changed')]
+
+    changes = []
+    wanted = {s['name']: dict(s, options=parse_server_options(s['options'])) for s in desired['servers']}
+    current = _running_servers(running, runtime)
+
+    for server_name in sorted(current.keys() - wanted.keys()):
+        target = f'{name}/{server_name}'
+        if validate_runtime_values(name, server_name):
+            changes.append(_change(RELOAD, 'server', target, 'remove', 'name not usable at runtime'))
+        else:
+            changes.append(_change(RUNTIME, 'server', target, 'remove', 'server removed',
+                                   delete_server_steps(name, server_name)))
+
+    for server_name in sorted(wanted.keys() - current.keys()):
+        server = wanted[server_name]
+        options = server['options']
+        target = f'{name}/{server_name}'
+        if options['other'] or validate_runtime_values(name, server_name, server['host'], server['port']):
+            changes.append(_change(RELOAD, 'server', target, 'add', 'server options need a reload'))
+            continue
+        row = {'server_name': server_name, 'address': server['host'], 'port': server['port'],
+               'weight': options['weight'], 'maxconn': options['maxconn'],
+               'check_enabled': options['check']}
+        changes.append(_change(RUNTIME, 'server', target, 'add', 'server added',
+                               add_server_steps(name, row)))
+
+    for server_name in sorted(wanted.keys() & current.keys()):
+        changes.extend(_diff_server(name, wanted[server_name], current[server_name]))
+
+    return changes
+
+
+def build_plan(desired_text, current_text, runtime, current=None):
+    """
+    Compare rendered and current config text plus the runtime servers
+    (None if unknown) and return (changes, unchanged), where unchanged is
+    the number of frontends, backends and sections that need nothing.
+    current is the already parsed current_text, if available.
+    """
+    if current_text is None:
+        return [_change(RELOAD, 'config', 'haproxy.cfg', 'add', 'no current configuration')], 0
+
+    if current is None:
+        current = parse_haproxy_config_text(current_text)
+    # Unchanged text only has to be checked against the runtime servers
+    desired = current if current_text == desired_text else parse_haproxy_config_text(desired_text)
+    changes = []
+    unchanged = 0
+
+    for section in ('global', 'defaults'):
+        if desired[section] != current[section]:
+            changes.append(_change(RELOAD, section, section, 'change', f'{section} section changed'))
+        else:
+            unchanged += 1
+
+    for kind in ('frontends', 'backends', 'listens'):
+        obj = kind[:-1]
+        wanted = {p['name']: p for p in desired[kind]}
+        running = {p['name']: p for p in current[kind]}
+        for name in sorted(running.keys() - wanted.keys()):
+            changes.append(_change(RELOAD, obj, name, 'remove', f'{obj} removed'))
+        for name in sorted(wanted.keys() - running.keys()):
+            changes.append(_change(RELOAD, obj, name, 'add', f'{obj} added'))
+        for name in sorted(wanted.keys() & running.keys()):
+            if kind == 'backends':
+                proxy_changes = _diff_backend(wanted[name], running[name], runtime)
+            else:
+                proxy_changes = [] if wanted[name]['config'] == running[name]['config'] else \
+                    [_change(RELOAD, obj, name, 'change', f'{obj} settings changed')]
+            changes.extend(proxy_changes)
+            unchanged += not proxy_changes
+
+    # peers, resolvers, userlists and the like
+    wanted = {(s['type'], s['name']): s['config'] for s in desired['other_sections']}
+    running = {(s['type'], s['name']): s['config'] for s in current['other_sections']}
+    for key in sorted(wanted.keys() | running.keys()):
+        name = ' '.join(filter(None, key))
+        if key not in wanted:
+            changes.append(_change(RELOAD, key[0], name, 'remove', f'{key[0]} section removed'))
+        elif key not in running:
+            changes.append(_change(RELOAD, key[0], name, 'add', f'{key[0]} section added'))
+        elif wanted[key] != running[key]:
+            changes.append(_change(RELOAD, key[0], name, 'change', f'{key[0]} section changed'))
+        else:
+            unchanged += 1
+
+    if not changes and desired_text != current_text:
+        changes.append(_change(NOOP, 'config', 'haproxy.cfg', 'change', 'only formatting differs'))
+
+    return changes, unchanged
+
+
+def choose_strategy(changes):
+    """'noop' if nothing runs differently, 'runtime' if the admin socket is enough, else 'reload'"""
+    kinds = {change['type'] for change in changes}
+    if RELOAD in kinds:
+        return RELOAD
+    if RUNTIME in kinds:
+        return RUNTIME
+    if NOOP in kinds:
+        # The file still has to be rewritten, which the runtime path does
+        return RUNTIME
+    return NOOP
+
+
+def plan_apply():
+    """
+    Dry run of an apply: the change set and the strategy it would use.
+    Returns dict with success, 'strategy', 'changes', 'counts' and the
+    rendered 'config' it compared.
+    """
+    try:
+        with job_phase('render'):
+            desired_text = render_config_from_db()
+
+        try:
+            current_file = get_config_cache().get(get_haproxy_config_path())
+        except FileNotFoundError:
+            current_file = None
+
+        with job_phase('read running state'):
+            runtime = read_servers_state()
+        with job_phase('plan'):
+            if current_file is None:
+                changes, unchanged = build_plan(desired_text, None, runtime.get('servers'))
+            else:
+                changes, unchanged = build_plan(desired_text, current_file.content, runtime.get('servers'),
+                                                current=current_file.parsed)
+                if current_file.hash != get_applied_config_hash():
+                    # Written without a reload (POST /api/config), or never
+                    # applied by us: HAProxy may run something else
+                    changes.insert(0, _change(RELOAD, 'config', 'haproxy.cfg', 'change',
+                                              'config file changed since the last apply'))
+
+        counts = {RUNTIME: 0, RELOAD: 0, NOOP: unchanged}
+        for change in changes:
+            counts[change['type']] += 1
+
+        result = {
+            'success': True,
+            'strategy': choose_strategy(changes),
+            'changes': changes,
+            'counts': counts,
+            'config': desired_text
+        }
+        if not runtime['success']:
+            result['warning'] = f"Running servers unknown, compared with the config file only: {runtime['error']}"
+        return result
+
+    except Exception as e:
+        return {'success': False, 'error': f'Failed to plan configuration apply: {str(e)}'}
+
+
+def _apply_runtime_plan(plan, username, ip_address):
+    """Write the new config without a reload and send the plan's commands"""
+    config_path = get_haproxy_config_path()
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    with job_phase('backup'):
+        backup_path = backup_current_config(username, timestamp, 'Auto-backup before runtime apply')
+
+    install_result = install_config(plan['config'], timestamp)
+    if not install_result['success']:
+        return install_result
+    warnings = install_result['warnings']
+
+    steps = [step for change in plan['changes'] for step in change['steps']]
+    runtime_result = {'success': True, 'commands': []}
+    if steps:
+        with job_phase('runtime commands'):
+            runtime_result = apply_runtime_steps(steps, 'apply configuration')
+    if 'warning' in runtime_result:
+        warnings.append(runtime_result['warning'])
+
+    if runtime_result['success']:
+        record_applied_config()
+        log_audit(username, 'apply_config', 'haproxy', None,
+                  f"Configuration applied at runtime ({len(runtime_result['commands'])} commands)", ip_address)
+        result = {
+            'success': True,
+            'strategy': RUNTIME,
+            'backup': backup_path,
+            'commands': runtime_result['commands'],
+            'message': 'Configuration applied without reloading HAProxy'
+        }
+    else:
+        # The runtime commands were reverted; the new file is in place, so a
+        # reload picks it up
+        warnings.append(f"Runtime apply failed, reloaded instead: {runtime_result['error']}")
+        with job_phase('reload'):
+            reload_result = reload_haproxy()
+        if not reload_result['success']:
+            copy_file_with_privileges(backup_path, config_path)
+            return reload_result
+        if 'warning' in reload_result:
+            warnings.append(reload_result['warning'])
+
+        verb = reload_verb(reload_result)
+        log_audit(username, 'apply_config', 'haproxy', None, f'Configuration applied and service {verb}', ip_address)
+        result = {
+            'success': True,
+            'strategy': RELOAD,
+            'backup': backup_path,
+            'message': f'Configuration applied and HAProxy {verb} successfully'
+        }
+        if 'reload' in reload_result:
+            result['reload'] = reload_result['reload']
+
+    if warnings:
+        result['warning'] = '; '.join(warnings)
+    return result
+
+
+def execute_plan(username, ip_address):
+    """
+    Apply the database configuration using the cheapest strategy.
+    Returns the apply result with the 'strategy' used and the 'plan' counts.
+    """
+    plan = plan_apply()
+    if not plan['success']:
+        return plan
+
+    try:
+        if plan['strategy'] == NOOP:
+            result = {'success': True, 'strategy': NOOP, 'message': 'Configuration already applied'}
+        elif plan['strategy'] == RUNTIME:
+            result = _apply_runtime_plan(plan, username, ip_address)
+        else:
+            result = apply_config_and_restart(username, ip_address, plan['config'])
+            if result['success']:
+                result['strategy'] = RELOAD
+    except Exception as e:
+        return {'success': False, 'error': f'Failed to apply configuration: {str(e)}'}
+
+    if result['success']:
+        result['plan'] = plan['counts']
+        if 'warning' in plan:
+            result['warning'] = '; '.join(filter(None, [plan['warning'], result.get('warning')]))
+    return result
@@ -0,0 +1,226 @@
+"""Fragment-cached HAProxy configuration renderer
+
+Both ways of producing haproxy.cfg, rendering the database for an apply
+(render_config_from_db) and writing a configuration posted to /api/config
+(write_haproxy_config), go through here. The file is built one section at
+a time and the text of each section is cached under a key made of
+everything it is rendered from. For database backends that is the backend
+row plus its servers' version from backend_server_versions, which triggers
+bump on every server insert, update and delete, so the servers of an
+unchanged backend are not even read. After a one-server edit only that
+server's backend is queried and formatted again; the file is the cached
+fragments joined together.
+"""
+import threading
+from collections import OrderedDict
+
+FRAGMENT_CACHE_SIZE = 20000
+
+# global section rendered from the database, and for posted configs without one
+DB_GLOBAL = (
+    'log /dev/log local0',
+    'log /dev/log local1 notice',
+    'chroot /var/lib/haproxy',
+    'stats socket /run/haproxy/admin.sock mode 660 level admin expose-fd listeners',
+    'stats timeout 30s',
+    'user haproxy',
+    'group haproxy',
+    'daemon',
+)
+
+DB_DEFAULTS = (
+    'log     global',
+    'mode    tcp',
+    'option  tcplog',
+    'option  dontlognull',
+    'timeout connect 5000',
+    'timeout client  50000',
+    'timeout server  50000',
+)
+
+# defaults section of a posted configuration that has none
+POSTED_DEFAULTS = (
+    'log     global',
+    'mode    http',
+    'option  httplog',
+    'option  dontlognull',
+    'timeout connect 5000',
+    'timeout client  50000',
+    'timeout server  50000',
+)
+
+
+def format_server_options(server):
+    """Config/runtime options ('check weight 3 ...') for a backend server row"""
+    options = []
+    if server['check_enabled']:
+        options.append('check')
+    if server['weight'] != 1:
+        options.append(f'weight {server["weight"]}')
+    if server['maxconn'] != 32:
+        options.append(f'maxconn {server["maxconn"]}')
+    return ' '.join(options)
+
+
+def with_expose_fd(line):
+    """
+    Add 'expose-fd listeners' to an admin-level stats socket line, so a
+    reload can hand the listening sockets over to the new process
+    """
+    if line.startswith('stats socket') and 'level admin' in line and 'expose-fd' not in line:
+        return f'{line} expose-fd listeners'
+    return line
+
+
+def _section(header, lines):
+    """Text of one section, ending with the blank line that separates it"""
+    return '\n'.join([header, *lines, ''])
+
+
+def _indented(lines):
+    return [f'    {line}' for line in lines]
+
+
+def _custom_lines(text, skip):
+    """Non-empty lines of a posted 'config' text, minus those starting with skip"""
+    return [f'    {line.strip()}' for line in text.split('\n')
+            if line.strip() and not line.strip().startswith(skip)]
+
+
+def _render_db_frontend(frontend):
+    lines = [f'    bind {frontend["bind_address"]}:{frontend["bind_port"]}', f'    mode {frontend["mode"]}']
+    if frontend['default_backend']:
+        lines.append(f'    default_backend {frontend["default_backend"]}')
+    return _section(f'frontend {frontend["name"]}', lines)
+
+
+def _render_db_backend(backend, servers):
+    lines = [f'    mode {backend["mode"]}', f'    balance {backend["balance"]}']
+    for server in servers:
+        # strip() also drops the indent of server lines, as it always has
+        lines.append(f'    server {server["server_name"]} {server["address"]}:{server["port"]} '
+                     f'{format_server_options(server)}'.strip())
+    return _section(f'backend {backend["name"]}', lines)
+
+
+def _render_posted_global(text):
+    if not text:
+        return _section('global', _indented(DB_GLOBAL))
+    return _section('global', _indented(with_expose_fd(line.strip()) for line in text.split('\n') if line.strip()))
+
+
+def _render_posted_defaults(text):
+    if not text:
+        return _section('defaults', _indented(POSTED_DEFAULTS))
+    return _section('defaults', _indented(line.strip() for line in text.split('\n') if line.strip()))
+
+
+def _render_posted_frontend(name, binds, default_backend, config):
+    lines = [f'    bind {bind}' for bind in binds]
+    if default_backend:
+        lines.append(f'    default_backend {default_backend}')
+    if config is not None:
+        lines.extend(_custom_lines(config, ('bind', 'default_backend')))
+    return _section(f'frontend {name}', lines)
+
+
+def _render_posted_backend(name, balance, servers, config):
+    lines = [f'    balance {balance}']
+    for server_name, host, port, options in servers:
+        lines.append(f'    server {server_name} {host}:{port} {options}'.strip())
+    if config is not None:
+        lines.extend(_custom_lines(config, ('balance', 'server')))
+    return _section(f'backend {name}', lines)
+
+
+class ConfigRenderer:
+    """Renders configurations from sections, caching each section's text"""
+
+    def __init__(self, max_fragments=FRAGMENT_CACHE_SIZE):
+        self.max_fragments = max_fragments
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _cached(self, key):
+        with self._lock:
+            text = self._fragments.get(key)
+            if text is not None:
+                self.hits += 1
+                self._fragments.move_to_end(key)
+            return text
+
+    def fragment(self, key, render, *args):
+        """Cached text of the section identified by key, else render(*args)"""
+        text = self._cached(key)
+        if text is not None:
+            return text
+
+        text = render(*args)
+        with self._lock:
+            self.misses += 1
+            self._fragments[key] = text
+            while len(self._fragments) > self.max_fragments:
+                self._fragments.popitem(last=False)
+        return text
+
+    def render_db(self, frontends, backends, load_servers):
+        """
+        Configuration from database rows: frontends_servers rows, and
+        backend_servers rows that include their 'servers_version'.
+        load_servers(backend_names) returns {backend name: enabled
+        backend_server_list rows} for all backends whose text is not cached,
+        in one call.
+        """
+        fragment = self.fragment
+        parts = [
+            fragment(('global', DB_GLOBAL), _section, 'global', _indented(DB_GLOBAL)),
+            fragment(('defaults', DB_DEFAULTS), _section, 'defaults', _indented(DB_DEFAULTS)),
+        ]
+        for frontend in frontends:
+            parts.append(fragment(('db-frontend', tuple(frontend)), _render_db_frontend, frontend))
+
+        # Every column of the row, servers_version included
+        keys = [('db-backend', tuple(backend)) for backend in backends]
+        texts = [self._cached(key) for key in keys]
+        missing = [backend['name'] for backend, text in zip(backends, texts) if text is None]
+        servers = load_servers(missing) if missing else {}
+        for backend, key, text in zip(backends, keys, texts):
+            if text is None:
+                text = fragment(key, _render_db_backend, backend, servers.get(backend['name'], ()))
+            parts.append(text)
+        return '\n'.join(parts)
+
+    def render_posted(self, config_data):
+        """Configuration from a posted dict of global, defaults, frontends and backends"""
+        fragment = self.fragment
+        global_text = config_data.get('global') or ''
+        defaults_text = config_data.get('defaults') or ''
+        parts = [
+            fragment(('posted-global', global_text), _render_posted_global, global_text),
+            fragment(('posted-defaults', defaults_text), _render_posted_defaults, defaults_text),
+        ]
+        for frontend in config_data.get('frontends', []):
+            args = (frontend['name'], tuple(frontend.get('binds', [])), frontend.get('default_backend'),
+                    frontend.get('config'))
+            parts.append(fragment(('posted-frontend',) + args, _render_posted_frontend, *args))
+        for backend in config_data.get('backends', []):
+            servers = tuple((s['name'], s['host'], s['port'], s.get('options', ''))
+                            for s in backend.get('servers', []))
+            args = (backend['name'], backend.get('balance', 'roundrobin'), servers, backend.get('config'))
+            parts.append(fragment(('posted-backend',) + args, _render_posted_backend, *args))
+        return '\n'.join(parts)
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_config_renderer():
+    """Get the shared config renderer"""
+    global _renderer
+    with _renderer_lock:
+        if _renderer is None:
+            _renderer = ConfigRenderer()
+        return _renderer
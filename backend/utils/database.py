@@ -1,15 +1,156 @@
 """Database schema and utilities for HAProxy Manager"""
+import logging
 import sqlite3
 import os
-from datetime import datetime
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from itertools import groupby
+from operator import itemgetter
+
+# Prepared statements kept per connection (sqlite3 default: 128)
+STATEMENT_CACHE_SIZE = 512
+
+logger = logging.getLogger(__name__)
+
+# Connections of finished requests kept open for the next ones
+IDLE_CONNECTIONS = int(os.getenv('DATABASE_IDLE_CONNECTIONS', '8'))
+
+# Per thread, or per greenlet under gevent's monkey patching: a connection
+# (and its transaction) is never used by two requests at once
+_local = threading.local()
+_idle = []
+_idle_lock = threading.Lock()
+
+class ThreadConnection(sqlite3.Connection):
+    """
+    Connection used by one thread (or greenlet) at a time. close() leaves
+    it open; at the end of a request it goes back to the idle connections
+    for the next request to reuse. Write inside ``with conn.transaction():``.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._depth = 0
+
+    def close(self):
+        """Nothing to do: the connection stays open for the thread"""
+
+    def close_for_good(self):
+        sqlite3.Connection.close(self)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Commit what the block writes, or roll it back if it raises. Inside
+        a transaction that is already open (a helper called by a caller
+        that has not committed yet) the block is a savepoint instead: it
+        only ever undoes its own writes, and the caller commits both.
+        """
+        nested = self._depth > 0 or self.in_transaction
+        savepoint = f'nested_{self._depth}'
+        self.execute(f'SAVEPOINT {savepoint}' if nested else 'BEGIN')
+        self._depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._depth -= 1
+            if nested:
+                self.execute(f'ROLLBACK TO {savepoint}')
+                self.execute(f'RELEASE {savepoint}')
+            else:
+                self.rollback()
+            raise
+        self._depth -= 1
+        if nested:
+            self.execute(f'RELEASE {savepoint}')
+        else:
+            self.commit()
+
+def _open_connection(db_path):
+    # timeout is SQLite's busy_timeout: wait that long for a lock held by
+    # another connection instead of failing with 'database is locked'.
+    # Idle connections move between threads, one user at a time.
+    conn = sqlite3.connect(
+        db_path,
+        timeout=float(os.getenv('DATABASE_BUSY_TIMEOUT', '5')),
+        cached_statements=STATEMENT_CACHE_SIZE,
+        check_same_thread=False,
+        factory=ThreadConnection
+    )
+    conn.row_factory = sqlite3.Row
+    # WAL: readers no longer wait for the writer (and the other way round),
+    # and with synchronous=NORMAL a commit does not fsync, only checkpoints do
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f"PRAGMA mmap_size = {int(os.getenv('DATABASE_MMAP_SIZE', str(64 * 1024 * 1024)))}")
+    conn.execute('PRAGMA foreign_keys = ON')
+    return conn
+
+def open_db_connection():
+    """A connection of the caller's own, e.g. for a background writer"""
+    return _open_connection(os.getenv('DATABASE_PATH', '/var/lib/haproxy-manager/users.db'))
+
+def _take_idle_connection(key):
+    """An idle connection for (pid, path), or None"""
+    with _idle_lock:
+        while _idle:
+            idle_key, conn = _idle.pop()
+            if idle_key == key:
+                return conn
+            # A connection inherited through fork() must not be used, nor closed
+            if idle_key[0] == key[0]:
+                conn.close_for_good()
+    return None
 
 def get_db_connection():
-    """Get database connection"""
+    """
+    Get the current thread's (or greenlet's) database connection: an idle
+    one left by an earlier request, or a new one. DATABASE_PATH is read on
+    every call.
+    """
     db_path = os.getenv('DATABASE_PATH', '/var/lib/haproxy-manager/users.db')
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
+    key = (os.getpid(), db_path)
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.key != key:
+        if conn is not None and _local.key[0] == key[0]:
+            conn.close_for_good()
+        conn = _take_idle_connection(key) or _open_connection(db_path)
+        _local.conn = conn
+        _local.key = key
     return conn
 
+def release_db_connection():
+    """
+    Roll back what the request left uncommitted, e.g. when an error skipped
+    its commit, and keep the connection for the next request. Called at the
+    end of every request.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        return
+    _local.conn = None
+    if conn.in_transaction:
+        conn.rollback()
+    conn._depth = 0
+    with _idle_lock:
+        if _local.key[0] == os.getpid() and len(_idle) < IDLE_CONNECTIONS:
+            _idle.append((_local.key, conn))
+            return
+    conn.close_for_good()
+
+def close_db_connection():
+    """Really close the current thread's connection and the idle ones"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        _local.conn = None
+        conn.close_for_good()
+    with _idle_lock:
+        idle = [conn for key, conn in _idle if key[0] == os.getpid()]
+        _idle.clear()
+    for conn in idle:
+        conn.close_for_good()
+
 def init_database():
     """Initialize all database tables"""
     db_path = os.getenv('DATABASE_PATH', '/var/lib/haproxy-manager/users.db')
@@ -75,6 +216,26 @@ def init_database():
         )
     ''')
 
+    # Bumped on every change to a backend's servers, so the config renderer
+    # can reuse a backend's rendered text without reading its servers
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS backend_server_versions (
+            backend_name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+    for event, row in (('INSERT', 'NEW'), ('UPDATE', 'OLD'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS backend_server_list_{event.lower()}_{row.lower()}_version
+            AFTER {event} ON backend_server_list
+            BEGIN
+                INSERT INTO backend_server_versions (backend_name, version)
+                VALUES ({row}.backend_name, 1)
+                ON CONFLICT(backend_name) DO UPDATE SET version = version + 1;
+            END
+        ''')
+
     # Connection history tracking
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS connection_history (
@@ -129,38 +290,181 @@ def init_database():
         )
     ''')
 
+    # Keyset pagination and prefix filters of the list endpoints
+    # (see list_query.py); name/username columns already have unique indexes
+    for name, table, columns in (
+        ('idx_frontend_servers_bind_address', 'frontend_servers', 'bind_address'),
+        ('idx_backend_server_list_address', 'backend_server_list', 'address'),
+        ('idx_config_backups_created', 'config_backups', 'created_at, id'),
+    ):
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table}({columns})')
+
+    # Active connections only, newest first
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_connection_history_active
+        ON connection_history(connected_at, id) WHERE disconnected_at IS NULL
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_connection_history_active_client
+        ON connection_history(client_ip) WHERE disconnected_at IS NULL
+    ''')
+
+    migrate_database(cursor)
+
     conn.commit()
     conn.close()
 
-def log_audit(username, action, resource_type, resource_name=None, details=None, ip_address=None):
-    """Log an audit entry"""
+def _drop_orphan_servers(cursor):
+    """
+    Foreign keys are enforced from now on: drop the servers of backends
+    deleted before, which were neither listed nor rendered
+    """
+    cursor.execute('''
+        SELECT id, backend_name, server_name, address, port FROM backend_server_list
+        WHERE backend_name NOT IN (SELECT name FROM backend_servers)
+    ''')
+    for server_id, backend_name, server_name, address, port in cursor.fetchall():
+        logger.warning('Removing server %s/%s (%s:%s, id %s): backend %s no longer exists',
+                       backend_name, server_name, address, port, server_id, backend_name)
+        cursor.execute('DELETE FROM backend_server_list WHERE id = ?', (server_id,))
+
+# Data migrations, run once each in this order; PRAGMA user_version is the
+# number of them applied to a database
+MIGRATIONS = (
+    _drop_orphan_servers,
+)
+
+def migrate_database(cursor):
+    """Run the migrations a database has not had yet"""
+    version = cursor.execute('PRAGMA user_version').fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        migration(cursor)
+        cursor.execute(f'PRAGMA user_version = {number}')
+
+def _audit_timestamp():
+    # Taken when the event happens, not when its batch is written; same
+    # format as CURRENT_TIMESTAMP
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def write_audit_entries(entries, conn=None):
+    """
+    Insert audit entries, (username, action, resource_type, resource_name,
+    details, ip_address, created_at) tuples, in one transaction (on conn,
+    by default the current thread's connection)
+    """
+    conn = conn or get_db_connection()
+
+    with conn.transaction():
+        conn.executemany('''
+            INSERT INTO audit_log (username, action, resource_type, resource_name, details, ip_address, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', entries)
+
+def log_audit(username, action, resource_type, resource_name=None, details=None, ip_address=None, sync=False):
+    """
+    Log an audit entry. It is written in the background (see audit_log.py);
+    with sync=True, return only once it is committed.
+    """
+    log_audit_many([(username, action, resource_type, resource_name, details, ip_address)], sync=sync)
+
+def log_audit_many(entries, sync=False):
+    """
+    Log many audit entries, written in a single transaction.
+    entries is a list of (username, action, resource_type, resource_name,
+    details, ip_address) tuples.
+    """
+    if not entries:
+        return
+
+    # Imported here: audit_log.py uses this module
+    from .audit_log import get_audit_writer
+
+    timestamp = _audit_timestamp()
+    entries = [tuple(entry) + (timestamp,) for entry in entries]
+    writer = get_audit_writer()
+    if writer is None:
+        write_audit_entries(entries)
+    else:
+        writer.submit(entries, sync=sync)
+
+BACKEND_FIELDS = ('id', 'name', 'mode', 'balance', 'enabled', 'created_at', 'updated_at')
+SERVER_FIELDS = ('id', 'server_name', 'address', 'port', 'enabled', 'weight', 'maxconn', 'check_enabled')
+
+# Above this many backends, attach_servers() reads every server
+SERVER_IN_LIMIT = 500
+
+def attach_servers(backends):
+    """
+    Fill the 'servers' list of backend dicts, ordered by server name, with
+    one query streamed in (backend, server) order and grouped in one pass.
+    """
+    servers_by_backend = {}
+    for backend in backends:
+        backend['servers'] = servers_by_backend[backend['name']] = []
+    if not backends:
+        return backends
+
     conn = get_db_connection()
     cursor = conn.cursor()
+    # Plain tuples: building the dicts from them is much cheaper than from Rows
+    cursor.row_factory = None
 
-    cursor.execute('''
-        INSERT INTO audit_log (username, action, resource_type, resource_name, details, ip_address)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (username, action, resource_type, resource_name, details, ip_address))
+    columns = ', '.join(SERVER_FIELDS)
+    if len(servers_by_backend) <= SERVER_IN_LIMIT:
+        names = list(servers_by_backend)
+        cursor.execute(f'''
+            SELECT backend_name, {columns}
+            FROM backend_server_list
+            WHERE backend_name IN ({', '.join('?' * len(names))})
+            ORDER BY backend_name, server_name
+        ''', names)
+    else:
+        cursor.execute(f'''
+            SELECT backend_name, {columns}
+            FROM backend_server_list
+            ORDER BY backend_name, server_name
+        ''')
+    for backend_name, rows in groupby(cursor, key=itemgetter(0)):
+        servers = servers_by_backend.get(backend_name)
+        # Servers of a backend that no longer exists are not listed
+        if servers is not None:
+            servers.extend(dict(zip(SERVER_FIELDS, row[1:])) for row in rows)
 
-    conn.commit()
     conn.close()
+    return backends
+
+def get_backends_with_servers():
+    """
+    Get all backends, each with its 'servers' list, ordered by name.
+    Two queries in total: the backends, then every server.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.row_factory = None
+
+    cursor.execute(f'''
+        SELECT {', '.join(BACKEND_FIELDS)}
+        FROM backend_servers
+        ORDER BY name
+    ''')
+    backends = [dict(zip(BACKEND_FIELDS, row)) for row in cursor.fetchall()]
+    conn.close()
+
+    return attach_servers(backends)
 
 def add_user(username, password_hash):
     """Add a new user to the database"""
     conn = get_db_connection()
-    cursor = conn.cursor()
 
     try:
-        cursor.execute(
-            'INSERT INTO users (username, password_hash) VALUES (?, ?)',
-            (username, password_hash)
-        )
-        conn.commit()
+        with conn.transaction():
+            conn.execute(
+                'INSERT INTO users (username, password_hash) VALUES (?, ?)',
+                (username, password_hash)
+            )
         return True
     except sqlite3.IntegrityError:
         return False
-    finally:
-        conn.close()
 
 def get_all_users():
     """Get all users (without password hashes)"""
@@ -179,28 +483,20 @@ def delete_user(username):
         return False  # Protect admin user
 
     conn = get_db_connection()
-    cursor = conn.cursor()
 
-    cursor.execute('DELETE FROM users WHERE username = ?', (username,))
-    deleted = cursor.rowcount > 0
-
-    conn.commit()
-    conn.close()
+    with conn.transaction():
+        deleted = conn.execute('DELETE FROM users WHERE username = ?', (username,)).rowcount > 0
 
     return deleted
 
 def change_password(username, new_password_hash):
     """Change user password"""
     conn = get_db_connection()
-    cursor = conn.cursor()
 
-    cursor.execute(
-        'UPDATE users SET password_hash = ? WHERE username = ?',
-        (new_password_hash, username)
-    )
-    updated = cursor.rowcount > 0
-
-    conn.commit()
-    conn.close()
+    with conn.transaction():
+        updated = conn.execute(
+            'UPDATE users SET password_hash = ? WHERE username = ?',
+            (new_password_hash, username)
+        ).rowcount > 0
 
     return updated
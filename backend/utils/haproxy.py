@@ -1,12 +1,26 @@
 """HAProxy management utilities"""
 import subprocess
-import socket
 import os
 import re
 import hashlib
 import shutil
+import threading
+import time
+from collections import OrderedDict
+from itertools import groupby
+from operator import itemgetter
 from datetime import datetime
 from .database import get_db_connection, log_audit
+from .admin_socket import (
+    AdminSocketError, close_admin_socket_pools, fan_out, get_admin_socket_pool, send_command,
+    send_commands, send_master_command
+)
+from .config_cache import get_config_cache
+from .config_parser import parse_config, parse_server, paused_gc
+from .config_render import format_server_options, get_config_renderer
+from .jobs import job_phase
+from .reload_metrics import ListenerProbe, get_reload_tracker
+from .stats_parser import StatCsvParser, aggregate_stats, empty_stats, merge_stats, parse_proxy_index
 
 def get_haproxy_config_path():
     """Get HAProxy configuration file path"""
@@ -35,6 +49,7 @@ def copy_file_with_privileges(source, destination, timeout=5):
         # First try direct copy (no sudo)
         try:
             shutil.copy2(source, destination)
+            get_config_cache().invalidate(destination)
             return {'success': True}
         except PermissionError:
             pass  # Try with sudo
@@ -58,6 +73,7 @@ def copy_file_with_privileges(source, destination, timeout=5):
         if result.returncode != 0:
             return {'success': False, 'error': f'Failed to copy file: {result.stderr}'}
 
+        get_config_cache().invalidate(destination)
         return {'success': True}
 
     except FileNotFoundError as e:
@@ -98,6 +114,65 @@ def restart_haproxy_service():
     except Exception as e:
         return {'success': False, 'error': f'Failed to restart HAProxy: {str(e)}'}
 
+VALIDATION_CACHE_SIZE = 64
+
+_validation_cache = OrderedDict()
+_validation_lock = threading.Lock()
+_versions = {}
+
+def get_haproxy_version(haproxy_binary):
+    """
+    First line of 'haproxy -v', cached until the binary changes on disk
+    """
+    stat = os.stat(haproxy_binary)
+    signature = (stat.st_mtime_ns, stat.st_size)
+
+    cached = _versions.get(haproxy_binary)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    result = subprocess.run([haproxy_binary, '-v'], capture_output=True, text=True, timeout=5)
+    version = (result.stdout.strip().splitlines() or [''])[0]
+    _versions[haproxy_binary] = (signature, version)
+    return version
+
+# Absolute paths in a config: certificates, CA files, maps, error files...
+_PATH_PATTERN = re.compile(r'(?<![\w:./])/[^\s,()\'"]+')
+
+def referenced_files_signature(content):
+    """
+    (path, mtime_ns, size) of every absolute path the config mentions, so
+    that a cached validation no longer applies once one of them changes
+    """
+    signature = []
+    for path in sorted(set(_PATH_PATTERN.findall(content))):
+        try:
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append((path, None, None))
+    return tuple(signature)
+
+def _get_cached_validation(key):
+    """Validation result for (content hash, HAProxy version, referenced files), if still fresh"""
+    ttl = float(os.getenv('HAPROXY_VALIDATION_CACHE_TTL', '3600'))
+    with _validation_lock:
+        entry = _validation_cache.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > ttl:
+            del _validation_cache[key]
+            return None
+        _validation_cache.move_to_end(key)
+        return entry[1]
+
+def _cache_validation(key, result):
+    with _validation_lock:
+        _validation_cache[key] = (time.monotonic(), result)
+        _validation_cache.move_to_end(key)
+        while len(_validation_cache) > VALIDATION_CACHE_SIZE:
+            _validation_cache.popitem(last=False)
+
 def validate_haproxy_config(config_path):
     """Validate HAProxy configuration file"""
     haproxy_binary = get_haproxy_binary_path()
@@ -116,6 +191,17 @@ def validate_haproxy_config(config_path):
             return {'success': False, 'error': 'HAProxy binary not found. Set HAPROXY_BINARY environment variable or install HAProxy.'}
 
     try:
+        try:
+            config = get_config_cache().get(config_path)
+        except FileNotFoundError:
+            config = None
+        cache_key = (config.hash, get_haproxy_version(haproxy_binary),
+                     referenced_files_signature(config.content)) if config else None
+
+        cached = _get_cached_validation(cache_key) if cache_key else None
+        if cached is not None:
+            return dict(cached, cached=True)
+
         result = subprocess.run(
             [haproxy_binary, '-c', '-f', config_path],
             capture_output=True,
@@ -124,212 +210,327 @@ def validate_haproxy_config(config_path):
         )
 
         if result.returncode != 0:
+            # Not cached: the fix may well be in a file the config refers to
             return {'success': False, 'error': f'Configuration validation failed: {result.stderr}'}
 
-        return {'success': True}
+        validation = {'success': True}
+        if cache_key:
+            _cache_validation(cache_key, validation)
+        return validation
     except subprocess.TimeoutExpired:
         return {'success': False, 'error': 'Configuration validation timed out'}
     except Exception as e:
         return {'success': False, 'error': f'Failed to validate configuration: {str(e)}'}
 
-def read_haproxy_stats():
-    """Read HAProxy statistics from admin socket"""
-    socket_path = get_haproxy_socket_path()
+# 'show stat' type filter bits
+STAT_TYPE_FRONTEND = 1
+STAT_TYPE_BACKEND = 2
+STAT_TYPE_SERVER = 4
+STAT_TYPES = {
+    'frontend': STAT_TYPE_FRONTEND,
+    'backend': STAT_TYPE_BACKEND,
+    'server': STAT_TYPE_SERVER
+}
+
+# Proxy ids only change on reload; refresh the cached map periodically and
+# whenever a lookup misses or returns rows for a different proxy.
+PROXY_INDEX_TTL = 60.0
+_proxy_indexes = {}
+_proxy_index_lock = threading.Lock()
+
+def get_admin_endpoints():
+    """
+    Get the HAProxy admin endpoints as a list of (name, address) pairs.
+    HAPROXY_ADMIN_ENDPOINTS is a comma-separated list of [name=]address,
+    where address is a Unix socket path or tcp://host:port. Falls back to
+    the single HAPROXY_SOCKET_PATH socket.
+    """
+    configured = os.getenv('HAPROXY_ADMIN_ENDPOINTS', '').strip()
+    if not configured:
+        return [('default', get_haproxy_socket_path())]
+
+    endpoints = []
+    for item in configured.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, sep, address = item.partition('=')
+        if not sep:
+            name, address = item, item
+        endpoints.append((name.strip(), address.strip()))
+    return endpoints
+
+def get_endpoint_timeout():
+    """Per-endpoint deadline in seconds for fanned-out admin socket calls"""
+    return float(os.getenv('HAPROXY_ENDPOINT_TIMEOUT', '3'))
+
+def _socket_error_message(error, address, action):
+    """Turn an admin socket exception into the user-facing error string"""
+    if isinstance(error, FileNotFoundError):
+        return f'HAProxy socket not found at {address}'
+    if isinstance(error, PermissionError):
+        return f'Permission denied to access HAProxy socket at {address}'
+    if isinstance(error, TimeoutError):
+        return f'Failed to {action}: {address} timed out'
+    return f'Failed to {action}: {str(error)}'
+
+def _fan_out_stats(func, action):
+    """
+    Run func(address) -> stats dict against every admin endpoint and
+    aggregate the results. Failing endpoints are listed under 'errors'
+    unless all of them failed.
+    Returns (aggregated stats, {name: stats} per instance).
+    """
+    endpoints = get_admin_endpoints()
+    addresses = dict(endpoints)
+    results = fan_out(func, endpoints, get_endpoint_timeout())
+
+    instances = {}
+    errors = {}
+    for name, result, error in results:
+        if error is not None:
+            errors[name] = _socket_error_message(error, addresses[name], action)
+        elif 'error' in result:
+            errors[name] = result['error']
+        else:
+            instances[name] = result
+
+    if not instances:
+        stats = {'error': '; '.join(dict.fromkeys(errors.values()))}
+        # Not found on every endpoint that answered
+        answered = [result for _, result, _ in results if result is not None]
+        if answered and all(result.get('not_found') for result in answered):
+            stats['not_found'] = True
+        return stats, {}
+
+    stats = aggregate_stats(list(instances.items()))
+    if errors:
+        stats = dict(stats, errors=errors)
+    return stats, instances
+
+def _read_stats_from(address, proxy_id=-1, type_mask=-1):
+    """Read and parse 'show stat' from one admin endpoint"""
+    if proxy_id == -1 and type_mask == -1:
+        command = 'show stat'
+    else:
+        command = f'show stat {proxy_id} {type_mask} -1'
+
+    # Stream 'show stat' from a pooled admin socket connection straight
+    # into the incremental CSV parser
+    parser = StatCsvParser()
+    get_admin_socket_pool(address).stream(command, parser.feed)
+    return parser.close()
+
+def read_haproxy_stats(breakdown=False):
+    """
+    Read HAProxy statistics from every admin endpoint, aggregated.
+    With breakdown, per-instance stats are included under 'instances'.
+    """
+    stats, instances = _fan_out_stats(_read_stats_from, 'read HAProxy stats')
+    if breakdown and instances:
+        stats = dict(stats, instances=instances)
+    return stats
+
+def _read_sample_from(address):
+    """Read 'show stat' and 'show info' over one admin socket session"""
+    # A pooled connection may have been closed by a reload; retry once
+    for attempt in range(2):
+        parser = StatCsvParser(keep_raw=True)
+        try:
+            with get_admin_socket_pool(address).connection() as conn:
+                conn.stream('show stat', parser.feed)
+                info = conn.execute('show info')
+            break
+        except (AdminSocketError, ConnectionError):
+            if attempt:
+                raise
 
-    try:
-        # Connect to HAProxy admin socket
-        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        sock.connect(socket_path)
-
-        # Send 'show stat' command
-        sock.sendall(b'show stat\n')
-
-        # Read response
-        response = b''
-        while True:
-            chunk = sock.recv(4096)
-            if not chunk:
-                break
-            response += chunk
+    return {'stats': parser.close(), 'stat_csv': bytes(parser.raw), 'info': info}
 
-        sock.close()
+def read_stats_sample():
+    """
+    Collect one stats sample for the background sampler, from all admin
+    endpoints concurrently.
+    Returns dict with aggregated 'stats' and per-instance 'instances', each
+    holding parsed 'stats', the raw 'stat_csv' bytes and 'info' text.
+    """
+    samples = {}
 
-        # Parse CSV response
-        lines = response.decode('utf-8').strip().split('\n')
-        if not lines:
-            return None
+    def collect(address):
+        sample = _read_sample_from(address)
+        samples[address] = sample
+        return sample['stats']
 
-        # First line is headers
-        headers = lines[0].strip('# ').split(',')
-
-        stats = {
-            'frontends': [],
-            'backends': [],
-            'servers': [],
-            'summary': {
-                'total_sessions': 0,
-                'current_sessions': 0,
-                'bytes_in': 0,
-                'bytes_out': 0
-            }
-        }
+    stats, instances = _fan_out_stats(collect, 'read HAProxy stats')
+    endpoints = dict(get_admin_endpoints())
 
-        for line in lines[1:]:
-            if not line.strip():
-                continue
+    return {
+        'stats': stats,
+        'instances': {name: samples[endpoints[name]] for name in instances}
+    }
 
-            values = line.split(',')
-            if len(values) < len(headers):
+def get_proxy_index(address, refresh=False):
+    """
+    Get the cached proxy name -> id map of one admin endpoint, used for
+    filtered stats. Raises on socket errors.
+    """
+    with _proxy_index_lock:
+        cached = _proxy_indexes.get(address)
+        if not refresh and cached and time.monotonic() - cached['loaded_at'] <= PROXY_INDEX_TTL:
+            return cached['proxies']
+
+    # Frontend and backend rows only - servers are not needed for the map
+    response = send_command(f'show stat -1 {STAT_TYPE_FRONTEND | STAT_TYPE_BACKEND} -1', address)
+    proxies = parse_proxy_index(response)
+
+    with _proxy_index_lock:
+        _proxy_indexes[address] = {'proxies': proxies, 'loaded_at': time.monotonic()}
+
+    return proxies
+
+def _read_filtered_stats_from(address, frontend, backend, type_mask):
+    """Filtered 'show stat' against one admin endpoint"""
+    if not frontend and not backend:
+        return _read_stats_from(address, -1, type_mask)
+
+    # Frontend rows only exist on the frontend side, backend and server rows
+    # on the backend side
+    lookups = []
+    if frontend:
+        lookups.append((frontend, 'frontend', type_mask & STAT_TYPE_FRONTEND))
+    if backend:
+        lookups.append((backend, 'backend', type_mask & (STAT_TYPE_BACKEND | STAT_TYPE_SERVER)))
+
+    stats = empty_stats()
+    for name, side, mask in lookups:
+        if not mask:
+            continue
+
+        result = None
+        for refresh in (False, True):
+            proxy = get_proxy_index(address, refresh=refresh).get(name)
+            if not proxy or not proxy[side]:
                 continue
 
-            entry = dict(zip(headers, values))
-
-            pxname = entry.get('pxname', '')
-            svname = entry.get('svname', '')
-
-            # Frontend
-            if svname == 'FRONTEND':
-                stats['frontends'].append({
-                    'name': pxname,
-                    'status': entry.get('status', 'UNKNOWN'),
-                    'sessions_current': int(entry.get('scur', 0) or 0),
-                    'sessions_total': int(entry.get('stot', 0) or 0),
-                    'bytes_in': int(entry.get('bin', 0) or 0),
-                    'bytes_out': int(entry.get('bout', 0) or 0),
-                    'requests_total': int(entry.get('req_tot', 0) or 0),
-                    'rate': int(entry.get('rate', 0) or 0)
-                })
-
-            # Backend
-            elif svname == 'BACKEND':
-                stats['backends'].append({
-                    'name': pxname,
-                    'status': entry.get('status', 'UNKNOWN'),
-                    'sessions_current': int(entry.get('scur', 0) or 0),
-                    'sessions_total': int(entry.get('stot', 0) or 0),
-                    'bytes_in': int(entry.get('bin', 0) or 0),
-                    'bytes_out': int(entry.get('bout', 0) or 0),
-                    'queue_current': int(entry.get('qcur', 0) or 0),
-                    'active_servers': int(entry.get('act', 0) or 0),
-                    'backup_servers': int(entry.get('bck', 0) or 0)
-                })
-
-            # Server
-            elif svname not in ('FRONTEND', 'BACKEND'):
-                stats['servers'].append({
-                    'backend': pxname,
-                    'name': svname,
-                    'status': entry.get('status', 'UNKNOWN'),
-                    'weight': int(entry.get('weight', 0) or 0),
-                    'sessions_current': int(entry.get('scur', 0) or 0),
-                    'sessions_total': int(entry.get('stot', 0) or 0),
-                    'bytes_in': int(entry.get('bin', 0) or 0),
-                    'bytes_out': int(entry.get('bout', 0) or 0),
-                    'check_status': entry.get('check_status', ''),
-                    'last_status_change': entry.get('lastchg', ''),
-                    'downtime': int(entry.get('downtime', 0) or 0)
-                })
-
-                # Add to summary
-                stats['summary']['total_sessions'] += int(entry.get('stot', 0) or 0)
-                stats['summary']['current_sessions'] += int(entry.get('scur', 0) or 0)
-                stats['summary']['bytes_in'] += int(entry.get('bin', 0) or 0)
-                stats['summary']['bytes_out'] += int(entry.get('bout', 0) or 0)
-
-        return stats
+            result = _read_stats_from(address, proxy['iid'], mask)
 
-    except FileNotFoundError:
-        return {'error': f'HAProxy socket not found at {socket_path}'}
-    except PermissionError:
-        return {'error': f'Permission denied to access HAProxy socket at {socket_path}'}
-    except Exception as e:
-        return {'error': f'Failed to read HAProxy stats: {str(e)}'}
-
-def parse_haproxy_config():
-    """Parse HAProxy configuration file"""
-    config_path = get_haproxy_config_path()
-
-    try:
-        with open(config_path, 'r') as f:
-            content = f.read()
-
-        config = {
-            'frontends': [],
-            'backends': [],
-            'global': '',
-            'defaults': ''
-        }
+            # A reload may have renumbered proxies since the map was built
+            rows = result['frontends'] + result['backends']
+            names = {row['name'] for row in rows} | {row['backend'] for row in result['servers']}
+            if names <= {name}:
+                break
+            result = None
 
-        # Extract global section
-        global_match = re.search(r'global\s+(.*?)(?=\n\S|\Z)', content, re.DOTALL)
-        if global_match:
-            config['global'] = global_match.group(1).strip()
+        if result is None:
+            return {'error': f'{side.capitalize()} not found: {name}', 'not_found': True}
 
-        # Extract defaults section
-        defaults_match = re.search(r'defaults\s+(.*?)(?=\nfrontend|\nbackend|\nlisten|\Z)', content, re.DOTALL)
-        if defaults_match:
-            config['defaults'] = defaults_match.group(1).strip()
+        merge_stats(stats, result)
 
-        # Extract frontends
-        frontend_pattern = r'frontend\s+(\S+)\s+(.*?)(?=\nfrontend|\nbackend|\nlisten|\Z)'
-        for match in re.finditer(frontend_pattern, content, re.DOTALL):
-            name = match.group(1)
-            body = match.group(2).strip()
+    return stats
 
-            # Parse bind addresses
-            binds = re.findall(r'bind\s+([^\n]+)', body)
+def read_filtered_stats(frontend=None, backend=None, types=None, breakdown=False):
+    """
+    Read statistics for a single frontend and/or backend and/or a subset of
+    row types, letting HAProxy do the filtering on every admin endpoint.
+    types is a list of 'frontend', 'backend' and 'server'.
+    Returns the usual stats dict, or dict with 'error' (and 'not_found' when
+    a requested proxy does not exist on any endpoint).
+    """
+    type_mask = 0
+    for stat_type in types or STAT_TYPES:
+        type_mask |= STAT_TYPES[stat_type]
+
+    stats, instances = _fan_out_stats(
+        lambda address: _read_filtered_stats_from(address, frontend, backend, type_mask),
+        'read HAProxy stats'
+    )
+    if breakdown and instances:
+        stats = dict(stats, instances=instances)
+    return stats
+
+def read_haproxy_config():
+    """
+    Read and parse the HAProxy configuration file through the config cache.
+    Returns dict with success/error, the parsed 'config' (shared, do not
+    modify), the raw 'content' and its SHA-256 'hash'.
+    """
+    config_path = get_haproxy_config_path()
 
-            # Parse default backend
-            default_backend = ''
-            backend_match = re.search(r'default_backend\s+(\S+)', body)
-            if backend_match:
-                default_backend = backend_match.group(1)
-
-            config['frontends'].append({
-                'name': name,
-                'binds': binds,
-                'default_backend': default_backend,
-                'config': body
-            })
-
-        # Extract backends
-        backend_pattern = r'backend\s+(\S+)\s+(.*?)(?=\nfrontend|\nbackend|\nlisten|\Z)'
-        for match in re.finditer(backend_pattern, content, re.DOTALL):
-            name = match.group(1)
-            body = match.group(2).strip()
-
-            # Parse balance algorithm
-            balance = 'roundrobin'
-            balance_match = re.search(r'balance\s+(\S+)', body)
-            if balance_match:
-                balance = balance_match.group(1)
-
-            # Parse servers
-            servers = []
-            server_pattern = r'server\s+(\S+)\s+([^:\s]+):(\d+)(.*)$'
-            for server_match in re.finditer(server_pattern, body, re.MULTILINE):
-                servers.append({
-                    'name': server_match.group(1),
-                    'host': server_match.group(2),
-                    'port': server_match.group(3),
-                    'options': server_match.group(4).strip()
-                })
-
-            config['backends'].append({
-                'name': name,
-                'balance': balance,
-                'servers': servers,
-                'config': body
-            })
-
-        return config
+    try:
+        cached = get_config_cache().get(config_path)
+        return {'success': True, 'config': cached.parsed, 'content': cached.content, 'hash': cached.hash}
 
     except FileNotFoundError:
-        return {'error': f'HAProxy config not found at {config_path}'}
+        return {'success': False, 'error': f'HAProxy config not found at {config_path}'}
     except PermissionError:
-        return {'error': f'Permission denied to read HAProxy config at {config_path}'}
+        return {'success': False, 'error': f'Permission denied to read HAProxy config at {config_path}'}
     except Exception as e:
-        return {'error': f'Failed to parse HAProxy config: {str(e)}'}
+        return {'success': False, 'error': f'Failed to parse HAProxy config: {str(e)}'}
+
+def parse_haproxy_config():
+    """Parse HAProxy configuration file (cached until the file changes)"""
+    result = read_haproxy_config()
+    if not result['success']:
+        return {'error': result['error']}
+    return result['config']
+
+def parse_haproxy_config_text(content):
+    """
+    Parse HAProxy configuration text into global, defaults, frontends,
+    backends and listen sections, plus an outline of every section
+    """
+    config = {
+        'frontends': [],
+        'backends': [],
+        'listens': [],
+        'global': '',
+        'defaults': '',
+        'other_sections': [],
+        'sections': []
+    }
+
+    with paused_gc():
+        for section in parse_config(content):
+            config['sections'].append(section.to_dict(entries=False))
+
+            if section.type in ('global', 'defaults'):
+                # Only the first (unnamed) one, as before
+                if not config[section.type]:
+                    config[section.type] = section.body
+                continue
+            if section.type not in ('frontend', 'backend', 'listen'):
+                config['other_sections'].append({'type': section.type, 'name': section.name, 'config': section.body})
+                continue
+
+            binds = []
+            servers = []
+            default_backend = ''
+            balance = ''
+            for line, keyword, args in section.entries:
+                if keyword == 'server':
+                    server = parse_server(args)
+                    if server is not None:
+                        server['line'] = line
+                        servers.append(server)
+                elif keyword == 'bind':
+                    binds.append(args)
+                elif keyword == 'default_backend' and not default_backend and args:
+                    default_backend = args.split()[0]
+                elif keyword == 'balance' and not balance and args:
+                    balance = args.split()[0]
+
+            proxy = {'name': section.name, 'line': section.line}
+            if section.type != 'backend':
+                proxy['binds'] = binds
+                proxy['default_backend'] = default_backend
+            if section.type != 'frontend':
+                proxy['balance'] = balance or 'roundrobin'
+                proxy['servers'] = servers
+            proxy['config'] = section.body
+
+            config[section.type + 's'].append(proxy)
+
+    return config
 
 def write_haproxy_config(config_data):
     """Write HAProxy configuration file"""
@@ -345,80 +546,9 @@ def write_haproxy_config(config_data):
         if os.path.exists(config_path):
             shutil.copy2(config_path, backup_path)
 
-        # Build configuration
-        config_lines = []
-
-        # Global section
-        config_lines.append('global')
-        if 'global' in config_data and config_data['global']:
-            for line in config_data['global'].split('\n'):
-                if line.strip():
-                    config_lines.append(f'    {line.strip()}')
-        else:
-            # Default global config
-            config_lines.extend([
-                '    log /dev/log local0',
-                '    log /dev/log local1 notice',
-                '    chroot /var/lib/haproxy',
-                '    stats socket /run/haproxy/admin.sock mode 660 level admin',
-                '    stats timeout 30s',
-                '    user haproxy',
-                '    group haproxy',
-                '    daemon'
-            ])
-
-        config_lines.append('')
-
-        # Defaults section
-        config_lines.append('defaults')
-        if 'defaults' in config_data and config_data['defaults']:
-            for line in config_data['defaults'].split('\n'):
-                if line.strip():
-                    config_lines.append(f'    {line.strip()}')
-        else:
-            # Default defaults config
-            config_lines.extend([
-                '    log     global',
-                '    mode    http',
-                '    option  httplog',
-                '    option  dontlognull',
-                '    timeout connect 5000',
-                '    timeout client  50000',
-                '    timeout server  50000'
-            ])
-
-        config_lines.append('')
-
-        # Frontends
-        for frontend in config_data.get('frontends', []):
-            config_lines.append(f'frontend {frontend["name"]}')
-            for bind in frontend.get('binds', []):
-                config_lines.append(f'    bind {bind}')
-            if frontend.get('default_backend'):
-                config_lines.append(f'    default_backend {frontend["default_backend"]}')
-            # Add any custom config lines
-            if 'config' in frontend:
-                for line in frontend['config'].split('\n'):
-                    if line.strip() and not line.strip().startswith('bind') and not line.strip().startswith('default_backend'):
-                        config_lines.append(f'    {line.strip()}')
-            config_lines.append('')
-
-        # Backends
-        for backend in config_data.get('backends', []):
-            config_lines.append(f'backend {backend["name"]}')
-            config_lines.append(f'    balance {backend.get("balance", "roundrobin")}')
-            for server in backend.get('servers', []):
-                options = server.get('options', '')
-                config_lines.append(f'    server {server["name"]} {server["host"]}:{server["port"]} {options}'.strip())
-            # Add any custom config lines
-            if 'config' in backend:
-                for line in backend['config'].split('\n'):
-                    if line.strip() and not line.strip().startswith('balance') and not line.strip().startswith('server'):
-                        config_lines.append(f'    {line.strip()}')
-            config_lines.append('')
+        config_content = get_config_renderer().render_posted(config_data)
 
         # Write configuration to temporary file first
-        config_content = '\n'.join(config_lines)
         temp_config_path = os.path.join(backup_dir, f'haproxy.cfg.tmp.{timestamp}')
         with open(temp_config_path, 'w') as f:
             f.write(config_content)
@@ -450,8 +580,63 @@ def write_haproxy_config(config_data):
     except Exception as e:
         return {'success': False, 'error': f'Failed to write configuration: {str(e)}'}
 
-def reload_haproxy():
-    """Reload HAProxy service"""
+RELOAD_METHODS = ('master', 'systemctl', 'restart')
+
+def get_reload_method():
+    """How configuration changes are picked up: 'master', 'systemctl' or 'restart'"""
+    method = os.getenv('HAPROXY_RELOAD_METHOD', 'systemctl').lower()
+    return method if method in RELOAD_METHODS else 'systemctl'
+
+def get_master_socket_path():
+    """HAProxy master CLI socket (haproxy -S), or None if not configured"""
+    return os.getenv('HAPROXY_MASTER_SOCKET') or None
+
+def _reload_probe_addresses():
+    """
+    (host, port) listeners to probe during a reload: HAPROXY_RELOAD_PROBE
+    (comma-separated host:port), else the first bind of every frontend in
+    the current config, with wildcard addresses probed on loopback.
+    """
+    configured = os.getenv('HAPROXY_RELOAD_PROBE', '').strip()
+    if configured:
+        binds = [item.strip() for item in configured.split(',') if item.strip()]
+    else:
+        config = parse_haproxy_config()
+        binds = [frontend['binds'][0].split()[0] for frontend in config.get('frontends', []) if frontend['binds']]
+
+    addresses = []
+    for bind in binds:
+        host, _, port = bind.rpartition(':')
+        if not port.isdigit():
+            continue
+        host = host.strip('[]')
+        if host in ('', '*', '0.0.0.0'):
+            host = '127.0.0.1'
+        elif host == '::':
+            host = '::1'
+        addresses.append((host, int(port)))
+    return addresses
+
+def reload_verb(result):
+    """'restarted' or 'reloaded', depending on how a reload_haproxy() result was applied"""
+    return 'restarted' if result.get('method') == 'restart' else 'reloaded'
+
+def _master_reload(master_address):
+    """Seamless reload through the master CLI"""
+    try:
+        output = send_master_command('reload', master_address)
+    except FileNotFoundError:
+        return {'success': False, 'error': f'HAProxy master socket not found at {master_address}'}
+    except OSError as e:
+        return {'success': False, 'error': f'Failed to reload HAProxy: {str(e)}'}
+
+    # HAProxy 2.7+ reports the outcome; older versions just close the connection
+    if 'Success=0' in output:
+        return {'success': False, 'error': f'Failed to reload HAProxy: {output.strip()}'}
+    return {'success': True}
+
+def _systemctl_reload():
+    """Reload through systemd, which signals the master process"""
     try:
         result = subprocess.run(
             ['sudo', 'systemctl', 'reload', 'haproxy'],
@@ -470,182 +655,618 @@ def reload_haproxy():
     except Exception as e:
         return {'success': False, 'error': f'Failed to reload HAProxy: {str(e)}'}
 
+def reload_haproxy():
+    """
+    Make HAProxy pick up its configuration using HAPROXY_RELOAD_METHOD.
+    'master' and 'systemctl' reload without dropping the listeners; a
+    restart only happens for 'restart', or as a fallback when
+    HAPROXY_RESTART_FALLBACK is enabled.
+    Returns dict with success/error, the 'method' used and the 'reload'
+    measurements (listener downtime, drain time once known).
+    """
+    method = get_reload_method()
+
+    # Check if we should skip reload (dev mode)
+    if os.getenv('SKIP_HAPROXY_RESTART', 'false').lower() == 'true':
+        record_applied_config()
+        return {'success': True, 'method': method, 'warning': 'HAProxy reload skipped (development mode)'}
+
+    master_address = get_master_socket_path()
+    if method == 'master' and not master_address:
+        return {'success': False, 'error': 'HAPROXY_MASTER_SOCKET is required for HAPROXY_RELOAD_METHOD=master'}
+
+    tracker = get_reload_tracker()
+    old_workers = tracker.old_workers(master_address)
+    started = time.monotonic()
+
+    with ListenerProbe(_reload_probe_addresses()) as probe:
+        if method == 'master':
+            result = _master_reload(master_address)
+        elif method == 'systemctl':
+            result = _systemctl_reload()
+        else:
+            result = restart_haproxy_service()
+
+        if not result['success'] and method != 'restart' and \
+                os.getenv('HAPROXY_RESTART_FALLBACK', 'false').lower() == 'true':
+            error = result['error']
+            method = 'restart'
+            result = restart_haproxy_service()
+            if result['success']:
+                result['warning'] = f'Reload failed, HAProxy was restarted instead: {error}'
+            else:
+                result['error'] = f"{error}; restart fallback: {result['error']}"
+
+    if not result['success']:
+        return result
+
+    record_applied_config()
+    # Pooled admin connections still point at the old process
+    close_admin_socket_pools()
+
+    result['method'] = method
+    result['reload'] = tracker.record(
+        method, probe, time.monotonic() - started, master_address,
+        old_workers if method != 'restart' else None
+    )
+    return result
+
+def send_runtime_command(command, action='run runtime command'):
+    """
+    Send one runtime API command to every admin endpoint.
+    Returns dict with success, the (joined) response text and, when several
+    endpoints are configured, per-instance 'responses'.
+    """
+    endpoints = get_admin_endpoints()
+    addresses = dict(endpoints)
+    results = fan_out(lambda address: send_command(command, address), endpoints, get_endpoint_timeout())
+
+    responses = {}
+    errors = {}
+    for name, response, error in results:
+        if error is not None:
+            errors[name] = _socket_error_message(error, addresses[name], action)
+        else:
+            responses[name] = response.strip()
+
+    if errors:
+        return {'success': False, 'error': '; '.join(errors.values()), 'responses': responses}
+
+    result = {'success': True, 'response': '\n'.join(r for r in responses.values() if r)}
+    if len(endpoints) > 1:
+        result['responses'] = responses
+    return result
+
+# Informational replies of runtime commands that succeeded; anything else
+# a command prints is an error message
+RUNTIME_OK_PREFIXES = ('IP changed from', 'no need to change', 'port changed from',
+                       'New server registered', 'Server deleted')
+
+def _runtime_ok(response):
+    return not response or response.startswith(RUNTIME_OK_PREFIXES)
+
+def send_runtime_commands(commands, action='run runtime commands'):
+    """
+    Send a list of runtime API commands to every admin endpoint, pipelined
+    over one socket session per endpoint.
+    Returns dict with success and 'results', one per command: the command,
+    its (joined) response and, when several endpoints are configured,
+    per-instance 'responses'. A command succeeded if no endpoint printed
+    an error for it. 'outputs' holds the raw outputs of every endpoint that
+    answered, also when another one failed.
+    """
+    endpoints = get_admin_endpoints()
+    addresses = dict(endpoints)
+    outcomes = fan_out(lambda address: send_commands(commands, address), endpoints, get_endpoint_timeout())
+
+    responses = {}
+    errors = {}
+    for name, response, error in outcomes:
+        if error is not None:
+            errors[name] = _socket_error_message(error, addresses[name], action)
+        else:
+            responses[name] = response
+
+    if errors:
+        return {'success': False, 'error': '; '.join(errors.values()), 'outputs': responses}
+
+    results = []
+    for i, command in enumerate(commands):
+        per_instance = {name: output[i].strip() for name, output in responses.items()}
+        result = {
+            'command': command,
+            'success': all(_runtime_ok(r) for r in per_instance.values()),
+            'response': '\n'.join(r for r in per_instance.values() if r)
+        }
+        if len(endpoints) > 1:
+            result['responses'] = per_instance
+        results.append(result)
+
+    return {'success': all(r['success'] for r in results), 'results': results, 'outputs': responses}
+
+def parse_servers_state(text):
+    """
+    Parse 'show servers state' output into
+    {(backend, server): {'address', 'port', 'weight', 'fqdn'}}
+    address is the resolved IP; fqdn is the configured hostname, or None.
+    """
+    servers = {}
+    columns = None
+    for line in text.splitlines():
+        if line.startswith('# '):
+            columns = {name: i for i, name in enumerate(line[2:].split())}
+            continue
+        fields = line.split()
+        if columns is None or len(fields) < len(columns):
+            continue
+        fqdn = fields[columns['srv_fqdn']] if 'srv_fqdn' in columns else '-'
+        servers[(fields[columns['be_name']], fields[columns['srv_name']])] = {
+            'address': fields[columns['srv_addr']],
+            'port': int(fields[columns['srv_port']]) if 'srv_port' in columns else None,
+            'weight': int(fields[columns['srv_uweight']]),
+            'fqdn': fqdn if fqdn != '-' else None,
+        }
+    return servers
+
+def read_servers_state():
+    """
+    Read the backend servers of the running HAProxy from every admin endpoint.
+    Returns dict with success and 'servers'; fails if an endpoint cannot be
+    read or the endpoints disagree.
+    """
+    endpoints = get_admin_endpoints()
+    addresses = dict(endpoints)
+    outcomes = fan_out(lambda address: send_command('show servers state', address),
+                       endpoints, get_endpoint_timeout())
+
+    states = []
+    for name, response, error in outcomes:
+        if error is not None:
+            return {'success': False, 'error': _socket_error_message(error, addresses[name], 'read servers state')}
+        states.append(parse_servers_state(response))
+
+    if any(state != states[0] for state in states[1:]):
+        return {'success': False, 'error': 'Servers differ between HAProxy instances'}
+    return {'success': True, 'servers': states[0]}
+
 def toggle_server(backend_name, server_name, enable):
-    """Enable or disable a server via HAProxy socket"""
-    socket_path = get_haproxy_socket_path()
+    """Enable or disable a server via HAProxy socket (on every endpoint)"""
+    # Send command to enable/disable server
+    command = f'{"enable" if enable else "disable"} server {backend_name}/{server_name}'
+    return send_runtime_command(command, 'toggle server')
+
+# Runtime API command per bulk server state
+SERVER_STATE_COMMANDS = {
+    'ready': 'set server {}/{} state ready',
+    'drain': 'set server {}/{} state drain',
+    'maint': 'set server {}/{} state maint',
+    'enable': 'enable server {}/{}',
+    'disable': 'disable server {}/{}',
+}
+
+# Proxy and server names as HAProxy accepts them
+_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_.:-]+$')
+
+def set_servers_state(changes):
+    """
+    Apply many server state changes in one admin socket session per endpoint.
+    changes is a list of dicts with backend, server and state (one of
+    SERVER_STATE_COMMANDS). Returns dict with success and per-change
+    'results', or an error if a change is invalid or HAProxy is unreachable.
+    """
+    commands = []
+    for change in changes:
+        backend_name = change.get('backend')
+        server_name = change.get('server')
+        state = change.get('state')
+        if not backend_name or not server_name or state not in SERVER_STATE_COMMANDS:
+            return {'success': False, 'error': f'Invalid change: {change}', 'invalid': True}
+        # A ';' or whitespace would inject extra commands into the batch
+        if not _NAME_PATTERN.match(backend_name) or not _NAME_PATTERN.match(server_name):
+            return {'success': False, 'error': f'Invalid server name: {backend_name}/{server_name}', 'invalid': True}
+        commands.append(SERVER_STATE_COMMANDS[state].format(backend_name, server_name))
+
+    result = send_runtime_commands(commands, 'change server states')
+    if 'results' in result:
+        for change, entry in zip(changes, result['results']):
+            entry['backend'] = change['backend']
+            entry['server'] = change['server']
+            entry['state'] = change['state']
+    return result
+
+def apply_runtime_steps(steps, action):
+    """
+    Send (command, revert, optional) steps in one batch. If a non-optional
+    command fails, or an endpoint cannot be reached, every endpoint that did
+    answer gets the reverts of the commands that took effect on it, in
+    reverse order, so the running processes are left as they were.
+    Returns dict with success, the 'commands' sent and whether an optional
+    command failed ('optional_failed'), or 'skipped' in development mode
+    when HAProxy is not reachable.
+    """
+    commands = [command for command, _, _ in steps]
+    result = send_runtime_commands(commands, action)
+    if 'results' not in result:
+        if result['outputs']:
+            revert_runtime_steps(steps, result['outputs'])
+        elif os.getenv('SKIP_HAPROXY_RESTART', 'false').lower() == 'true':
+            return {'success': True, 'commands': [], 'skipped': True,
+                    'warning': f'Runtime {action} skipped (development mode)'}
+        return result
 
-    try:
-        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        sock.connect(socket_path)
+    outcomes = list(zip(steps, result['results']))
+    failed = [r for (_, _, optional), r in outcomes if not r['success'] and not optional]
+    if failed:
+        revert_runtime_steps(steps, result['outputs'])
+        return {
+            'success': False,
+            'error': '; '.join(f"{r['command']}: {r['response']}" for r in failed),
+            'failed': failed
+        }
 
-        # Send command to enable/disable server
-        command = f'{"enable" if enable else "disable"} server {backend_name}/{server_name}\n'
-        sock.sendall(command.encode('utf-8'))
+    return {'success': True, 'commands': commands, 'optional_failed': not result['success']}
 
-        # Read response
-        response = sock.recv(4096).decode('utf-8')
-        sock.close()
+def revert_runtime_steps(steps, outputs):
+    """
+    Undo (command, revert, optional) steps on each endpoint of outputs
+    (name -> the outputs of its commands), for the commands that took
+    effect there. Best effort: an endpoint that fails now needs an apply.
+    """
+    addresses = dict(get_admin_endpoints())
+    reverts = {}
+    for name, output in outputs.items():
+        commands = [revert for (_, revert, _), response in reversed(list(zip(steps, output)))
+                    if revert and _runtime_ok(response.strip())]
+        if commands and name in addresses:
+            reverts[name] = commands
+    if reverts:
+        by_address = {addresses[name]: commands for name, commands in reverts.items()}
+        fan_out(lambda address: send_commands(by_address[address], address),
+                [(name, addresses[name]) for name in reverts], get_endpoint_timeout())
+
+def validate_runtime_values(*values):
+    """Error message if a value could break out of a runtime command line"""
+    for value in values:
+        if not _NAME_PATTERN.match(str(value)):
+            return f'Invalid value for runtime command: {value}'
+    return None
+
+def plan_server_update(backend_name, old, new):
+    """
+    Work out how to bring a running server from its old to its new DB row.
+    Returns (steps, requires_apply). steps is a list of (command, revert,
+    optional) runtime commands; a failing optional command only means the
+    change has to wait for a full apply. requires_apply tells whether a full
+    apply is needed for the change to be complete.
+    """
+    target = f"{backend_name}/{old['server_name']}"
+    steps = []
+    requires_apply = False
+
+    if new['weight'] != old['weight']:
+        steps.append((f"set server {target} weight {new['weight']}",
+                      f"set server {target} weight {old['weight']}", False))
+    if new['maxconn'] != old['maxconn']:
+        steps.append((f"set maxconn server {target} {new['maxconn']}",
+                      f"set maxconn server {target} {old['maxconn']}", False))
+    if new['address'] != old['address'] or new['port'] != old['port']:
+        steps.append((f"set server {target} addr {new['address']} port {new['port']}",
+                      f"set server {target} addr {old['address']} port {old['port']}", False))
+    if bool(new['check_enabled']) != bool(old['check_enabled']):
+        if new['check_enabled']:
+            # Only works if the running config already has 'check' for it
+            steps.append((f'enable health {target}', f'disable health {target}', True))
+        else:
+            steps.append((f'disable health {target}', f'enable health {target}', False))
+    if bool(new['enabled']) != bool(old['enabled']):
+        # Disabled servers are left out of the config; until the next apply
+        # a disabled server is kept in maintenance
+        requires_apply = True
+        if not new['enabled']:
+            steps.append((f'set server {target} state maint', f'set server {target} state ready', False))
 
-        return {'success': True, 'response': response.strip()}
+    return steps, requires_apply
 
-    except Exception as e:
-        return {'success': False, 'error': f'Failed to toggle server: {str(e)}'}
+def _not_running(result):
+    """
+    Whether a failed apply_runtime_steps() only failed because HAProxy
+    could not be reached or does not run the server ('No such server')
+    """
+    failed = result.get('failed')
+    if not failed:
+        return True
+    return all(line.startswith('No such server')
+               for r in failed for line in r['response'].splitlines() if line)
+
+def push_server_update(backend_name, old, new):
+    """
+    Apply a backend server's DB edit to the running HAProxy.
+    old and new are the server's DB rows before and after the edit.
+    On failure every command that did take effect is reverted, so the
+    caller can drop the DB change and stay consistent with runtime. If
+    HAProxy is unreachable or does not know the server, nothing is pushed
+    and the change is left to the next apply (success, requires_apply).
+    Returns dict with success, the 'commands' sent and 'requires_apply'.
+    """
+    steps, requires_apply = plan_server_update(backend_name, old, new)
+    if not steps:
+        return {'success': True, 'commands': [], 'requires_apply': requires_apply}
+
+    # Everything below ends up in a ';'-separated command line
+    error = validate_runtime_values(backend_name, old['server_name'], new['address'], old['address'])
+    if error:
+        return {'success': False, 'error': error}
+    for field in ('weight', 'maxconn', 'port'):
+        if not str(new[field]).isdigit():
+            return {'success': False, 'error': f'Invalid {field}: {new[field]}'}
+
+    result = apply_runtime_steps(steps, 'server update')
+    if not result['success'] and _not_running(result):
+        # HAProxy is down or unreachable, or the server was never applied:
+        # the edit is saved and waits for the next apply
+        return {'success': True, 'commands': [], 'requires_apply': True,
+                'warning': f"Not applied at runtime: {result['error']}"}
+    if result['success']:
+        # Only optional commands failed, or nothing was sent in development mode
+        result['requires_apply'] = requires_apply or result.pop('optional_failed', False) or \
+            result.get('skipped', False)
+    return result
+
+def add_server_steps(backend_name, server):
+    """Runtime steps that add a backend server (DB row) to a running backend"""
+    target = f"{backend_name}/{server['server_name']}"
+    options = format_server_options(server)
+    steps = [(f"add server {target} {server['address']}:{server['port']} {options}".strip(),
+              f'del server {target}', False)]
+    if server['check_enabled']:
+        steps.append((f'enable health {target}', f'disable health {target}', False))
+    steps.append((f'enable server {target}', f'disable server {target}', False))
+    return steps
+
+def delete_server_steps(backend_name, server_name):
+    """Runtime steps that remove a server from a running backend"""
+    target = f'{backend_name}/{server_name}'
+    return [
+        (f'disable server {target}', f'enable server {target}', False),
+        (f'del server {target}', None, False),
+    ]
+
+def add_server_runtime(backend_name, server):
+    """
+    Add a backend server (DB row) to the running HAProxy without a reload:
+    'add server' with the same options the rendered config uses, then
+    'enable health' and 'enable server' (dynamic servers start in
+    maintenance). On failure whatever was added is removed again.
+    Returns dict with success and the 'commands' sent.
+    """
+    error = validate_runtime_values(backend_name, server['server_name'], server['address'],
+                                     server['port'], server['weight'], server['maxconn'])
+    if error:
+        return {'success': False, 'error': error}
 
-def apply_config_and_restart(username, ip_address):
-    """Apply database configuration to HAProxy and restart service"""
+    return apply_runtime_steps(add_server_steps(backend_name, server), 'add server')
+
+def delete_server_runtime(backend_name, server_name):
+    """
+    Remove a backend server from the running HAProxy without a reload.
+    HAProxy only deletes servers in maintenance, so it is disabled first;
+    if the delete fails (e.g. connections are still attached) the server
+    is enabled again.
+    Returns dict with success and the 'commands' sent.
+    """
+    error = validate_runtime_values(backend_name, server_name)
+    if error:
+        return {'success': False, 'error': error}
+
+    result = apply_runtime_steps(delete_server_steps(backend_name, server_name), 'delete server')
+    if not result['success'] and result.get('failed') and \
+            all(r['response'].startswith('No such server') for r in result['failed']):
+        # Not in the running process (never applied): already as desired
+        return {'success': True, 'commands': []}
+    return result
+
+def get_config_file_hash(config_path):
+    """SHA-256 of a config file, or None if it does not exist"""
     try:
-        config_path = get_haproxy_config_path()
-        backup_dir = get_backup_directory()
+        return get_config_cache().get(config_path).hash
+    except FileNotFoundError:
+        return None
 
-        # Create backup first
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_filename = f'haproxy.cfg.backup.{timestamp}'
-        backup_path = os.path.join(backup_dir, backup_filename)
+def get_applied_hash_path():
+    """File holding the hash of the config HAProxy was last loaded with"""
+    return os.path.join(get_backup_directory(), 'applied.sha256')
 
-        if os.path.exists(config_path):
-            # Read current config
-            with open(config_path, 'r') as f:
-                backup_content = f.read()
+def get_applied_config_hash():
+    """
+    SHA-256 of the config last applied, reloaded or restored through this
+    app, or None if unknown. The live file can differ: POST /api/config
+    writes it without reloading.
+    """
+    try:
+        with open(get_applied_hash_path()) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
 
-            # Write backup to backup directory
-            with open(backup_path, 'w') as f:
-                f.write(backup_content)
+def record_applied_config():
+    """Remember the live config file as the one HAProxy now runs"""
+    config_hash = get_config_file_hash(get_haproxy_config_path())
+    path = get_applied_hash_path()
+    with open(f'{path}.tmp', 'w') as f:
+        f.write(config_hash or '')
+    os.replace(f'{path}.tmp', path)
 
-            # Calculate hash
-            config_hash = hashlib.sha256(backup_content.encode()).hexdigest()
+def backup_current_config(username, timestamp, description='Auto-backup before apply'):
+    """
+    Copy the current HAProxy config into the backup directory and record it.
+    Returns the backup path (which does not exist if there was no config).
+    """
+    config_path = get_haproxy_config_path()
+    backup_dir = get_backup_directory()
+
+    backup_filename = f'haproxy.cfg.backup.{timestamp}'
+    backup_path = os.path.join(backup_dir, backup_filename)
 
-            # Track backup in database
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
+    if os.path.exists(config_path):
+        # Read current config
+        with open(config_path, 'r') as f:
+            backup_content = f.read()
+
+        # Write backup to backup directory
+        with open(backup_path, 'w') as f:
+            f.write(backup_content)
+
+        # Calculate hash
+        config_hash = hashlib.sha256(backup_content.encode()).hexdigest()
+
+        # Track backup in database
+        conn = get_db_connection()
+        with conn.transaction():
+            conn.execute('''
                 INSERT INTO config_backups (filename, filepath, description, created_by, config_hash)
                 VALUES (?, ?, ?, ?, ?)
             ''', (
                 backup_filename,
                 backup_path,
-                'Auto-backup before apply',
+                description,
                 username,
                 config_hash
             ))
-            conn.commit()
-            conn.close()
 
-        # Read configuration from database
-        conn = get_db_connection()
-        cursor = conn.cursor()
+    return backup_path
 
-        config_lines = []
-
-        # Global section (use default)
-        config_lines.extend([
-            'global',
-            '    log /dev/log local0',
-            '    log /dev/log local1 notice',
-            '    chroot /var/lib/haproxy',
-            '    stats socket /run/haproxy/admin.sock mode 660 level admin',
-            '    stats timeout 30s',
-            '    user haproxy',
-            '    group haproxy',
-            '    daemon',
-            ''
-        ])
-
-        # Defaults section
-        config_lines.extend([
-            'defaults',
-            '    log     global',
-            '    mode    tcp',
-            '    option  tcplog',
-            '    option  dontlognull',
-            '    timeout connect 5000',
-            '    timeout client  50000',
-            '    timeout server  50000',
-            ''
-        ])
-
-        # Frontends from database
-        cursor.execute('SELECT * FROM frontend_servers WHERE enabled = 1 ORDER BY name')
-        for frontend in cursor.fetchall():
-            config_lines.append(f'frontend {frontend["name"]}')
-            config_lines.append(f'    bind {frontend["bind_address"]}:{frontend["bind_port"]}')
-            config_lines.append(f'    mode {frontend["mode"]}')
-            if frontend['default_backend']:
-                config_lines.append(f'    default_backend {frontend["default_backend"]}')
-            config_lines.append('')
-
-        # Backends from database
-        cursor.execute('SELECT * FROM backend_servers WHERE enabled = 1 ORDER BY name')
-        for backend in cursor.fetchall():
-            config_lines.append(f'backend {backend["name"]}')
-            config_lines.append(f'    mode {backend["mode"]}')
-            config_lines.append(f'    balance {backend["balance"]}')
-
-            # Get servers for this backend
-            cursor.execute('''
-                SELECT * FROM backend_server_list
-                WHERE backend_name = ? AND enabled = 1
-                ORDER BY server_name
-            ''', (backend['name'],))
-
-            for server in cursor.fetchall():
-                options = []
-                if server['check_enabled']:
-                    options.append('check')
-                if server['weight'] != 1:
-                    options.append(f'weight {server["weight"]}')
-                if server['maxconn'] != 32:
-                    options.append(f'maxconn {server["maxconn"]}')
-
-                options_str = ' '.join(options)
-                config_lines.append(f'    server {server["server_name"]} {server["address"]}:{server["port"]} {options_str}'.strip())
-
-            config_lines.append('')
+# Above this many uncached backends, read every server instead of an IN list
+SERVER_QUERY_IN_LIMIT = 500
+# What the renderer needs of a server row; backend_name must come first
+SERVER_RENDER_COLUMNS = 'backend_name, server_name, address, port, weight, maxconn, check_enabled'
+
+def render_config_from_db():
+    """Render the complete HAProxy configuration from the database"""
+    # Read configuration from database
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    # Frontends from database
+    cursor.execute('SELECT * FROM frontend_servers WHERE enabled = 1 ORDER BY name')
+    frontends = cursor.fetchall()
+
+    # Backends from database, with the version of their server list
+    cursor.execute('''
+        SELECT b.*, COALESCE(v.version, 0) AS servers_version
+        FROM backend_servers b
+        LEFT JOIN backend_server_versions v ON v.backend_name = b.name
+        WHERE b.enabled = 1
+        ORDER BY b.name
+    ''')
+    backends = cursor.fetchall()
+
+    def load_servers(backend_names):
+        # Servers of the backends whose text is not cached yet, in one query
+        # streamed in (backend, server) order and grouped in one pass
+        if len(backend_names) <= SERVER_QUERY_IN_LIMIT:
+            placeholders = ', '.join('?' * len(backend_names))
+            cursor.execute(f'''
+                SELECT {SERVER_RENDER_COLUMNS} FROM backend_server_list
+                WHERE enabled = 1 AND backend_name IN ({placeholders})
+                ORDER BY backend_name, server_name
+            ''', backend_names)
+        else:
+            cursor.execute(f'''
+                SELECT {SERVER_RENDER_COLUMNS} FROM backend_server_list
+                WHERE enabled = 1
+                ORDER BY backend_name, server_name
+            ''')
+        servers = {}
+        for name, rows in groupby(cursor, key=itemgetter(0)):
+            servers[name] = list(rows)
+        return servers
 
+    try:
+        return get_config_renderer().render_db(frontends, backends, load_servers)
+    finally:
         conn.close()
 
-        # Write configuration to temporary file first
-        config_content = '\n'.join(config_lines)
-        temp_config_path = os.path.join(backup_dir, f'haproxy.cfg.tmp.{timestamp}')
-        with open(temp_config_path, 'w') as f:
-            f.write(config_content)
+def install_config(content, timestamp):
+    """
+    Validate a rendered configuration and copy it to the HAProxy config path.
+    Returns dict with success/error and any 'warnings'.
+    """
+    config_path = get_haproxy_config_path()
+    backup_dir = get_backup_directory()
 
-        # Validate configuration
+    # Write configuration to temporary file first
+    temp_config_path = os.path.join(backup_dir, f'haproxy.cfg.tmp.{timestamp}')
+    with open(temp_config_path, 'w') as f:
+        f.write(content)
+
+    # Validate configuration
+    with job_phase('validate'):
         validation_result = validate_haproxy_config(temp_config_path)
 
-        if not validation_result['success']:
-            os.remove(temp_config_path)
-            return validation_result
+    if not validation_result['success']:
+        os.remove(temp_config_path)
+        return validation_result
 
-        # Copy validated config to HAProxy config location
+    # Copy validated config to HAProxy config location
+    with job_phase('install'):
         copy_result = copy_file_with_privileges(temp_config_path, config_path)
 
-        if not copy_result['success']:
-            os.remove(temp_config_path)
-            return copy_result
-
-        # Clean up temp file
+    if not copy_result['success']:
         os.remove(temp_config_path)
+        return copy_result
 
-        # Restart HAProxy
-        restart_result = restart_haproxy_service()
+    # Clean up temp file
+    os.remove(temp_config_path)
 
-        if not restart_result['success']:
-            # Restore backup if restart fails
+    warnings = [r['warning'] for r in (validation_result, copy_result) if 'warning' in r]
+    return {'success': True, 'warnings': warnings}
+
+def apply_config_and_restart(username, ip_address, config_content=None):
+    """
+    Apply database configuration to HAProxy and reload it (see reload_haproxy).
+    config_content is the already rendered configuration, if available.
+    """
+    try:
+        config_path = get_haproxy_config_path()
+        if config_content is None:
+            with job_phase('render'):
+                config_content = render_config_from_db()
+
+        # Nothing to validate, copy or reload if HAProxy already runs it (and
+        # the live file was not changed since)
+        config_hash = hashlib.sha256(config_content.encode()).hexdigest()
+        if config_hash == get_applied_config_hash() == get_config_file_hash(config_path):
+            return {'success': True, 'unchanged': True, 'message': 'Configuration already applied'}
+
+        # Create backup first
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        with job_phase('backup'):
+            backup_path = backup_current_config(username, timestamp)
+
+        install_result = install_config(config_content, timestamp)
+        if not install_result['success']:
+            return install_result
+
+        # Reload HAProxy
+        with job_phase('reload'):
+            reload_result = reload_haproxy()
+
+        if not reload_result['success']:
+            # Restore backup if reload fails
             restore_result = copy_file_with_privileges(backup_path, config_path)
-            return restart_result
+            return reload_result
 
-        log_audit(username, 'apply_config', 'haproxy', None, 'Configuration applied and service restarted', ip_address)
+        verb = reload_verb(reload_result)
+        log_audit(username, 'apply_config', 'haproxy', None, f'Configuration applied and service {verb}', ip_address)
 
-        result = {'success': True, 'backup': backup_path, 'message': 'Configuration applied and HAProxy restarted successfully'}
+        result = {'success': True, 'backup': backup_path, 'message': f'Configuration applied and HAProxy {verb} successfully'}
+        if 'reload' in reload_result:
+            result['reload'] = reload_result['reload']
 
         # Collect all warnings
-        warnings = []
-        if 'warning' in validation_result:
-            warnings.append(validation_result['warning'])
-        if 'warning' in copy_result:
-            warnings.append(copy_result['warning'])
-        if 'warning' in restart_result:
-            warnings.append(restart_result['warning'])
+        warnings = install_result['warnings']
+        if 'warning' in reload_result:
+            warnings.append(reload_result['warning'])
 
         if warnings:
             result['warning'] = '; '.join(warnings)
@@ -655,22 +1276,6 @@ def apply_config_and_restart(username, ip_address):
     except Exception as e:
         return {'success': False, 'error': f'Failed to apply configuration: {str(e)}'}
 
-def list_config_backups():
-    """List all configuration backups"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        SELECT id, filename, filepath, description, created_by, config_hash, created_at
-        FROM config_backups
-        ORDER BY created_at DESC
-    ''')
-
-    backups = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-
-    return backups
-
 def restore_backup(backup_id, username, ip_address):
     """Restore a configuration backup"""
     try:
@@ -708,46 +1313,51 @@ def restore_backup(backup_id, username, ip_address):
                 current_content = f.read()
             config_hash = hashlib.sha256(current_content.encode()).hexdigest()
 
-            cursor.execute('''
-                INSERT INTO config_backups (filename, filepath, description, created_by, config_hash)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
-                current_backup_filename,
-                current_backup_path,
-                'Auto-backup before restore',
-                username,
-                config_hash
-            ))
-            conn.commit()
+            with conn.transaction():
+                conn.execute('''
+                    INSERT INTO config_backups (filename, filepath, description, created_by, config_hash)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (
+                    current_backup_filename,
+                    current_backup_path,
+                    'Auto-backup before restore',
+                    username,
+                    config_hash
+                ))
 
         # Validate the backup configuration before restoring
-        validation_result = validate_haproxy_config(backup_path)
+        with job_phase('validate'):
+            validation_result = validate_haproxy_config(backup_path)
 
         if not validation_result['success']:
             conn.close()
             return validation_result
 
         # Copy backup to HAProxy config location
-        copy_result = copy_file_with_privileges(backup_path, config_path)
+        with job_phase('install'):
+            copy_result = copy_file_with_privileges(backup_path, config_path)
 
         if not copy_result['success']:
             conn.close()
             return copy_result
 
-        # Restart HAProxy
-        restart_result = restart_haproxy_service()
+        # Reload HAProxy
+        with job_phase('reload'):
+            reload_result = reload_haproxy()
 
-        if not restart_result['success']:
-            # Restore current config if restart fails
+        if not reload_result['success']:
+            # Restore current config if reload fails
             restore_result = copy_file_with_privileges(current_backup_path, config_path)
             conn.close()
-            return restart_result
+            return reload_result
 
         log_audit(username, 'restore_backup', 'haproxy', backup['filename'], f'Restored backup ID {backup_id}', ip_address)
 
         conn.close()
 
         result = {'success': True, 'message': f'Backup restored successfully: {backup["filename"]}'}
+        if 'reload' in reload_result:
+            result['reload'] = reload_result['reload']
 
         # Collect all warnings
         warnings = []
@@ -755,8 +1365,8 @@ def restore_backup(backup_id, username, ip_address):
             warnings.append(validation_result['warning'])
         if 'warning' in copy_result:
             warnings.append(copy_result['warning'])
-        if 'warning' in restart_result:
-            warnings.append(restart_result['warning'])
+        if 'warning' in reload_result:
+            warnings.append(reload_result['warning'])
 
         if warnings:
             result['warning'] = '; '.join(warnings)
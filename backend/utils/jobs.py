@@ -0,0 +1,165 @@
+"""Background jobs for long-running HAProxy operations
+
+Applies and restores validate, copy files with sudo and reload HAProxy,
+which can take many seconds. They run here, in a small thread pool, while
+the request that started them returns a job id right away. Code running in
+a job marks its steps with ``job_phase()``, and /api/jobs/<id> reports
+each phase's status and timing.
+
+Jobs live in the memory of the worker process that started them; finished
+jobs are kept for ``JOB_RETENTION`` seconds.
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+JOB_RETENTION = 3600
+MAX_FINISHED_JOBS = 200
+
+_current = threading.local()
+
+
+def _now():
+    return datetime.now().isoformat(timespec='milliseconds')
+
+
+@contextmanager
+def job_phase(name):
+    """
+    Record a phase of the job running in this thread.
+    Does nothing outside of a job.
+    """
+    job = getattr(_current, 'job', None)
+    if job is None:
+        yield
+        return
+
+    phase = job.start_phase(name)
+    try:
+        yield
+    except BaseException:
+        job.end_phase(phase, 'failed')
+        raise
+    job.end_phase(phase, 'done')
+
+
+class Job:
+    """State of one background operation"""
+
+    def __init__(self, job_type, username):
+        self.id = uuid.uuid4().hex
+        self.type = job_type
+        self.username = username
+        self.status = 'queued'
+        self.created_at = _now()
+        self.started_at = None
+        self.finished_at = None
+        self.duration_ms = None
+        self.phases = []
+        self.result = None
+        self._started = None
+        self._finished = None
+        self._lock = threading.Lock()
+
+    def start_phase(self, name):
+        phase = {'name': name, 'status': 'running', 'started_at': _now(), 'duration_ms': None,
+                 '_start': time.monotonic()}
+        with self._lock:
+            self.phases.append(phase)
+        return phase
+
+    def end_phase(self, phase, status):
+        with self._lock:
+            phase['status'] = status
+            phase['duration_ms'] = round((time.monotonic() - phase['_start']) * 1000, 1)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'id': self.id,
+                'type': self.type,
+                'username': self.username,
+                'status': self.status,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'duration_ms': self.duration_ms,
+                'phases': [{k: v for k, v in phase.items() if not k.startswith('_')} for phase in self.phases],
+                'result': self.result,
+            }
+
+
+class JobManager:
+    """Runs jobs in a thread pool and keeps their state for status queries"""
+
+    def __init__(self, max_workers=4):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='haproxy-job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, job_type, username, func, *args):
+        """
+        Run func(*args) in the background. Its return value, a dict with
+        success/error, becomes the job result.
+        Returns the Job.
+        """
+        job = Job(job_type, username)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, func, args)
+        return job
+
+    def _run(self, job, func, args):
+        with job._lock:
+            job.status = 'running'
+            job.started_at = _now()
+            job._started = time.monotonic()
+
+        _current.job = job
+        try:
+            result = func(*args)
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+        finally:
+            _current.job = None
+
+        with job._lock:
+            job.result = result
+            job.status = 'succeeded' if result.get('success') else 'failed'
+            job.finished_at = _now()
+            job._finished = time.monotonic()
+            job.duration_ms = round((job._finished - job._started) * 1000, 1)
+
+    def _prune(self):
+        """Forget finished jobs past their retention (called with the lock held)"""
+        now = time.monotonic()
+        finished = [job for job in self._jobs.values() if job._finished is not None]
+        for job in finished:
+            if now - job._finished > JOB_RETENTION:
+                del self._jobs[job.id]
+        finished = [job for job in finished if job.id in self._jobs]
+        for job in sorted(finished, key=lambda j: j._finished)[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job.id]
+
+    def get(self, job_id):
+        """Job by id, or None"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    """Get the shared job manager"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager(max_workers=int(os.getenv('JOB_WORKERS', '4')))
+        return _manager
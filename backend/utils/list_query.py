@@ -0,0 +1,202 @@
+"""Paginated, filtered and projected list queries for the list endpoints
+
+The list endpoints (/api/frontends, /api/backends, /api/users,
+/api/haproxy/backups and /api/connections/active) accept:
+
+- ``limit=N`` (1-1000): at most N items, plus a ``next_cursor`` that is
+  null on the last page
+- ``cursor=...``: the ``next_cursor`` of the previous page
+- ``fields=a,b``: only these fields of each item
+- ``name=`` / ``address=``: items whose name / address starts with this
+  prefix (case-sensitive)
+
+Without limit or cursor the whole list is returned, as before. Pages use
+keyset pagination: the sort always ends with the unique id, and the next
+page seeks past the last row with ``WHERE (sort columns) > (last values)``
+on an index, so a page costs the same however deep it is.
+"""
+import base64
+import binascii
+import json
+
+from .database import get_db_connection
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+class ListQueryError(ValueError):
+    """Invalid list parameters (HTTP 400)"""
+
+
+def prefix_filter(column):
+    """Condition on column starting with a prefix, as an index range scan"""
+    return f'{column} >= ? AND {column} < ?'
+
+
+def _prefix_bounds(prefix):
+    """[low, high) range of the strings starting with prefix (BINARY collation)"""
+    last = ord(prefix[-1])
+    if last >= 0x10FFFF:
+        return prefix, prefix + '\U0010ffff'
+    return prefix, prefix[:-1] + chr(last + 1)
+
+
+class ListSpec:
+    """
+    One list endpoint: the table, its output fields (name -> SQL
+    expression), the sort columns ending with a unique one, the direction,
+    the prefix filters (parameter -> condition with two placeholders) and
+    an optional fixed condition
+    """
+
+    def __init__(self, table, fields, order, descending=False, filters=None, where=None):
+        self.table = table
+        self.fields = fields
+        self.order = order
+        self.descending = descending
+        self.filters = filters or {}
+        self.where = where
+
+
+FRONTENDS = ListSpec(
+    'frontend_servers',
+    {name: name for name in ('id', 'name', 'bind_address', 'bind_port', 'mode', 'default_backend',
+                             'enabled', 'created_at', 'updated_at')},
+    ('name', 'id'),
+    filters={'name': prefix_filter('name'), 'address': prefix_filter('bind_address')},
+)
+
+BACKENDS = ListSpec(
+    'backend_servers',
+    {name: name for name in ('id', 'name', 'mode', 'balance', 'enabled', 'created_at', 'updated_at')},
+    ('name', 'id'),
+    filters={
+        'name': prefix_filter('name'),
+        # Backends with at least one server at a matching address
+        'address': f"name IN (SELECT backend_name FROM backend_server_list WHERE {prefix_filter('address')})",
+    },
+)
+
+USERS = ListSpec(
+    'users',
+    {'id': 'id', 'username': 'username', 'created_at': 'created_at'},
+    ('username', 'id'),
+    filters={'name': prefix_filter('username')},
+)
+
+BACKUPS = ListSpec(
+    'config_backups',
+    {name: name for name in ('id', 'filename', 'filepath', 'description', 'created_by', 'config_hash',
+                             'created_at')},
+    ('created_at', 'id'),
+    descending=True,
+    filters={'name': prefix_filter('filename')},
+)
+
+ACTIVE_CONNECTIONS = ListSpec(
+    'connection_history',
+    {name: name for name in ('id', 'server_name', 'server_type', 'client_ip', 'session_id', 'status',
+                             'bytes_in', 'bytes_out', 'connected_at', 'disconnected_at')},
+    ('connected_at', 'id'),
+    descending=True,
+    filters={'name': prefix_filter('server_name'), 'address': prefix_filter('client_ip')},
+    where='disconnected_at IS NULL',
+)
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, binascii.Error):
+        raise ListQueryError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != size or \
+            not all(isinstance(value, (str, int, float)) for value in values):
+        raise ListQueryError('Invalid cursor')
+    return values
+
+
+def parse_fields(spec, value, extra=()):
+    """Requested fields (all if value is empty); extra are allowed non-column fields"""
+    available = list(spec.fields) + list(extra)
+    if not value:
+        return available
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in available]
+    if unknown:
+        raise ListQueryError(f"Unknown field(s): {', '.join(unknown)}. Available: {', '.join(available)}")
+    return fields
+
+
+def parse_limit(args):
+    """Page size, or None for the whole list (no limit and no cursor)"""
+    value = args.get('limit')
+    if value is None or value == '':
+        return DEFAULT_LIMIT if args.get('cursor') else None
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ListQueryError('limit must be an integer')
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ListQueryError(f'limit must be between 1 and {MAX_LIMIT}')
+    return limit
+
+
+def run_list_query(spec, args, fields):
+    """
+    Run a list query with the request arguments (limit, cursor and the
+    spec's filters). Returns (items, next_cursor); items hold the given
+    fields that are columns of the spec, next_cursor is None on the last
+    page or when not paginating.
+    """
+    limit = parse_limit(args)
+    columns = [field for field in fields if field in spec.fields]
+    select = [f'{spec.fields[field]} AS {field}' for field in columns]
+    # The sort key of the last row makes the next cursor
+    select.extend(f'{column} AS _key{i}' for i, column in enumerate(spec.order))
+
+    conditions = [spec.where] if spec.where else []
+    params = []
+    for param, condition in spec.filters.items():
+        prefix = args.get(param)
+        if prefix:
+            conditions.append(condition)
+            params.extend(_prefix_bounds(prefix))
+
+    cursor_value = args.get('cursor')
+    if cursor_value:
+        values = decode_cursor(cursor_value, len(spec.order))
+        keys = ', '.join(spec.order)
+        conditions.append(f"({keys}) {'<' if spec.descending else '>'} ({', '.join('?' * len(values))})")
+        params.extend(values)
+
+    direction = 'DESC' if spec.descending else 'ASC'
+    sql = f"SELECT {', '.join(select)} FROM {spec.table}"
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(f'({condition})' for condition in conditions)
+    sql += ' ORDER BY ' + ', '.join(f'{column} {direction}' for column in spec.order)
+    if limit is not None:
+        # One extra row tells whether there is a next page
+        sql += ' LIMIT ?'
+        params.append(limit + 1)
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        rows = cursor.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(list(rows[-1][len(columns):]))
+
+    width = len(columns)
+    items = [dict(zip(columns, row[:width])) for row in rows]
+    return items, next_cursor
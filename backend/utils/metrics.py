@@ -0,0 +1,140 @@
+"""Prometheus text exposition of HAProxy stats
+
+Rendered from the background sampler's raw ``show stat`` CSV and ``show
+info`` output, so a scrape never triggers its own stats dump. The rendered
+text is cached per sample; label sets are encoded once per proxy/server and
+reused across samples. Every series carries a ``haproxy`` label naming the
+admin endpoint it came from.
+"""
+import re
+import threading
+
+# 'type' column values in 'show stat'
+STAT_ROW_TYPES = {'0': 'frontend', '1': 'backend', '2': 'server', '3': 'listener'}
+
+# Columns that are identifiers rather than metrics
+LABEL_COLUMNS = ('pxname', 'svname', 'type', 'iid', 'sid', 'pid')
+
+_INVALID_NAME_CHARS = re.compile(r'[^a-zA-Z0-9_]')
+
+
+def _metric_name(prefix, field):
+    return prefix + _INVALID_NAME_CHARS.sub('_', field).lower()
+
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _is_number(value):
+    try:
+        float(value)
+    except ValueError:
+        return False
+    return True
+
+
+class PrometheusRenderer:
+    """Renders samples to Prometheus text format, cached per sample"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cached_for = None
+        self._cached = None
+        self._labels = {}
+
+    def render(self, sample):
+        """Get the exposition text (bytes) for a sampler sample"""
+        with self._lock:
+            if self._cached_for is sample:
+                return self._cached
+
+            families = {}
+            for instance, data in sample.get('instances', {}).items():
+                self._render_info(families, instance, data.get('info', ''))
+                self._render_stats(families, instance, data.get('stat_csv', b''))
+
+            # All samples of a metric family must be grouped together
+            output = ''.join(
+                f'# TYPE {name} untyped\n' + ''.join(lines)
+                for name, lines in families.items()
+            )
+            self._cached_for = sample
+            self._cached = output.encode('utf-8')
+            return self._cached
+
+    def _label_set(self, instance, pxname, svname, row_type):
+        """Encoded '{haproxy=..,proxy=..,server=..,type=..}' for a row, memoised"""
+        key = (instance, pxname, svname, row_type)
+        labels = self._labels.get(key)
+        if labels is None:
+            labels = '{haproxy="%s",proxy="%s",server="%s",type="%s"} ' % (
+                _escape_label(instance),
+                _escape_label(pxname),
+                _escape_label(svname),
+                STAT_ROW_TYPES.get(row_type, row_type)
+            )
+            self._labels[key] = labels
+        return labels
+
+    def _render_stats(self, families, instance, data):
+        lines = data.decode('utf-8', 'replace').split('\n')
+        if not lines or not lines[0].startswith('#'):
+            return
+
+        columns = lines[0].lstrip('# ').split(',')
+        rows = [line.split(',') for line in lines[1:] if line]
+        rows = [row for row in rows if len(row) >= len(columns)]
+        if not rows:
+            return
+
+        index = {name: i for i, name in enumerate(columns)}
+        pxname_index = index.get('pxname', 0)
+        svname_index = index.get('svname', 1)
+        type_index = index.get('type')
+
+        # Drop memoised label sets for proxies/servers that no longer exist
+        if len(self._labels) > 4 * len(rows) + 1024:
+            self._labels = {}
+
+        labels = [
+            self._label_set(instance, row[pxname_index], row[svname_index],
+                            row[type_index] if type_index is not None else '')
+            for row in rows
+        ]
+
+        for i, field in enumerate(columns):
+            if not field or field in LABEL_COLUMNS:
+                continue
+
+            values = [(label, row[i]) for label, row in zip(labels, rows) if row[i]]
+            # Only columns whose values are all numeric are metrics
+            if not values or not all(value.isdigit() or _is_number(value) for _, value in values):
+                continue
+
+            name = _metric_name('haproxy_stat_', field)
+            families.setdefault(name, []).extend(f'{name}{label}{value}\n' for label, value in values)
+
+    def _render_info(self, families, instance, info):
+        label = '{haproxy="%s"} ' % _escape_label(instance)
+        for line in info.split('\n'):
+            key, sep, value = line.partition(':')
+            value = value.strip()
+            if not sep or not value or not _is_number(value):
+                continue
+            name = _metric_name('haproxy_process_', key.strip())
+            families.setdefault(name, []).append(f'{name}{label}{value}\n')
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_metrics_renderer():
+    """Get the process-wide Prometheus renderer"""
+    global _renderer
+
+    with _renderer_lock:
+        if _renderer is None:
+            _renderer = PrometheusRenderer()
+        return _renderer
@@ -0,0 +1,187 @@
+"""Listener downtime and drain time of HAProxy reloads
+
+While a reload runs, a probe thread keeps opening TCP connections to the
+frontend listeners; the longest stretch in which connections were refused
+is the listener downtime. A hitless reload (master CLI or ``systemctl
+reload`` with ``expose-fd listeners``) should show none, a restart shows
+the full gap.
+
+After the reload the workers that were running before it keep serving
+their established connections. When the master CLI is available its
+``show proc`` output is polled in the background until those old workers
+have exited, which is the drain time.
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+
+from .admin_socket import send_master_command
+
+PROBE_INTERVAL = 0.01
+PROBE_TIMEOUT = 0.2
+# How long to keep probing after the reload command returned, waiting for
+# the listeners to accept again
+PROBE_SETTLE = 2.0
+DRAIN_POLL_INTERVAL = 0.5
+HISTORY_SIZE = 50
+
+
+def parse_show_proc(text):
+    """
+    Parse the master CLI 'show proc' output.
+    Returns {'master': pid, 'workers': [pids], 'old_workers': [pids]}.
+    """
+    procs = {'master': None, 'workers': [], 'old_workers': []}
+    section = 'workers'
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('#'):
+            if 'old workers' in line:
+                section = 'old_workers'
+            elif 'workers' in line:
+                section = 'workers'
+            elif 'programs' in line:
+                section = None
+            continue
+
+        fields = line.split()
+        if len(fields) < 2 or not fields[0].isdigit():
+            continue
+        if fields[1] == 'master':
+            procs['master'] = int(fields[0])
+        elif fields[1] == 'worker' and section:
+            procs[section].append(int(fields[0]))
+    return procs
+
+
+class ListenerProbe:
+    """Measures the longest window in which a set of listeners refused connections"""
+
+    def __init__(self, addresses):
+        self.addresses = addresses
+        self._returned = None
+        self._thread = None
+        self._down_since = {}
+        self.downtime = 0.0
+        self.failures = 0
+
+    def _connect(self, address):
+        try:
+            with socket.create_connection(address, timeout=PROBE_TIMEOUT):
+                return True
+        except OSError:
+            return False
+
+    def _run(self):
+        while True:
+            now = time.monotonic()
+            all_up = True
+            for address in self.addresses:
+                if self._connect(address):
+                    since = self._down_since.pop(address, None)
+                    if since is not None:
+                        self.downtime = max(self.downtime, now - since)
+                else:
+                    all_up = False
+                    self.failures += 1
+                    self._down_since.setdefault(address, now)
+
+            if self._returned is not None and (all_up or now - self._returned > PROBE_SETTLE):
+                break
+            time.sleep(PROBE_INTERVAL)
+
+        # Listeners that never came back count until the probe gave up
+        end = time.monotonic()
+        for since in self._down_since.values():
+            self.downtime = max(self.downtime, end - since)
+
+    def __enter__(self):
+        if self.addresses:
+            self._thread = threading.Thread(target=self._run, name='haproxy-reload-probe', daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._returned = time.monotonic()
+        if self._thread is not None:
+            self._thread.join()
+        return False
+
+
+class ReloadTracker:
+    """Recent reload measurements; drain times are filled in as workers exit"""
+
+    def __init__(self, size=HISTORY_SIZE, drain_timeout=300.0):
+        self.drain_timeout = drain_timeout
+        self._reloads = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def old_workers(self, master_address):
+        """Worker PIDs running before a reload, or None if unknown"""
+        if not master_address:
+            return None
+        try:
+            return parse_show_proc(send_master_command('show proc', master_address))['workers']
+        except OSError:
+            return None
+
+    def record(self, method, probe, duration, master_address=None, old_workers=None):
+        """Store the measurements of a reload and start watching its drain"""
+        entry = {
+            'id': uuid.uuid4().hex,
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'method': method,
+            'duration_ms': round(duration * 1000, 1),
+            'probed': [f'{host}:{port}' for host, port in probe.addresses],
+            'listener_downtime_ms': round(probe.downtime * 1000, 1) if probe.addresses else None,
+            'refused_connections': probe.failures,
+            'drain_ms': None,
+            'draining': bool(old_workers),
+        }
+        with self._lock:
+            self._reloads.append(entry)
+
+        if old_workers:
+            threading.Thread(
+                target=self._watch_drain, args=(entry, master_address, set(old_workers), time.monotonic()),
+                name='haproxy-drain-watch', daemon=True
+            ).start()
+        return dict(entry)
+
+    def _watch_drain(self, entry, master_address, old_workers, started):
+        while time.monotonic() - started < self.drain_timeout:
+            try:
+                procs = parse_show_proc(send_master_command('show proc', master_address))
+            except OSError:
+                break
+            if not old_workers & set(procs['workers'] + procs['old_workers']):
+                with self._lock:
+                    entry['drain_ms'] = round((time.monotonic() - started) * 1000, 1)
+                    entry['draining'] = False
+                return
+            time.sleep(DRAIN_POLL_INTERVAL)
+
+        with self._lock:
+            entry['draining'] = False
+
+    def recent(self):
+        """Reload measurements, newest first"""
+        with self._lock:
+            return [dict(entry) for entry in reversed(self._reloads)]
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_reload_tracker():
+    """Get the shared reload tracker"""
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            _tracker = ReloadTracker(drain_timeout=float(os.getenv('HAPROXY_DRAIN_TIMEOUT', '300')))
+        return _tracker
@@ -0,0 +1,253 @@
+"""In-memory stats history with fixed-size ring buffers
+
+Every recorded sample stores per-second rates computed from the cumulative
+counters of the previous sample, plus a few gauges, as float32 columns
+(see stats_snapshot.py): one slot of the ring holds, per entity type, the
+row keys and one column per history field. Row keys are shared between
+slots while the set of frontends/backends/servers does not change, and an
+all-zero column (no errors, an idle field) is not stored at all. Memory is
+fixed at ``capacity`` slots no matter how long we run, and recording a
+sample only replaces the oldest slot.
+
+STATS_HISTORY_FIELDS (comma-separated) restricts the recorded fields.
+"""
+import math
+import os
+import threading
+import time
+
+from .stats_snapshot import StatsSnapshot, float_column, is_zero_column
+
+# (output field, stats key) pairs per entity type
+RATE_FIELDS = {
+    'frontend': (
+        ('sessions_rate', 'sessions_total'),
+        ('requests_rate', 'requests_total'),
+        ('bytes_in_rate', 'bytes_in'),
+        ('bytes_out_rate', 'bytes_out'),
+        ('request_errors_rate', 'errors_request'),
+        ('http_5xx_rate', 'http_5xx'),
+    ),
+    'backend': (
+        ('sessions_rate', 'sessions_total'),
+        ('bytes_in_rate', 'bytes_in'),
+        ('bytes_out_rate', 'bytes_out'),
+        ('connection_errors_rate', 'errors_connection'),
+        ('response_errors_rate', 'errors_response'),
+        ('http_5xx_rate', 'http_5xx'),
+    ),
+    'server': (
+        ('sessions_rate', 'sessions_total'),
+        ('bytes_in_rate', 'bytes_in'),
+        ('bytes_out_rate', 'bytes_out'),
+        ('connection_errors_rate', 'errors_connection'),
+        ('response_errors_rate', 'errors_response'),
+        ('http_5xx_rate', 'http_5xx'),
+    ),
+}
+
+# HAProxy's average times (ms) as gauges, for backends and servers
+LATENCY_GAUGES = (
+    ('queue_time', 'queue_time'),
+    ('connect_time', 'connect_time'),
+    ('response_time', 'response_time'),
+    ('total_time', 'total_time'),
+)
+
+GAUGE_FIELDS = {
+    'frontend': (
+        ('sessions_current', 'sessions_current'),
+    ),
+    'backend': (
+        ('sessions_current', 'sessions_current'),
+        ('queue_current', 'queue_current'),
+    ) + LATENCY_GAUGES,
+    'server': (
+        ('sessions_current', 'sessions_current'),
+        ('queue_current', 'queue_current'),
+    ) + LATENCY_GAUGES,
+}
+
+# Rate fields that count failed requests/sessions, for the window error ratio
+ERROR_RATE_FIELDS = ('request_errors_rate', 'connection_errors_rate', 'response_errors_rate')
+
+HISTORY_TYPES = ('frontend', 'backend', 'server')
+
+# Entity type -> stats section
+_SECTIONS = {'frontend': 'frontends', 'backend': 'backends', 'server': 'servers'}
+
+
+class _Block:
+    """One entity type in one slot: row keys, key -> row, field -> column"""
+
+    __slots__ = ('keys', 'index', 'columns')
+
+    def __init__(self, keys, index, columns):
+        self.keys = keys
+        self.index = index
+        # None: all zero. Rate fields are missing from the first sample.
+        self.columns = columns
+
+
+class StatsHistory:
+    """Fixed-memory history of rates and gauges per stats entity"""
+
+    def __init__(self, capacity=720, resolution=5.0, fields=None):
+        self.capacity = capacity
+        self.resolution = resolution
+        # (timestamp, {entity type: _Block}) per slot
+        self._slots = [None] * capacity
+        self._head = 0
+        self._count = 0
+        self._last_record = None
+        self._previous = None
+        self._lock = threading.Lock()
+
+        self.rate_fields = {
+            entity_type: tuple(f for f in pairs if fields is None or f[0] in fields)
+            for entity_type, pairs in RATE_FIELDS.items()
+        }
+        self.gauge_fields = {
+            entity_type: tuple(f for f in pairs if fields is None or f[0] in fields)
+            for entity_type, pairs in GAUGE_FIELDS.items()
+        }
+        # Only the counters and gauges the history needs are kept between samples
+        self._snapshot_fields = {
+            _SECTIONS[entity_type]: (
+                tuple(dict.fromkeys(key for _, key in self.rate_fields[entity_type] + self.gauge_fields[entity_type])),
+                ()
+            )
+            for entity_type in HISTORY_TYPES
+        }
+
+    def fields(self, entity_type):
+        """Recorded fields of an entity type"""
+        return [f for f, _ in self.rate_fields[entity_type]] + [f for f, _ in self.gauge_fields[entity_type]]
+
+    def record(self, stats, timestamp=None):
+        """
+        Record a stats snapshot.
+        Samples closer together than the resolution are skipped, and so are
+        samples missing an admin endpoint: their summed counters drop and
+        would read as a counter reset, then as a spike once it is back.
+        """
+        if 'error' in stats or stats.get('errors'):
+            return
+        now = time.time() if timestamp is None else timestamp
+
+        with self._lock:
+            if self._last_record is not None and now - self._last_record < self.resolution:
+                return
+            self._last_record = now
+
+            previous = self._previous
+            snapshot = StatsSnapshot.from_stats(stats, now, self._snapshot_fields, reuse=previous)
+            elapsed = now - previous.timestamp if previous is not None else 0
+
+            blocks = {}
+            for entity_type in HISTORY_TYPES:
+                section = _SECTIONS[entity_type]
+                data = snapshot.sections[section]
+                columns = {}
+                if elapsed > 0:
+                    for field, stat_key in self.rate_fields[entity_type]:
+                        columns[field] = snapshot.rate(previous, section, stat_key, elapsed)
+                for field, stat_key in self.gauge_fields[entity_type]:
+                    columns[field] = float_column(data.numbers[stat_key])
+                for field, column in columns.items():
+                    if is_zero_column(column):
+                        columns[field] = None
+                blocks[entity_type] = _Block(data.keys, data.index, columns)
+
+            self._slots[self._head] = (now, blocks)
+            self._head = (self._head + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+            self._previous = snapshot
+
+    def query(self, entity_type, name, window=3600, step=None, now=None):
+        """
+        Get downsampled history for one entity.
+        Each point is the average of the samples in a step-sized bucket;
+        'averages' holds the average of every field over the whole window,
+        plus the error ratio (failed share of requests) over the window.
+        Returns None if the entity has no history.
+        """
+        now = time.time() if now is None else now
+        step = max(step or window / 60, self.resolution)
+        start = now - window
+        buckets = int(math.ceil(window / step))
+
+        fields = self.fields(entity_type)
+        sums = {field: [0.0] * buckets for field in fields}
+        counts = {field: [0] * buckets for field in fields}
+        found = False
+
+        with self._lock:
+            for i in range(self._count):
+                ts, blocks = self._slots[(self._head - self._count + i) % self.capacity]
+                block = blocks[entity_type]
+                position = block.index.get(name)
+                if position is None:
+                    continue
+                found = True
+                if ts < start or ts > now:
+                    continue
+                bucket = min(int((ts - start) // step), buckets - 1)
+                for field in fields:
+                    if field not in block.columns:
+                        continue
+                    column = block.columns[field]
+                    value = 0.0 if column is None else column[position]
+                    if value == value:  # skip NaN gaps
+                        sums[field][bucket] += value
+                        counts[field][bucket] += 1
+
+        if not found:
+            return None
+
+        points = {
+            field: [
+                round(total / n, 3) if n else None
+                for total, n in zip(sums[field], counts[field])
+            ]
+            for field in fields
+        }
+
+        averages = {}
+        for field in fields:
+            n = sum(counts[field])
+            averages[field] = round(sum(sums[field]) / n, 3) if n else None
+
+        requests = averages.get('requests_rate') or averages.get('sessions_rate')
+        errors = sum(averages[f] or 0 for f in ERROR_RATE_FIELDS if f in averages)
+        averages['error_ratio'] = round(errors / requests, 6) if requests else None
+
+        return {
+            'type': entity_type,
+            'name': name,
+            'window': window,
+            'step': step,
+            'start': round(start, 3),
+            'timestamps': [round(start + i * step, 3) for i in range(buckets)],
+            'points': points,
+            'averages': averages
+        }
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def get_stats_history():
+    """Get the process-wide stats history"""
+    global _history
+
+    with _history_lock:
+        if _history is None:
+            fields = os.getenv('STATS_HISTORY_FIELDS')
+            _history = StatsHistory(
+                capacity=int(os.getenv('STATS_HISTORY_SIZE', '720')),
+                resolution=float(os.getenv('STATS_HISTORY_RESOLUTION', '5')),
+                fields={f.strip() for f in fields.split(',') if f.strip()} if fields else None
+            )
+        return _history
@@ -0,0 +1,407 @@
+"""Streaming parser for HAProxy 'show stat' CSV output
+
+The parser is fed raw bytes as they arrive from the admin socket. Complete
+lines are parsed immediately; only the trailing partial line is carried over
+to the next chunk. Column positions are resolved once from the header line
+and each row only converts the columns that end up in the result.
+"""
+from operator import itemgetter
+
+# HTTP status class counters (frontends, backends and servers)
+HTTP_STATUS_FIELDS = (
+    ('http_1xx', 'hrsp_1xx'),
+    ('http_2xx', 'hrsp_2xx'),
+    ('http_3xx', 'hrsp_3xx'),
+    ('http_4xx', 'hrsp_4xx'),
+    ('http_5xx', 'hrsp_5xx'),
+    ('http_other', 'hrsp_other'),
+)
+
+# Average times in ms over the last 1024 requests, and error counters
+# (backends and servers)
+LATENCY_ERROR_FIELDS = (
+    ('queue_time', 'qtime'),
+    ('connect_time', 'ctime'),
+    ('response_time', 'rtime'),
+    ('total_time', 'ttime'),
+    ('errors_connection', 'econ'),
+    ('errors_response', 'eresp'),
+    ('retries', 'wretr'),
+    ('redispatches', 'wredis'),
+)
+
+# Latency fields are averages, not counters
+LATENCY_FIELDS = ('queue_time', 'connect_time', 'response_time', 'total_time')
+
+# Fields that only grow (until a reload resets them), so their change over
+# time is a rate; the others are gauges
+COUNTER_FIELDS = frozenset((
+    'sessions_total', 'bytes_in', 'bytes_out', 'requests_total', 'errors_request',
+    'denied_requests', 'denied_responses', 'errors_connection', 'errors_response',
+    'retries', 'redispatches', 'downtime',
+) + tuple(key for key, _ in HTTP_STATUS_FIELDS))
+
+# (output key, CSV column) pairs for each row type
+FRONTEND_INT_FIELDS = (
+    ('sessions_current', 'scur'),
+    ('sessions_total', 'stot'),
+    ('bytes_in', 'bin'),
+    ('bytes_out', 'bout'),
+    ('requests_total', 'req_tot'),
+    ('rate', 'rate'),
+    ('errors_request', 'ereq'),
+    ('denied_requests', 'dreq'),
+    ('denied_responses', 'dresp'),
+) + HTTP_STATUS_FIELDS
+FRONTEND_STR_FIELDS = (
+    ('name', 'pxname'),
+    ('status', 'status'),
+)
+
+BACKEND_INT_FIELDS = (
+    ('sessions_current', 'scur'),
+    ('sessions_total', 'stot'),
+    ('bytes_in', 'bin'),
+    ('bytes_out', 'bout'),
+    ('queue_current', 'qcur'),
+    ('active_servers', 'act'),
+    ('backup_servers', 'bck'),
+    ('requests_total', 'req_tot'),
+) + LATENCY_ERROR_FIELDS + HTTP_STATUS_FIELDS
+BACKEND_STR_FIELDS = (
+    ('name', 'pxname'),
+    ('status', 'status'),
+)
+
+SERVER_INT_FIELDS = (
+    ('weight', 'weight'),
+    ('sessions_current', 'scur'),
+    ('sessions_total', 'stot'),
+    ('bytes_in', 'bin'),
+    ('bytes_out', 'bout'),
+    ('downtime', 'downtime'),
+    ('queue_current', 'qcur'),
+) + LATENCY_ERROR_FIELDS + HTTP_STATUS_FIELDS
+SERVER_STR_FIELDS = (
+    ('backend', 'pxname'),
+    ('name', 'svname'),
+    ('status', 'status'),
+    ('check_status', 'check_status'),
+    ('last_status_change', 'lastchg'),
+)
+
+# Server columns summed into the summary block
+SUMMARY_FIELDS = (
+    ('total_sessions', 'sessions_total'),
+    ('current_sessions', 'sessions_current'),
+    ('bytes_in', 'bytes_in'),
+    ('bytes_out', 'bytes_out'),
+)
+
+STR_DEFAULTS = {'status': 'UNKNOWN'}
+
+# Ever-growing counters; every other numeric column mostly holds small
+# values that repeat across rows (0, weights, latencies, error counts)
+COUNTER_COLUMNS = {'stot', 'bin', 'bout', 'req_tot', 'hrsp_2xx', 'hrsp_3xx', 'hrsp_4xx'}
+
+
+class _IntCache(dict):
+    """bytes -> int for CSV values, memoising short ones. Empty means 0."""
+
+    def __missing__(self, value):
+        number = int(value) if value else 0
+        if len(value) <= 3:
+            self[value] = number
+        return number
+
+
+_to_int = _IntCache().__getitem__
+
+
+def add_derived_fields(section, row):
+    """
+    Add ratios computed from a row's counters:
+    error_ratio - failed share of requests (frontends: invalid requests;
+                  backends/servers: connection plus response errors)
+    http_5xx_ratio - share of HTTP responses that were 5xx
+    """
+    if section == 'frontends':
+        requests = row['requests_total'] or row['sessions_total']
+        errors = row['errors_request']
+    else:
+        requests = row['sessions_total']
+        errors = row['errors_connection'] + row['errors_response']
+
+    responses = (row['http_1xx'] + row['http_2xx'] + row['http_3xx'] +
+                 row['http_4xx'] + row['http_5xx'] + row['http_other'])
+
+    row['error_ratio'] = round(errors / requests, 6) if requests else 0.0
+    row['http_5xx_ratio'] = round(row['http_5xx'] / responses, 6) if responses else 0.0
+    return row
+
+
+def empty_stats():
+    """Return an empty stats structure"""
+    return {
+        'frontends': [],
+        'backends': [],
+        'servers': [],
+        'summary': {
+            'total_sessions': 0,
+            'current_sessions': 0,
+            'bytes_in': 0,
+            'bytes_out': 0
+        }
+    }
+
+
+class _RowSpec:
+    """Precomputed column lookups for one row type"""
+
+    def __init__(self, columns, int_fields, str_fields):
+        counter_fields = tuple(f for f in int_fields if f[1] in COUNTER_COLUMNS)
+        small_fields = tuple(f for f in int_fields if f[1] not in COUNTER_COLUMNS)
+        counter_keys, self.counter_getter, counter_defaults = self._split(columns, counter_fields, 0)
+        small_keys, self.small_getter, small_defaults = self._split(columns, small_fields, 0)
+        str_keys, self.str_getter, self.str_defaults = self._split(columns, str_fields, None)
+        self.int_defaults = dict(counter_defaults, **small_defaults)
+        self.keys = str_keys + counter_keys + small_keys
+        # Highest column index this row type reads
+        self.last_column = max((columns[column] for _, column in int_fields + str_fields
+                                if column in columns), default=0)
+
+    @staticmethod
+    def _split(columns, fields, default):
+        keys = []
+        indexes = []
+        defaults = {}
+        for key, column in fields:
+            index = columns.get(column)
+            if index is None:
+                # Column not present in this HAProxy version
+                defaults[key] = default if default is not None else STR_DEFAULTS.get(key, '')
+            else:
+                keys.append(key)
+                indexes.append(index)
+
+        if not indexes:
+            getter = lambda values: ()
+        elif len(indexes) == 1:
+            single = itemgetter(indexes[0])
+            getter = lambda values: (single(values),)
+        else:
+            getter = itemgetter(*indexes)
+
+        return tuple(keys), getter, defaults
+
+    def build(self, values):
+        """Build the output dict for one split CSV row"""
+        counters = self.counter_getter(values)
+        try:
+            counters = list(map(int, counters))
+        except ValueError:
+            # Columns that do not apply to a row (e.g. hrsp_* in TCP mode) are empty
+            counters = list(map(_to_int, counters))
+        entry = dict(zip(self.keys, [v.decode('utf-8', 'replace') for v in self.str_getter(values)] +
+                         counters + list(map(_to_int, self.small_getter(values)))))
+        if self.str_defaults:
+            entry.update(self.str_defaults)
+        if self.int_defaults:
+            entry.update(self.int_defaults)
+        return entry
+
+
+class StatCsvParser:
+    """Incremental 'show stat' CSV parser"""
+
+    def __init__(self, keep_raw=False):
+        self.stats = empty_stats()
+        # Optional copy of the raw response, for consumers needing every column
+        self.raw = bytearray() if keep_raw else None
+        self._tail = b''
+        self._ncolumns = None
+        self._maxsplit = None
+        self._svname = None
+        self._frontend = None
+        self._backend = None
+        self._server = None
+
+    def feed(self, chunk):
+        """Parse all complete lines in chunk, keeping any partial line"""
+        if self.raw is not None:
+            self.raw += chunk
+        data = self._tail + bytes(chunk) if self._tail else bytes(chunk)
+        end = data.rfind(b'\n')
+        if end == -1:
+            self._tail = data
+            return
+
+        self._tail = data[end + 1:]
+        for line in data[:end].split(b'\n'):
+            self._parse_line(line)
+
+    def close(self):
+        """Parse any remaining data and return the stats structure"""
+        if self._tail:
+            self._parse_line(self._tail)
+            self._tail = b''
+        return self.stats
+
+    def _parse_header(self, line):
+        names = line.lstrip(b'# ').rstrip(b'\r').decode('utf-8', 'replace').split(',')
+        columns = {}
+        for index, name in enumerate(names):
+            columns.setdefault(name, index)
+
+        self._ncolumns = len(names)
+        self._svname = columns.get('svname', 1)
+        self._frontend = _RowSpec(columns, FRONTEND_INT_FIELDS, FRONTEND_STR_FIELDS)
+        self._backend = _RowSpec(columns, BACKEND_INT_FIELDS, BACKEND_STR_FIELDS)
+        self._server = _RowSpec(columns, SERVER_INT_FIELDS, SERVER_STR_FIELDS)
+        # Columns past the last one we read are left unsplit
+        self._maxsplit = max(self._svname, self._frontend.last_column,
+                             self._backend.last_column, self._server.last_column) + 1
+
+    def _parse_line(self, line):
+        if not line.strip():
+            return
+
+        if self._ncolumns is None:
+            self._parse_header(line)
+            return
+
+        values = line.rstrip(b'\r').split(b',', self._maxsplit)
+        if len(values) < self._maxsplit:
+            return
+
+        svname = values[self._svname]
+        if svname == b'FRONTEND':
+            self.stats['frontends'].append(add_derived_fields('frontends', self._frontend.build(values)))
+        elif svname == b'BACKEND':
+            self.stats['backends'].append(add_derived_fields('backends', self._backend.build(values)))
+        else:
+            server = add_derived_fields('servers', self._server.build(values))
+            self.stats['servers'].append(server)
+
+            summary = self.stats['summary']
+            for summary_key, key in SUMMARY_FIELDS:
+                summary[summary_key] += server[key]
+
+
+def merge_stats(target, source):
+    """Append the rows of source into target and add up the summaries"""
+    for key in ('frontends', 'backends', 'servers'):
+        target[key].extend(source[key])
+    for key, value in source['summary'].items():
+        target['summary'][key] += value
+    return target
+
+
+# Numeric fields describing configuration or state rather than traffic,
+# which must not be added up when aggregating instances
+NON_ADDITIVE_FIELDS = {'weight', 'downtime', 'error_ratio', 'http_5xx_ratio'}
+
+
+def _stat_row_key(section, row):
+    if section == 'servers':
+        return (row['backend'], row['name'])
+    return row['name']
+
+
+def aggregate_stats(instances):
+    """
+    Merge stats from several HAProxy instances into one.
+    instances is a list of (name, stats). Rows for the same proxy/server are
+    combined: traffic counters are added up and differing statuses are
+    joined ('UP/DOWN').
+    """
+    if len(instances) == 1:
+        return instances[0][1]
+
+    result = empty_stats()
+    for section in ('frontends', 'backends', 'servers'):
+        merged = {}
+        # Latency sums weighted by sessions, per merged row
+        latency = {}
+        for _, stats in instances:
+            for row in stats[section]:
+                key = _stat_row_key(section, row)
+                existing = merged.get(key)
+                if existing is None:
+                    existing = merged[key] = dict(row)
+                else:
+                    for field, value in row.items():
+                        if field == 'status':
+                            if value not in existing['status'].split('/'):
+                                existing['status'] += '/' + value
+                        elif isinstance(value, int) and field not in NON_ADDITIVE_FIELDS \
+                                and field not in LATENCY_FIELDS:
+                            existing[field] += value
+
+                if section != 'frontends':
+                    weight = row['sessions_total'] or 1
+                    sums = latency.setdefault(key, [0, 0, 0, 0, 0])
+                    for i, field in enumerate(LATENCY_FIELDS):
+                        sums[i] += row[field] * weight
+                    sums[4] += weight
+
+        for key, sums in latency.items():
+            for i, field in enumerate(LATENCY_FIELDS):
+                merged[key][field] = round(sums[i] / sums[4])
+        for row in merged.values():
+            add_derived_fields(section, row)
+        result[section] = list(merged.values())
+
+    for _, stats in instances:
+        for key, value in stats['summary'].items():
+            result['summary'][key] += value
+
+    return result
+
+
+def parse_proxy_index(data):
+    """
+    Build a name -> proxy id map from a 'show stat' response.
+    Each entry records the proxy id and whether it has a frontend and/or a
+    backend side (a 'listen' section has both).
+    """
+    if isinstance(data, bytes):
+        data = data.decode('utf-8', 'replace')
+
+    lines = data.strip().split('\n')
+    if not lines or not lines[0].startswith('#'):
+        return {}
+
+    columns = lines[0].lstrip('# ').split(',')
+    try:
+        pxname_index = columns.index('pxname')
+        svname_index = columns.index('svname')
+        iid_index = columns.index('iid')
+    except ValueError:
+        return {}
+
+    proxies = {}
+    for line in lines[1:]:
+        values = line.split(',')
+        if len(values) <= iid_index:
+            continue
+        svname = values[svname_index]
+        if svname not in ('FRONTEND', 'BACKEND'):
+            continue
+        entry = proxies.setdefault(values[pxname_index], {
+            'iid': int(values[iid_index] or 0),
+            'frontend': False,
+            'backend': False
+        })
+        entry['frontend' if svname == 'FRONTEND' else 'backend'] = True
+
+    return proxies
+
+
+def parse_stat_csv(data):
+    """Parse a complete 'show stat' response (bytes or str)"""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    parser = StatCsvParser()
+    parser.feed(data)
+    return parser.close()
@@ -0,0 +1,164 @@
+"""Background HAProxy stats sampler with a shared snapshot cache
+
+One background thread collects a stats sample per interval. Requests are
+served from the cached sample; if it is stale and a refresh is already in
+flight, callers wait for that refresh instead of starting their own, so the
+admin socket sees at most one ``show stat`` dump per interval regardless of
+how many dashboards are open.
+
+A sample is a dict with the parsed ``stats`` plus whatever else the collect
+function gathered in the same pass (e.g. the raw CSV for /metrics).
+"""
+import os
+import threading
+import time
+
+from .stats_snapshot import get_sample_snapshot
+
+
+class StatsSampler:
+    """Periodically collects stats and caches the latest snapshot"""
+
+    def __init__(self, collect, interval=2.0):
+        self._collect = collect
+        self.interval = interval
+        self._cond = threading.Condition()
+        self._sample = None
+        self._previous = None
+        self._taken_at = 0.0
+        self._generation = 0
+        self._refreshing = False
+        self._thread = None
+        self._pid = None
+        self._stopped = threading.Event()
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """
+        Register callback(snapshot, timestamp) to be called with every
+        successfully collected snapshot (timestamp is epoch seconds).
+        """
+        self._listeners.append(callback)
+
+    def start(self):
+        """Start the sampling thread (again, after a fork) if needed"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+
+        with self._cond:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._refreshing = False
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='stats-sampler', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        """Sampling loop"""
+        while not self._stopped.is_set():
+            started = time.monotonic()
+            self.refresh()
+            elapsed = time.monotonic() - started
+            self._stopped.wait(max(self.interval - elapsed, 0.0))
+
+    def refresh(self):
+        """
+        Collect a new sample, or wait for the refresh already in progress.
+        Returns the resulting sample.
+        """
+        with self._cond:
+            if self._refreshing:
+                generation = self._generation
+                while self._refreshing and self._generation == generation:
+                    self._cond.wait()
+                return self._sample
+            self._refreshing = True
+
+        try:
+            sample = self._collect()
+        except Exception as e:
+            sample = {'stats': {'error': f'Failed to sample HAProxy stats: {str(e)}'}}
+        sample['timestamp'] = time.time()
+
+        # Only one refresh runs at a time, so self._sample is stable here.
+        # The sample being replaced is kept as a columnar snapshot only,
+        # without its row dicts and raw output.
+        previous = self._previous
+        replaced = self._sample
+        if replaced is not None and 'error' not in replaced['stats']:
+            reuse = previous['snapshot'] if previous is not None else None
+            previous = {
+                'timestamp': replaced['timestamp'],
+                'snapshot': get_sample_snapshot(replaced, reuse=reuse)
+            }
+
+        with self._cond:
+            self._previous = previous
+            self._sample = sample
+            self._taken_at = time.monotonic()
+            self._generation += 1
+            self._refreshing = False
+            self._cond.notify_all()
+
+        stats = sample['stats']
+        if stats and 'error' not in stats:
+            for callback in self._listeners:
+                try:
+                    callback(stats, sample['timestamp'])
+                except Exception:
+                    # A failing consumer must not stop sampling
+                    pass
+
+        return sample
+
+    def get_sample(self):
+        """Get the latest sample, refreshing it if older than the interval"""
+        self.start()
+
+        with self._cond:
+            if self._sample is not None and time.monotonic() - self._taken_at < self.interval:
+                return self._sample
+
+        return self.refresh()
+
+    def get(self):
+        """Get the latest stats snapshot"""
+        return self.get_sample()['stats']
+
+    def get_previous_sample(self):
+        """
+        Get the successful sample taken before the latest one, or None.
+        It only holds its 'timestamp' and columnar 'snapshot'.
+        """
+        with self._cond:
+            return self._previous
+
+    def age(self):
+        """Seconds since the cached sample was taken, or None"""
+        with self._cond:
+            if self._sample is None:
+                return None
+            return time.monotonic() - self._taken_at
+
+    def stop(self):
+        """Stop the sampling thread"""
+        self._stopped.set()
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def get_stats_sampler():
+    """Get the process-wide stats sampler"""
+    global _sampler
+
+    with _sampler_lock:
+        if _sampler is None:
+            from .haproxy import read_stats_sample
+            _sampler = StatsSampler(
+                read_stats_sample,
+                interval=float(os.getenv('STATS_SAMPLE_INTERVAL', '2'))
+            )
+        return _sampler
@@ -0,0 +1,290 @@
+"""Compact columnar stats snapshots
+
+A StatsSnapshot stores every numeric stats field as one typed column
+(``array('q')``, or an int64 NumPy array when NumPy is installed) and the
+row names as a tuple of interned strings, instead of one dict per row.
+Names and repeated string values (statuses, check results) are shared
+between snapshots, so holding many of them mostly costs 8 bytes per value.
+
+Aggregations work on whole columns: per-group sums, top-N, deltas and
+rates between two snapshots. to_stats() rebuilds the regular /api/stats
+structure. Snapshots restricted to a few columns back the retained stats:
+the sampler's previous sample and every slot of the stats history.
+"""
+import heapq
+import sys
+from array import array
+from operator import itemgetter
+
+from .stats_parser import (
+    BACKEND_INT_FIELDS, BACKEND_STR_FIELDS, FRONTEND_INT_FIELDS, FRONTEND_STR_FIELDS,
+    SERVER_INT_FIELDS, SERVER_STR_FIELDS, add_derived_fields
+)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# section -> (numeric fields, string fields)
+SNAPSHOT_FIELDS = {
+    'frontends': (tuple(k for k, _ in FRONTEND_INT_FIELDS), tuple(k for k, _ in FRONTEND_STR_FIELDS)),
+    'backends': (tuple(k for k, _ in BACKEND_INT_FIELDS), tuple(k for k, _ in BACKEND_STR_FIELDS)),
+    'servers': (tuple(k for k, _ in SERVER_INT_FIELDS), tuple(k for k, _ in SERVER_STR_FIELDS)),
+}
+
+_intern = sys.intern
+
+NAN = float('nan')
+
+
+def _row_key(section, row):
+    if section == 'servers':
+        return _intern(f"{row['backend']}/{row['name']}")
+    return _intern(row['name'])
+
+
+def _make_column(values):
+    if numpy is not None:
+        return numpy.fromiter(values, dtype=numpy.int64)
+    return array('q', values)
+
+
+def float_column(values):
+    """float32 column (array('f'), or a NumPy array)"""
+    if numpy is not None:
+        return numpy.asarray(values, dtype=numpy.float32)
+    return array('f', values)
+
+
+def is_zero_column(column):
+    """Whether every value of a column is zero"""
+    if numpy is not None and isinstance(column, numpy.ndarray):
+        return not column.any()
+    return column.count(0) == len(column)
+
+
+class _Section:
+    """Columns for the rows of one section (frontends, backends or servers)"""
+
+    __slots__ = ('keys', 'numbers', 'strings', '_index')
+
+    def __init__(self, keys, numbers, strings):
+        self.keys = keys
+        self.numbers = numbers
+        self.strings = strings
+        self._index = None
+
+    @property
+    def index(self):
+        """Row key -> position"""
+        if self._index is None:
+            self._index = {key: i for i, key in enumerate(self.keys)}
+        return self._index
+
+    def nbytes(self):
+        total = sum(column.itemsize * len(column) for column in self.numbers.values())
+        # Pointer arrays only: names and string values are interned and shared
+        total += 8 * len(self.keys) * (1 + len(self.strings))
+        return total
+
+
+class StatsSnapshot:
+    """Struct-of-arrays copy of a stats structure"""
+
+    def __init__(self, sections, summary, timestamp=None):
+        self.sections = sections
+        self.summary = summary
+        self.timestamp = timestamp
+
+    @classmethod
+    def from_stats(cls, stats, timestamp=None, fields=None, reuse=None):
+        """
+        Build a snapshot from a parsed stats structure. fields restricts it
+        to some sections and columns, like SNAPSHOT_FIELDS. The row keys of
+        the reuse snapshot are shared where the rows are the same, so
+        snapshots kept together store each key tuple once.
+        """
+        sections = {}
+        for section, (number_fields, string_fields) in (fields or SNAPSHOT_FIELDS).items():
+            rows = stats.get(section, [])
+            keys = tuple(_row_key(section, row) for row in rows)
+            shared = reuse.sections.get(section) if reuse is not None else None
+            if shared is not None and shared.keys == keys:
+                keys = shared.keys
+            else:
+                shared = None
+            numbers = {
+                field: _make_column(map(itemgetter(field), rows))
+                for field in number_fields
+            }
+            strings = {
+                field: [_intern(value) for value in map(itemgetter(field), rows)]
+                for field in string_fields
+            }
+            sections[section] = _Section(keys, numbers, strings)
+            if shared is not None:
+                sections[section]._index = shared.index
+        return cls(sections, dict(stats.get('summary', {})), timestamp)
+
+    def to_stats(self):
+        """Rebuild the /api/stats structure (rows as dicts)"""
+        stats = {'summary': dict(self.summary)}
+        for section, data in self.sections.items():
+            fields = tuple(data.strings) + tuple(data.numbers)
+            columns = list(data.strings.values()) + [
+                column.tolist() for column in data.numbers.values()
+            ]
+            stats[section] = [
+                add_derived_fields(section, dict(zip(fields, values)))
+                for values in zip(*columns)
+            ] if data.keys else []
+        return stats
+
+    def __len__(self):
+        return sum(len(data.keys) for data in self.sections.values())
+
+    def nbytes(self):
+        """Approximate memory held by this snapshot's own columns"""
+        return sum(data.nbytes() for data in self.sections.values())
+
+    def keys(self, section):
+        """Row keys of a section ('backend/server' for servers)"""
+        return self.sections[section].keys
+
+    def column(self, section, field):
+        """One numeric column of a section"""
+        return self.sections[section].numbers[field]
+
+    def sum_by(self, section, field, group='backend', previous=None):
+        """
+        Sum a numeric column per value of a string column, e.g. per backend.
+        With a previous snapshot, sums the rows' changes since then (see delta()).
+        """
+        data = self.sections[section]
+        groups = data.strings[group]
+        column = data.numbers[field] if previous is None else self.delta(previous, section, field)
+
+        if numpy is not None:
+            names, codes = numpy.unique(numpy.array(groups, dtype=object), return_inverse=True)
+            totals = numpy.zeros(len(names), dtype=numpy.int64)
+            numpy.add.at(totals, codes, column)
+            return {name: int(total) for name, total in zip(names.tolist(), totals.tolist())}
+
+        totals = {}
+        for name, value in zip(groups, column):
+            totals[name] = totals.get(name, 0) + value
+        return totals
+
+    def delta(self, previous, section, field):
+        """
+        Per-row change of a counter since a previous snapshot, aligned with
+        this snapshot's rows. Rows that are new, or whose counter went down
+        (the counters were reset by a reload), count from zero.
+        """
+        data = self.sections[section]
+        current = data.numbers[field]
+        old_data = previous.sections.get(section)
+        if old_data is None or not old_data.keys:
+            return current
+
+        old = old_data.numbers[field]
+        if old_data.keys == data.keys:
+            if numpy is not None:
+                diff = current - old
+                return numpy.where(diff < 0, current, diff)
+            return array('q', [
+                value - before if value >= before else value
+                for value, before in zip(current, old)
+            ])
+
+        # Rows were added, removed or reordered: align by key
+        old_index = old_data.index
+        if numpy is not None:
+            positions = numpy.fromiter((old_index.get(key, -1) for key in data.keys),
+                                       dtype=numpy.int64, count=len(data.keys))
+            before = numpy.where(positions >= 0, old[numpy.maximum(positions, 0)], 0)
+            diff = current - before
+            return numpy.where(diff < 0, current, diff)
+
+        result = array('q', current)
+        for i, key in enumerate(data.keys):
+            position = old_index.get(key)
+            if position is not None and current[i] >= old[position]:
+                result[i] = current[i] - old[position]
+        return result
+
+    def rate(self, previous, section, field, elapsed):
+        """
+        Per-second change of a counter since a previous snapshot taken
+        elapsed seconds before, as a float32 column aligned with this
+        snapshot's rows. Rows the previous snapshot does not have are NaN;
+        a counter that went down (reset by a reload) counts from zero.
+        """
+        data = self.sections[section]
+        current = data.numbers[field]
+        old_data = previous.sections.get(section)
+        if old_data is None or not old_data.keys:
+            return float_column([NAN] * len(current))
+
+        old = old_data.numbers[field]
+        same = old_data.keys == data.keys
+        if numpy is not None:
+            if same:
+                before = old
+                missing = None
+            else:
+                old_index = old_data.index
+                positions = numpy.fromiter((old_index.get(key, -1) for key in data.keys),
+                                           dtype=numpy.int64, count=len(data.keys))
+                missing = positions < 0
+                before = old[numpy.maximum(positions, 0)]
+            diff = current - before
+            rates = numpy.where(diff < 0, current, diff).astype(numpy.float32) / numpy.float32(elapsed)
+            if missing is not None:
+                rates[missing] = numpy.nan
+            return rates
+
+        if same:
+            return array('f', [
+                (value - before if value >= before else value) / elapsed
+                for value, before in zip(current, old)
+            ])
+
+        old_index = old_data.index
+        result = array('f', [NAN]) * len(current)
+        for i, key in enumerate(data.keys):
+            position = old_index.get(key)
+            if position is not None:
+                value = current[i]
+                before = old[position]
+                result[i] = (value - before if value >= before else value) / elapsed
+        return result
+
+    def top(self, section, field, n=10, previous=None):
+        """
+        The n rows with the highest value of field, as (key, value) pairs.
+        With a previous snapshot, rows are ranked by their change since then.
+        """
+        data = self.sections[section]
+        values = data.numbers[field] if previous is None else self.delta(previous, section, field)
+        n = min(n, len(values))
+        if n <= 0:
+            return []
+
+        if numpy is not None:
+            positions = numpy.argpartition(values, len(values) - n)[-n:]
+            positions = positions[numpy.argsort(values[positions], kind='stable')[::-1]]
+            return [(data.keys[i], int(values[i])) for i in positions.tolist()]
+
+        positions = heapq.nlargest(n, range(len(values)), key=values.__getitem__)
+        return [(data.keys[i], values[i]) for i in positions]
+
+
+def get_sample_snapshot(sample, reuse=None):
+    """Get the columnar snapshot of a sampler sample, building it once"""
+    snapshot = sample.get('snapshot')
+    if snapshot is None:
+        snapshot = StatsSnapshot.from_stats(sample['stats'], sample.get('timestamp'), reuse=reuse)
+        sample['snapshot'] = snapshot
+    return snapshot
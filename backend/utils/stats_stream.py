@@ -0,0 +1,203 @@
+"""Server-Sent Events fan-out of live stats
+
+The stats sampler publishes every snapshot here. The change set against the
+previous snapshot is computed and encoded once per sample, and the same
+encoded event is handed to every subscriber's queue.
+"""
+import json
+import queue
+import threading
+
+STREAM_SECTIONS = ('frontends', 'backends', 'servers')
+
+
+def _row_key(section, row):
+    if section == 'servers':
+        return f"{row['backend']}/{row['name']}"
+    return row['name']
+
+
+def index_stats(stats):
+    """Index snapshot rows by their stream key"""
+    index = {}
+    for section in STREAM_SECTIONS:
+        index[section] = {_row_key(section, row): row for row in stats.get(section, [])}
+    return index
+
+
+def diff_stats(previous, current):
+    """
+    Compute the change set between two indexed snapshots.
+    New rows are sent in full, changed rows only with their changed fields.
+    """
+    changed = {}
+    removed = {}
+
+    for section in STREAM_SECTIONS:
+        old_rows = previous.get(section, {})
+        new_rows = current.get(section, {})
+
+        section_changes = {}
+        for key, row in new_rows.items():
+            old = old_rows.get(key)
+            if old is None:
+                section_changes[key] = row
+            elif old is not row:
+                fields = {field: value for field, value in row.items() if old.get(field) != value}
+                if fields:
+                    section_changes[key] = fields
+        if section_changes:
+            changed[section] = section_changes
+
+        gone = [key for key in old_rows if key not in new_rows]
+        if gone:
+            removed[section] = gone
+
+    return changed, removed
+
+
+def format_event(event, data):
+    """Encode one SSE message"""
+    return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+
+class Subscription:
+    """A single connected stream client"""
+
+    def __init__(self, size):
+        self.queue = queue.Queue(maxsize=size)
+        # Set when the client fell behind and missed events
+        self.overflowed = False
+
+    def get(self, timeout):
+        return self.queue.get(timeout=timeout)
+
+
+class StatsBroadcaster:
+    """Turns sampled snapshots into delta events for all subscribers"""
+
+    def __init__(self, queue_size=16):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._stats = None
+        # Index of _stats, built only while there are subscribers
+        self._index = None
+        self._seq = 0
+        self._timestamp = None
+        self._snapshot_event = None
+
+    def publish(self, stats, timestamp):
+        """Sampler listener: diff against the last snapshot and fan out"""
+        with self._lock:
+            previous_stats = self._stats
+            previous = self._index
+            self._seq += 1
+            self._stats = stats
+            self._index = None
+            self._timestamp = timestamp
+            self._snapshot_event = None
+            seq = self._seq
+            subscribers = list(self._subscribers)
+
+        # Nobody listening: new subscribers start from the full snapshot anyway,
+        # so the index is only built once there is someone to diff for
+        if not subscribers:
+            return
+
+        if previous is None:
+            previous = index_stats(previous_stats) if previous_stats else {}
+        previous_summary = previous_stats['summary'] if previous_stats else {}
+        index = index_stats(stats)
+        with self._lock:
+            if self._seq == seq:
+                self._index = index
+
+        changed, removed = diff_stats(previous, index)
+        summary = {k: v for k, v in stats.get('summary', {}).items() if previous_summary.get(k) != v}
+
+        if not (changed or removed or summary):
+            return
+
+        event = format_event('delta', {
+            'seq': seq,
+            'timestamp': timestamp,
+            'changed': changed,
+            'removed': removed,
+            'summary': summary
+        })
+
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(event)
+            except queue.Full:
+                subscription.overflowed = True
+
+    def snapshot_event(self):
+        """Full snapshot event for new or resynchronising clients (or None)"""
+        with self._lock:
+            if self._stats is None:
+                return None
+            if self._snapshot_event is None:
+                self._snapshot_event = format_event('snapshot', {
+                    'seq': self._seq,
+                    'timestamp': self._timestamp,
+                    'stats': self._stats
+                })
+            return self._snapshot_event
+
+    def subscribe(self):
+        subscription = Subscription(self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def stream(self, keepalive=15.0):
+        """Generate SSE messages for a new subscriber until it disconnects"""
+        subscription = self.subscribe()
+        try:
+            event = self.snapshot_event()
+            if event:
+                yield event
+
+            while True:
+                if subscription.overflowed:
+                    # Drop whatever is queued and resynchronise with a full snapshot
+                    subscription.overflowed = False
+                    while True:
+                        try:
+                            subscription.queue.get_nowait()
+                        except queue.Empty:
+                            break
+                    event = self.snapshot_event()
+                    if event:
+                        yield event
+
+                try:
+                    yield subscription.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+        finally:
+            self.unsubscribe(subscription)
+
+
+_broadcaster = None
+_broadcaster_lock = threading.Lock()
+
+
+def get_stats_broadcaster():
+    """Get the process-wide stats broadcaster"""
+    global _broadcaster
+
+    with _broadcaster_lock:
+        if _broadcaster is None:
+            _broadcaster = StatsBroadcaster()
+        return _broadcaster
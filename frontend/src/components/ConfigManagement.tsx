@@ -20,6 +20,7 @@ export default function ConfigManagement({ onNotification }: ConfigManagementPro
   const [backups, setBackups] = useState<Backup[]>([])
   const [isLoading, setIsLoading] = useState(true)
   const [isApplying, setIsApplying] = useState(false)
+  const [applyPhase, setApplyPhase] = useState<string | null>(null)
   const [showConfirmRestore, setShowConfirmRestore] = useState<number | null>(null)
 
   const loadBackups = async () => {
@@ -39,19 +40,23 @@ export default function ConfigManagement({ onNotification }: ConfigManagementPro
   }, [])
 
   const handleApplyConfig = async () => {
-    if (!confirm('This will apply the current database configuration to HAProxy and restart the service. Continue?')) {
+    if (!confirm('This will apply the current database configuration to HAProxy and reload the service. Continue?')) {
       return
     }
 
     try {
       setIsApplying(true)
-      const result = await api.applyConfig()
+      const result = await api.applyConfig((job) => {
+        const running = job.phases?.find((phase: any) => phase.status === 'running')
+        setApplyPhase(running?.name || null)
+      })
       onNotification(result.message || 'Configuration applied successfully', 'success')
       await loadBackups()
     } catch (error: any) {
       onNotification(error.message || 'Failed to apply configuration', 'error')
     } finally {
       setIsApplying(false)
+      setApplyPhase(null)
     }
   }
 
@@ -102,7 +107,7 @@ export default function ConfigManagement({ onNotification }: ConfigManagementPro
               Apply Configuration
             </h3>
             <p style={{ fontSize: '0.875rem', color: '#94a3b8', marginBottom: '1rem' }}>
-              Generate HAProxy configuration from the database and restart the service.
+              Generate HAProxy configuration from the database and reload the service.
               A backup will be created automatically before applying changes.
             </p>
             <button
@@ -119,7 +124,7 @@ export default function ConfigManagement({ onNotification }: ConfigManagementPro
               }}
             >
               <Upload size={16} />
-              {isApplying ? 'Applying...' : 'Apply Configuration'}
+              {isApplying ? `Applying${applyPhase ? ` (${applyPhase})` : ''}...` : 'Apply Configuration'}
             </button>
           </div>
           <div style={{
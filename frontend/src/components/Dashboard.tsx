@@ -45,12 +45,33 @@ export default function Dashboard({ onLogout }: DashboardProps) {
     }
   }
 
+  const loadConfig = async () => {
+    try {
+      setConfig(await api.getConfig())
+    } catch (err: any) {
+      if (err.message === 'Unauthorized') {
+        onLogout()
+      }
+    }
+  }
+
   useEffect(() => {
     loadData()
 
-    // Refresh data every 5 seconds
-    const interval = setInterval(loadData, 5000)
-    return () => clearInterval(interval)
+    // Stats are pushed by the server; only the config is still polled
+    const closeStream = api.streamStats(
+      (statsData) => setStats(statsData),
+      (err) => {
+        if (err.message === 'Unauthorized') {
+          onLogout()
+        }
+      }
+    )
+    const interval = setInterval(loadConfig, 5000)
+    return () => {
+      closeStream()
+      clearInterval(interval)
+    }
   }, [])
 
   const showNotification = (message: string, type: 'success' | 'error') => {
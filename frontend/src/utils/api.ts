@@ -4,6 +4,30 @@
 
 const API_BASE_URL = '/api';
 
+/**
+ * Options of the list endpoints. Without limit or cursor the whole list is
+ * returned; with them the response also has next_cursor (null on the last
+ * page). name and address are prefix filters.
+ */
+export interface ListParams {
+  limit?: number;
+  cursor?: string;
+  fields?: string[];
+  name?: string;
+  address?: string;
+}
+
+const listQuery = (params?: ListParams) => {
+  const query = new URLSearchParams();
+  if (params?.limit) query.append('limit', params.limit.toString());
+  if (params?.cursor) query.append('cursor', params.cursor);
+  if (params?.fields?.length) query.append('fields', params.fields.join(','));
+  if (params?.name) query.append('name', params.name);
+  if (params?.address) query.append('address', params.address);
+  const encoded = query.toString();
+  return encoded ? `?${encoded}` : '';
+};
+
 class APIClient {
   private token: string | null = null;
 
@@ -98,8 +122,89 @@ class APIClient {
   }
 
   // Statistics
-  async getStats() {
-    return this.request('/stats');
+  async getStats(filters?: { backend?: string; frontend?: string; type?: string }) {
+    const params = new URLSearchParams();
+    if (filters?.backend) params.append('backend', filters.backend);
+    if (filters?.frontend) params.append('frontend', filters.frontend);
+    if (filters?.type) params.append('type', filters.type);
+
+    const query = params.toString();
+    return this.request(`/stats${query ? '?' + query : ''}`);
+  }
+
+  /**
+   * Subscribe to live stats over Server-Sent Events.
+   * The server sends a full snapshot first and then only the changed rows
+   * and fields; they are merged here so onStats always gets a full object.
+   * Returns a function that closes the stream.
+   */
+  streamStats(onStats: (stats: any) => void, onError?: (error: Error) => void): () => void {
+    const sections = ['frontends', 'backends', 'servers'] as const;
+    const rowKey = (section: string, row: any) =>
+      section === 'servers' ? `${row.backend}/${row.name}` : row.name;
+
+    let rows: Record<string, Map<string, any>> = {};
+    let summary: any = {};
+    let source: EventSource | null = null;
+    let closed = false;
+
+    const emit = () => {
+      const stats: any = { summary: { ...summary } };
+      for (const section of sections) {
+        stats[section] = Array.from(rows[section]?.values() || []);
+      }
+      onStats(stats);
+    };
+
+    const connect = async () => {
+      try {
+        const { ticket } = await this.request('/stats/stream/ticket', { method: 'POST' });
+        if (closed) return;
+
+        source = new EventSource(`${API_BASE_URL}/stats/stream?ticket=${encodeURIComponent(ticket)}`);
+
+        source.addEventListener('snapshot', (event) => {
+          const { stats } = JSON.parse((event as MessageEvent).data);
+          rows = {};
+          for (const section of sections) {
+            rows[section] = new Map((stats[section] || []).map((row: any) => [rowKey(section, row), row]));
+          }
+          summary = stats.summary || {};
+          emit();
+        });
+
+        source.addEventListener('delta', (event) => {
+          const delta = JSON.parse((event as MessageEvent).data);
+          for (const section of sections) {
+            const sectionRows = rows[section] || (rows[section] = new Map());
+            for (const [key, fields] of Object.entries(delta.changed?.[section] || {})) {
+              sectionRows.set(key, { ...sectionRows.get(key), ...(fields as any) });
+            }
+            for (const key of delta.removed?.[section] || []) {
+              sectionRows.delete(key);
+            }
+          }
+          summary = { ...summary, ...delta.summary };
+          emit();
+        });
+
+        source.onerror = () => {
+          // Tickets are single-use, so reconnect with a fresh one
+          source?.close();
+          if (!closed) setTimeout(connect, 5000);
+        };
+      } catch (err: any) {
+        onError?.(err);
+        if (!closed && err.message !== 'Unauthorized') setTimeout(connect, 5000);
+      }
+    };
+
+    connect();
+
+    return () => {
+      closed = true;
+      source?.close();
+    };
   }
 
   // Server management
@@ -110,14 +215,23 @@ class APIClient {
     });
   }
 
+  async setServersState(
+    changes: { backend: string; server: string; state: 'ready' | 'drain' | 'maint' | 'enable' | 'disable' }[]
+  ) {
+    return this.request('/servers/state', {
+      method: 'POST',
+      body: JSON.stringify({ changes }),
+    });
+  }
+
   // Health check
   async healthCheck() {
     return this.request('/health');
   }
 
   // User Management
-  async getUsers() {
-    return this.request('/users');
+  async getUsers(params?: ListParams) {
+    return this.request(`/users${listQuery(params)}`);
   }
 
   async createUser(username: string, password: string) {
@@ -141,8 +255,8 @@ class APIClient {
   }
 
   // Frontend Server Management
-  async getFrontends() {
-    return this.request('/frontends');
+  async getFrontends(params?: ListParams) {
+    return this.request(`/frontends${listQuery(params)}`);
   }
 
   async createFrontend(data: any) {
@@ -166,8 +280,8 @@ class APIClient {
   }
 
   // Backend Server Management
-  async getBackends() {
-    return this.request('/backends');
+  async getBackends(params?: ListParams) {
+    return this.request(`/backends${listQuery(params)}`);
   }
 
   async createBackend(data: any) {
@@ -204,8 +318,8 @@ class APIClient {
     });
   }
 
-  async deleteBackendServer(backendName: string, serverId: number) {
-    return this.request(`/backends/${backendName}/servers/${serverId}`, {
+  async deleteBackendServer(backendName: string, serverId: number, runtime = false) {
+    return this.request(`/backends/${backendName}/servers/${serverId}${runtime ? '?runtime=1' : ''}`, {
       method: 'DELETE',
     });
   }
@@ -221,25 +335,54 @@ class APIClient {
     return this.request(`/connections${query ? '?' + query : ''}`);
   }
 
-  async getActiveConnections() {
-    return this.request('/connections/active');
+  async getActiveConnections(params?: ListParams) {
+    return this.request(`/connections/active${listQuery(params)}`);
+  }
+
+  // Background jobs
+  async getJob(jobId: string) {
+    return this.request(`/jobs/${jobId}`);
+  }
+
+  /**
+   * Poll a background job until it finishes and return its result.
+   * onProgress gets the job status after every poll.
+   */
+  async waitForJob(jobId: string, onProgress?: (job: any) => void, interval = 500) {
+    for (;;) {
+      const job = await this.getJob(jobId);
+      onProgress?.(job);
+      if (job.status === 'succeeded') return job.result;
+      if (job.status === 'failed') throw new Error(job.result?.error || 'Job failed');
+      await new Promise((resolve) => setTimeout(resolve, interval));
+    }
   }
 
   // HAProxy Config Management
-  async applyConfig() {
-    return this.request('/haproxy/apply', {
+  async applyConfig(onProgress?: (job: any) => void) {
+    const { job_id } = await this.request('/haproxy/apply', {
       method: 'POST',
     });
+    return this.waitForJob(job_id, onProgress);
+  }
+
+  async getApplyPlan() {
+    return this.request('/haproxy/plan');
+  }
+
+  async getReloads() {
+    return this.request('/haproxy/reloads');
   }
 
-  async getBackups() {
-    return this.request('/haproxy/backups');
+  async getBackups(params?: ListParams) {
+    return this.request(`/haproxy/backups${listQuery(params)}`);
   }
 
-  async restoreBackup(backupId: number) {
-    return this.request(`/haproxy/backups/${backupId}/restore`, {
+  async restoreBackup(backupId: number, onProgress?: (job: any) => void) {
+    const { job_id } = await this.request(`/haproxy/backups/${backupId}/restore`, {
       method: 'POST',
     });
+    return this.waitForJob(job_id, onProgress);
   }
 }
 